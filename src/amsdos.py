@@ -0,0 +1,47 @@
+#!/usr/bin/env python
+
+"""
+AMSDOS.PY by Javier Garcia
+
+Builds the 128 bytes header that AMSDOS expects at the beginning of binary
+files, so they can be loaded in a CPC (or an emulator) with LOAD"FILE.BIN".
+
+offset  size  content
+0x00    1     user number
+0x01    8     file name (padded with spaces)
+0x09    3     extension (padded with spaces)
+0x12    1     file type (2 = binary)
+0x15    2     load address
+0x18    2     logical length
+0x1A    2     execution address
+0x40    3     real length
+0x43    2     checksum of bytes 0x00-0x42
+"""
+
+import struct
+
+AMSDOS_HEADER_SIZE = 128
+AMSDOS_BINARY = 2
+
+
+def parse_address(value):
+    """ Parses addresses written as 0xC000, &C000, #C000, $C000 or 49152 """
+    value = value.strip()
+    for prefix in ('&', '#', '$'):
+        if value.startswith(prefix):
+            return int(value[1:], 16)
+    return int(value, 0)
+
+
+def amsdos_header(filename, length, load=0x4000, execaddr=0, filetype=AMSDOS_BINARY):
+    if length > 0xFFFF:
+        raise ValueError("AMSDOS files can not be larger than 64K")
+    name, _, ext = filename.upper().partition('.')
+    header = bytearray(AMSDOS_HEADER_SIZE)
+    header[0x01:0x09] = name[:8].ljust(8).encode('ascii', 'replace')
+    header[0x09:0x0C] = ext[:3].ljust(3).encode('ascii', 'replace')
+    header[0x12] = filetype
+    struct.pack_into('<HxHH', header, 0x15, load & 0xFFFF, length, execaddr & 0xFFFF)
+    header[0x40:0x43] = length.to_bytes(3, 'little')
+    struct.pack_into('<H', header, 0x43, sum(header[0:0x43]) & 0xFFFF)
+    return bytes(header)
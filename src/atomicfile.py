@@ -0,0 +1,114 @@
+#!/usr/bin/env python
+
+"""
+ATOMICFILE.PY by Javier Garcia
+
+Files are written to a temporary file in the same directory that replaces
+the target at once (os.replace) when it is complete. Readers never see a
+half written file, and a failed or cancelled write leaves the old one as it
+was. atomic_update hashes the content while it is written and leaves the
+target untouched if it already had it. This module does not depend on
+tkinter.
+"""
+
+import contextlib
+import hashlib
+import os
+import tempfile
+
+# Bytes read at once when hashing files
+DIGEST_CHUNK = 1 << 20
+
+# mkstemp() creates private files, new outputs get the usual permissions instead
+_UMASK = os.umask(0)
+os.umask(_UMASK)
+
+
+def _temporary(filename):
+    """ Creates the temporary file that will replace filename, with its permissions """
+    folder = os.path.dirname(os.path.abspath(filename))
+    fd, tmpname = tempfile.mkstemp(dir=folder, prefix='.' + os.path.basename(filename), suffix='.tmp')
+    try:
+        os.chmod(tmpname, os.stat(filename).st_mode & 0o7777)
+    except OSError:
+        os.chmod(tmpname, 0o666 & ~_UMASK)
+    return fd, tmpname
+
+
+@contextlib.contextmanager
+def atomic_open(filename, mode='w'):
+    """ Opens a temporary file that replaces filename when closed without errors """
+    fd, tmpname = _temporary(filename)
+    try:
+        with os.fdopen(fd, mode) as stream:
+            yield stream
+        os.replace(tmpname, filename)
+    except BaseException:
+        os.unlink(tmpname)
+        raise
+
+
+def file_digest(filename, text=False):
+    """
+    Content hash of filename, read by chunks. With text the file is read in
+    text mode, matching the hash of what was written to a DigestWriter.
+    Returns None if the file can not be read.
+    """
+    digest = hashlib.blake2b(digest_size=16)
+    try:
+        with open(filename, 'r' if text else 'rb') as fd:
+            for chunk in iter(lambda: fd.read(DIGEST_CHUNK), '' if text else b''):
+                digest.update(chunk.encode() if text else chunk)
+    except (OSError, UnicodeDecodeError):
+        return None
+    return digest.hexdigest()
+
+
+class DigestWriter:
+    """ Stream that hashes everything written to it before passing it on """
+    def __init__(self, stream, text):
+        self.stream = stream
+        self.text = text
+        self.digest = hashlib.blake2b(digest_size=16)
+        self.replaced = False
+
+    def write(self, data):
+        self.digest.update(data.encode() if self.text else data)
+        return self.stream.write(data)
+
+    def writelines(self, lines):
+        for line in lines:
+            self.write(line)
+
+
+@contextlib.contextmanager
+def atomic_update(filename, mode='w'):
+    """
+    Like atomic_open, but the content is hashed while it is written and
+    filename is left untouched if it already had it. The stream (a
+    DigestWriter) tells in replaced whether the file was replaced.
+    """
+    fd, tmpname = _temporary(filename)
+    try:
+        with os.fdopen(fd, mode) as stream:
+            writer = DigestWriter(stream, 'b' not in mode)
+            yield writer
+        writer.replaced = file_digest(filename, writer.text) != writer.digest.hexdigest()
+        if writer.replaced:
+            os.replace(tmpname, filename)
+        else:
+            os.unlink(tmpname)
+    except BaseException:
+        if os.path.exists(tmpname):
+            os.unlink(tmpname)
+        raise
+
+
+def atomic_write(filename, data):
+    """
+    Writes data (str or bytes) to filename atomically. Returns False if the
+    file already had that content and was left untouched.
+    """
+    with atomic_update(filename, 'w' if isinstance(data, str) else 'wb') as fd:
+        fd.write(data)
+    return fd.replaced
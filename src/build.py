@@ -0,0 +1,70 @@
+#!/usr/bin/env python
+
+"""
+BUILD.PY by Javier Garcia
+
+Incremental builds for the command line interface. A cache file in the
+output directory (BUILD_CACHE) remembers for every input its modification
+time, size and content hash, and for every generated file the input, hash
+and options used to produce it. An output is only generated again when its
+input content, the options or the Tixel version change, or when the file is
+missing. Inputs whose time and size did not change are not read at all, so
+checking hundreds of projects only costs one stat() per file.
+
+Outputs are streamed to a temporary file that replaces the old one at once
+(os.replace, see atomicfile.py). Its content is hashed while it is written
+and files whose content does not change are not touched, so make and similar
+tools only see the files that really changed.
+"""
+
+import json
+import os
+from project import TIXEL_VERSION
+from atomicfile import atomic_open, file_digest
+
+BUILD_CACHE = '.tixel-build.json'
+
+
+class BuildCache:
+    def __init__(self, outdir):
+        self.filename = os.path.join(outdir, BUILD_CACHE)
+        self.inputs = {}    # input -> [mtime_ns, size, digest]
+        self.outputs = {}   # output -> [input, digest, options]
+        self.changed = False
+        try:
+            with open(self.filename) as fd:
+                data = json.load(fd)
+            if data.get('version') == TIXEL_VERSION:
+                self.inputs = data['inputs']
+                self.outputs = data['outputs']
+        except (OSError, ValueError, KeyError):
+            pass
+
+    def digest(self, filename):
+        """ Content hash of filename, only computed again if its time or size changed """
+        st = os.stat(filename)
+        entry = self.inputs.get(filename)
+        if entry is not None and entry[0] == st.st_mtime_ns and entry[1] == st.st_size:
+            return entry[2]
+        digest = file_digest(filename)
+        self.inputs[filename] = [st.st_mtime_ns, st.st_size, digest]
+        self.changed = True
+        return digest
+
+    def outdated(self, output, source, digest, options):
+        """ True if output must be generated again from source (with that digest) and options (a string) """
+        if self.outputs.get(output) != [source, digest, options]:
+            return True
+        return not os.path.exists(output)
+
+    def record(self, output, source, digest, options):
+        """ Remembers that output was generated from source (with that digest) and options """
+        self.outputs[output] = [source, digest, options]
+        self.changed = True
+
+    def save(self):
+        if self.changed:
+            data = {'version': TIXEL_VERSION, 'inputs': self.inputs, 'outputs': self.outputs}
+            with atomic_open(self.filename) as fd:
+                json.dump(data, fd)
+            self.changed = False
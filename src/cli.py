@@ -0,0 +1,385 @@
+#!/usr/bin/env python
+
+"""
+CLI.PY by Javier Garcia
+
+Headless command line interface to convert Tixel projects (.tpj) into C,
+assembly, BASIC or binary files without opening the editor. Projects are
+converted in parallel using a pool of processes:
+
+python3 src/cli.py -f c -f asm -o build/ -j 8 sprites/*.tpj
+
+The z80 format generates a compiled sprite (a Z80 routine that draws it) and
+reports its cost against a generic blit. Binary formats (bin and scr) can
+carry an AMSDOS header (--amsdos). The sprite data of every format but BASIC
+can be compressed with RLE or LZ (-c). Animations (-a) are exported as the
+first frame plus delta frames and large images can be exported as a tileset
+plus a tilemap (-t). PNG, BMP and PPM images are accepted too; they are
+imported for the screen mode given with --mode, reducing their colours to the
+best CPC palette (see imgimport.py). Large PPM, BMP and raw RGB images can be
+streamed straight into a binary file with bounded memory (--stream, see
+imgstream.py).
+
+With --build only the outputs whose project, options or Tixel version changed
+since the last run are generated again, and --watch keeps doing so every time
+a project changes (see build.py). Files are always replaced atomically and
+left untouched if their content does not change.
+"""
+
+import argparse
+import concurrent.futures
+import os
+import sys
+import time
+from pathlib import Path
+from imgconv import ImgConverter, ConversionError, SCREEN_ADDRESS, MASK_MODES, PIXELS_PER_BYTE
+from colormatch import METRICS
+from compress import COMPRESSORS
+from amsdos import amsdos_header, parse_address
+from project import load_project, TIXEL_VERSION
+from imgimport import import_image, IMAGE_EXTENSIONS, DITHERS
+from imgstream import ImageStream, stream_palette, convert_stream, STREAM_EXTENSIONS
+from build import BuildCache
+from atomicfile import atomic_update, atomic_write
+
+# format -> extension of the generated file
+FORMATS = {
+    'c':   '.c',
+    'asm': '.asm',
+    'bas': '.bas',
+    'bin': '.bin',
+    'scr': '.scr',
+    'z80': '.z80',
+}
+BINARY_FORMATS = ('bin', 'scr')
+# Default load address of sprites with an AMSDOS header
+SPRITE_ADDRESS = 0x4000
+# Options that change the generated files, checked by --build
+BUILD_OPTIONS = ('metric', 'compress', 'preshift', 'mask', 'inc_hl', 'anim', 'tiles', 'flips',
+                 'mode', 'dither', 'stream', 'raw_width', 'amsdos', 'load', 'exec')
+# Seconds between checks of the projects in --watch mode
+WATCH_INTERVAL = 0.5
+
+
+def output_path(filename, fmt, outdir):
+    return Path(outdir) / (Path(filename).stem + FORMATS[fmt])
+
+
+def write_binary(outfile, data, options, load):
+    """ Writes a binary file, with an AMSDOS header if requested """
+    if options.amsdos:
+        data = amsdos_header(outfile.name, len(data), load, options.exec) + data
+    atomic_write(outfile, data)
+
+
+def write_text(outfile, write, *args):
+    """ Streams the code generated by write(fd, *args) into outfile, replaced only if it changes """
+    with atomic_update(outfile) as fd:
+        write(fd, *args)
+
+
+def convert_project(filename, fmt, outdir, options, stream=None):
+    """
+    Converts one project into the requested format. Returns the path of the
+    generated file and the size report of the converter (None for BASIC).
+    It runs in the worker processes so it must be picklable. Text formats are
+    streamed to a temporary file that only replaces the output if its content
+    changes (see atomicfile.atomic_update), or to stream if given.
+    """
+    if options.stream:
+        return stream_image(filename, fmt, outdir, options)
+    if Path(filename).suffix.lower() in IMAGE_EXTENSIONS:
+        project = import_image(filename, options.mode, options.dither, options.metric)
+    else:
+        project = load_project(filename)
+    conv = ImgConverter(project.width, project.height, project.mode, options.metric, options.compress,
+                        options.preshift, project.transparent, options.mask, options.inc_hl,
+                        options.tiles, options.flips)
+    sprite = project.sprite.pixels
+    name = Path(filename).stem
+    if options.anim:
+        return convert_anim(conv, project, name, fmt, outdir, options, stream)
+    if options.tiles is not None:
+        return convert_tiles(conv, sprite, name, fmt, outdir, options, stream)
+    if fmt == 'z80':
+        report = conv.compiled_report
+    else:
+        report = conv.compression_report
+    if stream is not None:
+        conv.write_code(stream, fmt, sprite, name)
+        return '<stdout>', report()
+    outfile = output_path(filename, fmt, outdir)
+    if fmt in BINARY_FORMATS:
+        if fmt == 'bin':
+            data = conv.code_bin(sprite)
+            load = SPRITE_ADDRESS if options.load is None else options.load
+        else:
+            data = conv.code_scr(sprite)
+            load = SCREEN_ADDRESS if options.load is None else options.load
+        write_binary(outfile, data, options, load)
+    else:
+        write_text(outfile, conv.write_code, fmt, sprite, name)
+    return str(outfile), report()
+
+
+def convert_anim(conv, project, name, fmt, outdir, options, stream):
+    """ Exports all the frames of the project: the first one and the delta frames """
+    frames = [sprite.pixels for sprite in project.frames]
+    if stream is not None:
+        conv.write_anim(stream, fmt, frames, name)
+        return '<stdout>', conv.anim_report
+    outfile = Path(outdir) / (name + FORMATS[fmt])
+    if fmt == 'bin':
+        data = conv.code_anim_bin(frames)
+        load = SPRITE_ADDRESS if options.load is None else options.load
+        write_binary(outfile, data, options, load)
+    elif fmt in ('c', 'asm'):
+        write_text(outfile, conv.write_anim, fmt, frames, name)
+    else:
+        raise ConversionError(f"animations can not be exported in {fmt} format")
+    return str(outfile), conv.anim_report
+
+
+def convert_tiles(conv, sprite, name, fmt, outdir, options, stream):
+    """ Exports the image as a tileset of unique tiles and a tilemap """
+    if stream is not None:
+        conv.write_tiles(stream, fmt, sprite, name)
+        return '<stdout>', conv.tiles_report
+    outfile = Path(outdir) / (name + FORMATS[fmt])
+    if fmt == 'bin':
+        data = conv.code_tiles_bin(sprite)
+        load = SPRITE_ADDRESS if options.load is None else options.load
+        write_binary(outfile, data, options, load)
+    elif fmt in ('c', 'asm'):
+        write_text(outfile, conv.write_tiles, fmt, sprite, name)
+    else:
+        raise ConversionError(f"tilesets can not be exported in {fmt} format")
+    return str(outfile), conv.tiles_report
+
+
+def stream_image(filename, fmt, outdir, options):
+    """ Converts a large image into a binary file without loading it """
+    if fmt != 'bin' or Path(filename).suffix.lower() not in STREAM_EXTENSIONS:
+        raise ConversionError("only PPM, BMP and raw RGB images can be streamed, into bin files")
+    outfile = output_path(filename, fmt, outdir)
+    with ImageStream(filename, options.raw_width) as image:
+        palette = stream_palette(image, options.mode, options.metric)
+        ppb = PIXELS_PER_BYTE[options.mode]
+        size = (image.width + ppb - 1) // ppb * image.height
+        header = b''
+        if options.amsdos:
+            load = SPRITE_ADDRESS if options.load is None else options.load
+            header = amsdos_header(outfile.name, size, load, options.exec)
+        with atomic_update(outfile, 'wb') as fd:
+            fd.write(header)
+            convert_stream(image, options.mode, palette, fd, options.metric)
+        inks = ','.join(str(index) for index in palette)
+        return str(outfile), f"{image.width}x{image.height}, {size} bytes, inks {inks}"
+
+
+def parse_tile_size(value):
+    """ Parses tile sizes written as WxH (8x8, 16x8...) """
+    try:
+        width, height = value.lower().split('x')
+        return int(width), int(height)
+    except ValueError:
+        raise argparse.ArgumentTypeError(f"invalid tile size '{value}', use WxH")
+
+
+def print_result(project, outfile, report):
+    if report is None:
+        print(f"{project} -> {outfile}")
+    else:
+        print(f"{project} -> {outfile} ({report})")
+
+
+def collect_projects(paths):
+    """ Expands directories into the .tpj files they contain (images must be given one by one) """
+    projects = []
+    for path in paths:
+        if os.path.isdir(path):
+            projects.extend(sorted(str(p) for p in Path(path).glob('*.tpj')))
+        else:
+            projects.append(path)
+    return projects
+
+
+def parse_args(argv):
+    parser = argparse.ArgumentParser(
+        prog='tixel',
+        description='Converts Tixel projects into CPC source code or binary files.'
+    )
+    parser.add_argument('projects', nargs='+', help='.tpj files or directories containing them, or PNG/BMP/PPM images')
+    parser.add_argument('-f', '--format', action='append', choices=FORMATS.keys(),
+                        help='output format, can be repeated (default: c)')
+    parser.add_argument('-o', '--outdir', default='.', help='output directory (default: current one)')
+    parser.add_argument('-j', '--jobs', type=int, default=os.cpu_count() or 1,
+                        help='number of parallel processes (default: number of CPUs)')
+    parser.add_argument('-m', '--metric', choices=METRICS.keys(), default='manhattan',
+                        help='colour distance used to match the palette (default: manhattan)')
+    parser.add_argument('-c', '--compress', choices=COMPRESSORS.keys(), default=None,
+                        help='compress the sprite data (not available for bas)')
+    parser.add_argument('-s', '--preshift', action='store_true',
+                        help='emit one pre-shifted copy of the sprite per pixel offset (c, asm and bin)')
+    parser.add_argument('--mask', choices=MASK_MODES, default=None,
+                        help='emit AND masks for the transparent colour of the project, '
+                             'interleaved with the data or as a separate table (c, asm and bin)')
+    parser.add_argument('--inc-hl', action='store_true',
+                        help='compiled sprites (z80) walk rows with INC HL, slower but valid at any address')
+    parser.add_argument('-a', '--anim', action='store_true',
+                        help='export all the frames: the first one and then only the changed bytes (c, asm and bin)')
+    parser.add_argument('-t', '--tiles', type=parse_tile_size, default=None, metavar='WxH',
+                        help='export a tileset of unique WxH pixel tiles and a tilemap (c, asm and bin)')
+    parser.add_argument('--flips', action='store_true',
+                        help='tileset: reuse tiles that are mirrors of other ones')
+    parser.add_argument('--mode', type=int, choices=(0, 1, 2), default=1,
+                        help='screen mode used to import images (default: 1)')
+    parser.add_argument('--dither', choices=DITHERS, default='none',
+                        help='dithering used to import images (default: none)')
+    parser.add_argument('--stream', action='store_true',
+                        help='convert large PPM, BMP or raw RGB images into bin files reading them by bands')
+    parser.add_argument('--raw-width', type=int, default=None, metavar='W',
+                        help='width in pixels of raw RGB (.rgb) images')
+    parser.add_argument('--amsdos', action='store_true', help='add an AMSDOS header to binary files')
+    parser.add_argument('--load', type=parse_address, default=None,
+                        help='load address for the AMSDOS header (default: &4000 for bin, &C000 for scr)')
+    parser.add_argument('--exec', type=parse_address, default=0,
+                        help='execution address for the AMSDOS header (default: 0)')
+    parser.add_argument('-q', '--quiet', action='store_true', help='only report errors')
+    parser.add_argument('--stdout', action='store_true',
+                        help='stream the generated source code to the standard output instead of files')
+    parser.add_argument('-b', '--build', action='store_true',
+                        help='only convert the projects whose outputs are missing or outdated')
+    parser.add_argument('-w', '--watch', action='store_true',
+                        help='keep building the projects every time they change, until interrupted')
+    parser.add_argument('--interval', type=float, default=WATCH_INTERVAL, metavar='SECONDS',
+                        help=f'time between checks of the projects in watch mode (default: {WATCH_INTERVAL})')
+    parser.add_argument('--version', action='version', version=f'%(prog)s {TIXEL_VERSION}')
+    return parser.parse_args(argv)
+
+
+def run_tasks(tasks, args, done=None):
+    """
+    Converts the (project, format) pairs of tasks, calling done(project, format)
+    after every file generated. Returns the number of errors.
+    """
+    pooled = args.jobs > 1 and len(tasks) > 1 and not args.stdout
+    errors = 0
+    if args.stdout:
+        for prj, fmt in tasks:
+            try:
+                convert_project(prj, fmt, args.outdir, args, sys.stdout)
+            except Exception as e:
+                print(f"{prj}: error: {e}", file=sys.stderr)
+                errors = errors + 1
+    elif pooled:
+        with concurrent.futures.ProcessPoolExecutor(max_workers=args.jobs) as pool:
+            futures = {
+                pool.submit(convert_project, prj, fmt, args.outdir, args): (prj, fmt)
+                for prj, fmt in tasks
+            }
+            for future in concurrent.futures.as_completed(futures):
+                prj, fmt = futures[future]
+                try:
+                    outfile, report = future.result()
+                    if not args.quiet:
+                        print_result(prj, outfile, report)
+                    if done is not None:
+                        done(prj, fmt)
+                except Exception as e:
+                    print(f"{prj}: error: {e}", file=sys.stderr)
+                    errors = errors + 1
+    else:
+        for prj, fmt in tasks:
+            try:
+                outfile, report = convert_project(prj, fmt, args.outdir, args)
+                if not args.quiet:
+                    print_result(prj, outfile, report)
+                if done is not None:
+                    done(prj, fmt)
+            except Exception as e:
+                print(f"{prj}: error: {e}", file=sys.stderr)
+                errors = errors + 1
+    return errors
+
+
+def build(args, formats, cache, failed=None):
+    """
+    Converts only the projects whose outputs are missing or outdated according
+    to cache. failed maps the tasks that failed in previous passes (--watch) to
+    the state of their project, they are not tried again until it changes.
+    Returns the number of errors and of outputs that were up to date.
+    """
+    options = repr([getattr(args, name) for name in BUILD_OPTIONS])
+    tasks = []
+    digests = {}
+    for prj in collect_projects(args.projects):
+        try:
+            digests[prj] = cache.digest(prj)
+        except OSError:
+            digests[prj] = None
+        for fmt in formats:
+            outfile = str(output_path(prj, fmt, args.outdir))
+            if digests[prj] is not None and not cache.outdated(outfile, prj, digests[prj], options):
+                continue
+            if failed is not None and failed.get((prj, fmt), False) == cache.inputs.get(prj):
+                continue
+            tasks.append((prj, fmt))
+
+    def done(prj, fmt):
+        cache.record(str(output_path(prj, fmt, args.outdir)), prj, digests[prj], options)
+        if failed is not None:
+            failed.pop((prj, fmt), None)
+
+    errors = run_tasks(tasks, args, done)
+    if failed is not None:
+        for prj, fmt in tasks:
+            outfile = str(output_path(prj, fmt, args.outdir))
+            if cache.outputs.get(outfile) != [prj, digests[prj], options]:
+                failed[(prj, fmt)] = cache.inputs.get(prj)
+    cache.save()
+    skipped = len(digests) * len(formats) - len(tasks)
+    return errors, skipped
+
+
+def watch(args, formats):
+    """ Builds the projects every time one of them changes, until interrupted """
+    cache = BuildCache(args.outdir)
+    failed = {}
+    if not args.quiet:
+        print(f"watching {', '.join(args.projects)} (Ctrl+C to stop)")
+    try:
+        while True:
+            build(args, formats, cache, failed)
+            time.sleep(args.interval)
+    except KeyboardInterrupt:
+        cache.save()
+    return 0
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    formats = args.format or ['c']
+    if args.stdout:
+        if any(fmt in BINARY_FORMATS for fmt in formats):
+            print("error: binary output can not be sent to stdout", file=sys.stderr)
+            return 1
+        if args.build or args.watch:
+            print("error: --build and --watch write files, they can not be used with --stdout", file=sys.stderr)
+            return 1
+    else:
+        os.makedirs(args.outdir, exist_ok=True)
+    if args.watch:
+        return watch(args, formats)
+    if args.build:
+        errors, skipped = build(args, formats, BuildCache(args.outdir))
+        if not args.quiet and skipped > 0:
+            print(f"{skipped} outputs up to date")
+    else:
+        projects = collect_projects(args.projects)
+        errors = run_tasks([(prj, fmt) for prj in projects for fmt in formats], args)
+    return 1 if errors > 0 else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,135 @@
+#!/usr/bin/env python
+
+"""
+COLORMATCH.PY by Javier Garcia
+
+Nearest colour search used to convert arbitrary RGB values into one of the
+colours of a palette. Each ColorResolver is built for one palette and caches
+every colour it resolves (keyed by its packed 24-bit 0xRRGGBB value) so each
+different colour of an image is only searched once. Optionally it can build a
+full lookup table of 15 or 18 bits (5 or 6 bits per channel) up front.
+
+Available distance metrics:
+manhattan - |r1-r2| + |g1-g2| + |b1-b2| (the classic Tixel metric)
+weighted  - euclidean distance weighted by the "redmean" approximation
+cielab    - CIE76 delta E computed in the CIELAB colour space
+"""
+
+import math
+
+
+def _identity(rgb):
+    return rgb
+
+def _manhattan(c1, c2):
+    return abs(c1[0] - c2[0]) + abs(c1[1] - c2[1]) + abs(c1[2] - c2[2])
+
+def _weighted(c1, c2):
+    rmean = (c1[0] + c2[0]) / 2
+    dr = c1[0] - c2[0]
+    dg = c1[1] - c2[1]
+    db = c1[2] - c2[2]
+    return math.sqrt((2 + rmean / 256) * dr * dr + 4 * dg * dg + (2 + (255 - rmean) / 256) * db * db)
+
+def _linear(channel):
+    c = channel / 255
+    return c / 12.92 if c <= 0.04045 else ((c + 0.055) / 1.055) ** 2.4
+
+def _lab_f(t):
+    return t ** (1 / 3) if t > 0.008856 else 7.787 * t + 16 / 116
+
+def rgb2lab(rgb):
+    """ Converts a (r, g, b) sRGB colour into a (L, a, b) CIELAB one (D65) """
+    r, g, b = (_linear(c) for c in rgb)
+    x = (r * 0.4124 + g * 0.3576 + b * 0.1805) / 0.95047
+    y = (r * 0.2126 + g * 0.7152 + b * 0.0722)
+    z = (r * 0.0193 + g * 0.1192 + b * 0.9505) / 1.08883
+    fx, fy, fz = _lab_f(x), _lab_f(y), _lab_f(z)
+    return (116 * fy - 16, 500 * (fx - fy), 200 * (fy - fz))
+
+def _cielab(c1, c2):
+    return math.sqrt((c1[0] - c2[0]) ** 2 + (c1[1] - c2[1]) ** 2 + (c1[2] - c2[2]) ** 2)
+
+# name -> (transform applied to the colours, distance between transformed colours)
+METRICS = {
+    'manhattan': (_identity, _manhattan),
+    'weighted':  (_identity, _weighted),
+    'cielab':    (rgb2lab, _cielab),
+}
+
+
+def pack_rgb(r, g, b):
+    return (r << 16) | (g << 8) | b
+
+
+class ColorResolver:
+    def __init__(self, colors, metric='manhattan', lut_bits=0):
+        """
+        colors is the list of (r, g, b) palette entries. lut_bits can be 15 or
+        18 to precompute the whole colour space at that precision.
+        """
+        if metric not in METRICS:
+            raise ValueError(f"unknown colour metric '{metric}'")
+        self.colors = list(colors)
+        self.metric = metric
+        self.transform, self.distance = METRICS[metric]
+        self.targets = [self.transform(c) for c in self.colors]
+        self.cache = {}
+        self.hexcache = {}
+        self.lut = None
+        self.lut_shift = 0
+        if lut_bits:
+            self._build_lut(lut_bits)
+
+    def nearest(self, rgb):
+        """ Returns (distance, index) of the palette colour nearest to rgb """
+        value = self.transform(rgb)
+        nearest = None
+        for i, target in enumerate(self.targets):
+            diff = self.distance(value, target)
+            if nearest is None or diff < nearest[0]:
+                nearest = (diff, i)
+        return nearest
+
+    def _build_lut(self, bits):
+        if bits not in (15, 18):
+            raise ValueError("the colour lookup table must be of 15 or 18 bits")
+        chbits = bits // 3
+        self.lut_shift = 8 - chbits
+        levels = 1 << chbits
+        # each entry is resolved using the centre of the quantization bucket
+        half = 1 << (self.lut_shift - 1)
+        centres = [min(255, (v << self.lut_shift) + half) for v in range(levels)]
+        lut = bytearray(levels ** 3)
+        i = 0
+        for r in centres:
+            for g in centres:
+                for b in centres:
+                    lut[i] = self.nearest((r, g, b))[1]
+                    i = i + 1
+        self.lut = lut
+
+    def resolve(self, packed):
+        """ Returns the palette index for a packed 0xRRGGBB colour """
+        index = self.cache.get(packed)
+        if index is None:
+            r, g, b = (packed >> 16) & 0xFF, (packed >> 8) & 0xFF, packed & 0xFF
+            if self.lut is not None:
+                shift = self.lut_shift
+                chbits = 8 - shift
+                index = self.lut[(((r >> shift) << chbits | (g >> shift)) << chbits) | (b >> shift)]
+            else:
+                index = self.nearest((r, g, b))[1]
+            self.cache[packed] = index
+        return index
+
+    def resolve_rgb(self, rgb):
+        return self.resolve(pack_rgb(rgb[0], rgb[1], rgb[2]))
+
+    def resolve_hex(self, hexcol):
+        """ Returns the palette index for a "#RRGGBB" colour """
+        index = self.hexcache.get(hexcol)
+        if index is None:
+            index = self.resolve(int(hexcol.lstrip('#'), 16))
+            self.hexcache[hexcol] = index
+        return index
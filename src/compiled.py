@@ -0,0 +1,201 @@
+#!/usr/bin/env python
+
+"""
+COMPILED.PY by Javier Garcia
+
+Generates compiled sprites: a Z80 routine that draws one sprite writing every
+byte with immediate values, so there is no data to read and no loop to run.
+
+The routine expects HL pointing to the screen byte of the top left corner of
+the sprite and uses the default screen layout (&C000, 80 bytes per line). Rows
+are walked in zigzag (left to right, then right to left) so there is no need
+to go back to the start of the row before moving to the next line. Bytes with
+all their pixels transparent are skipped, partially transparent ones are
+drawn with AND/OR and the most repeated values are kept in B, C, D and E.
+
+Costs are given in T-states and in NOPs (microseconds), the unit usually used
+on the CPC as the gate array rounds every instruction to multiples of 4 T.
+Moving along the row with INC L/DEC L is faster than INC HL/DEC HL but the
+rows of the sprite must not cross a 256 bytes boundary; safe mode uses the
+16 bit versions.
+"""
+
+# instruction -> (T-states, NOPs, bytes)
+Z80_COSTS = {
+    'ld (hl),n': (10, 3, 2),
+    'ld (hl),r': (7, 2, 1),
+    'ld r,n':    (7, 2, 2),
+    'ld rr,nn':  (10, 3, 3),
+    'ld a,(hl)': (7, 2, 1),
+    'ld (hl),a': (7, 2, 1),
+    'ld a,r':    (4, 1, 1),
+    'ld r,a':    (4, 1, 1),
+    'and n':     (7, 2, 2),
+    'or n':      (7, 2, 2),
+    'add a,n':   (7, 2, 2),
+    'adc a,n':   (7, 2, 2),
+    'inc l':     (4, 1, 1),
+    'dec l':     (4, 1, 1),
+    'inc hl':    (6, 2, 1),
+    'dec hl':    (6, 2, 1),
+    'jr taken':  (12, 3, 2),
+    'jr':        (7, 2, 2),
+    'push':      (11, 4, 1),
+    'pop':       (10, 3, 1),
+    'ldi':       (16, 5, 2),
+    'ldir':      (21, 6, 2),
+    'djnz':      (13, 4, 2),
+    'djnz end':  (8, 3, 2),
+    'ret':       (10, 3, 1),
+}
+
+# Registers that can hold repeated values (A is needed for masks and line changes)
+VALUE_REGISTERS = ('b', 'c', 'd', 'e')
+
+# Next line: only one of every 8 lines needs to move to the next character row
+NEXT_LINE_SHORT = ('ld a,r', 'add a,n', 'ld r,a', 'and n', 'jr taken')
+NEXT_LINE_LONG = ('ld a,r', 'add a,n', 'ld r,a', 'and n', 'jr',
+                  'ld a,r', 'add a,n', 'ld r,a', 'ld a,r', 'adc a,n', 'ld r,a')
+
+
+def _cost(keys):
+    tstates = 0
+    nops = 0
+    for key in keys:
+        tstates = tstates + Z80_COSTS[key][0]
+        nops = nops + Z80_COSTS[key][1]
+    return tstates, nops
+
+
+def next_line_cost():
+    """ Average cost of moving HL to the next pixel line """
+    short = _cost(NEXT_LINE_SHORT)
+    long = _cost(NEXT_LINE_LONG)
+    return (short[0] * 7 + long[0]) / 8, (short[1] * 7 + long[1]) / 8
+
+
+def generic_cost(width, height, masked=False):
+    """
+    Estimated cost of drawing the sprite with a generic routine reading the
+    data: LDIR for opaque sprites and a byte loop with AND/OR for masked ones.
+    Every row also pays PUSH/POP HL and the move to the next line.
+    """
+    line_t, line_n = next_line_cost()
+    if masked:
+        # ld a,(de) / and (hl)... with two pointers: ~52 T (15 NOPs) plus DJNZ
+        byte = (52 + Z80_COSTS['djnz'][0], 15 + Z80_COSTS['djnz'][1])
+        row_t = byte[0] * width + _cost(('push', 'pop', 'ld r,n'))[0]
+        row_n = byte[1] * width + _cost(('push', 'pop', 'ld r,n'))[1]
+    else:
+        row = _cost(('push', 'pop', 'ld rr,nn'))
+        row_t = row[0] + Z80_COSTS['ldir'][0] * (width - 1) + Z80_COSTS['ldi'][0]
+        row_n = row[1] + Z80_COSTS['ldir'][1] * (width - 1) + Z80_COSTS['ldi'][1]
+    tstates = row_t * height + line_t * (height - 1) + Z80_COSTS['ret'][0]
+    nops = row_n * height + line_n * (height - 1) + Z80_COSTS['ret'][1]
+    return round(tstates), round(nops)
+
+
+class CompiledSprite:
+    """
+    Z80 routine drawing one sprite. rows is a list with a list of (mask, data)
+    pairs per row of the sprite, mask being the AND mask of the byte (0x00 for
+    opaque bytes, 0xFF for fully transparent ones).
+    """
+    def __init__(self, rows, label, safe=False):
+        self.rows = rows
+        self.label = label
+        self.safe = safe
+        self.tstates = 0
+        self.nops = 0
+        self.size = 0
+        self.lines = []
+        self.registers = self._assign_registers()
+        self._build()
+
+    def _assign_registers(self):
+        """ Keeps in registers the opaque values used more than twice """
+        counts = {}
+        for row in self.rows:
+            for mask, data in row:
+                if mask == 0x00:
+                    counts[data] = counts.get(data, 0) + 1
+        # loading a register costs 2 NOPs, each use saves 1 NOP
+        values = sorted((v for v in counts if counts[v] > 2), key=lambda v: (-counts[v], v))
+        return {value: reg for value, reg in zip(values, VALUE_REGISTERS)}
+
+    def _emit(self, code, key, timed=True):
+        self.lines.append('\t' + code)
+        tstates, nops, size = Z80_COSTS[key]
+        self.size = self.size + size
+        if timed:
+            self.tstates = self.tstates + tstates
+            self.nops = self.nops + nops
+
+    def _load_registers(self):
+        regs = {reg: value for value, reg in self.registers.items()}
+        for pair in ('bc', 'de'):
+            high, low = pair[0], pair[1]
+            if high in regs and low in regs:
+                self._emit(f"ld {pair},&{regs[high]:02X}{regs[low]:02X}", 'ld rr,nn')
+            elif high in regs:
+                self._emit(f"ld {high},&{regs[high]:02X}", 'ld r,n')
+            elif low in regs:
+                self._emit(f"ld {low},&{regs[low]:02X}", 'ld r,n')
+
+    def _move(self, steps):
+        if steps > 0:
+            inc = 'inc hl' if self.safe else 'inc l'
+            for _ in range(steps):
+                self._emit(inc, inc)
+        elif steps < 0:
+            dec = 'dec hl' if self.safe else 'dec l'
+            for _ in range(-steps):
+                self._emit(dec, dec)
+
+    def _write(self, mask, data):
+        if mask == 0x00:
+            if data in self.registers:
+                self._emit(f"ld (hl),{self.registers[data]}", 'ld (hl),r')
+            else:
+                self._emit(f"ld (hl),&{data:02X}", 'ld (hl),n')
+        else:
+            self._emit("ld a,(hl)", 'ld a,(hl)')
+            self._emit(f"and &{mask:02X}", 'and n')
+            if data != 0x00:
+                self._emit(f"or &{data:02X}", 'or n')
+            self._emit("ld (hl),a", 'ld (hl),a')
+
+    def _next_line(self, y):
+        """ Moves HL one pixel line down in the default screen layout """
+        label = f"{self.label}_l{y}"
+        code = ("ld a,h", "add a,&08", "ld h,a", "and &38", f"jr nz,{label}",
+                "ld a,l", "add a,&50", "ld l,a", "ld a,h", "adc a,&C0", "ld h,a")
+        # timing is added later using the average of short and long paths
+        for line, key in zip(code, NEXT_LINE_LONG):
+            self._emit(line, key, False)
+        self.lines.append(f"{label}:")
+
+    def _build(self):
+        self._load_registers()
+        column = 0
+        for y, row in enumerate(self.rows):
+            order = range(len(row)) if y % 2 == 0 else range(len(row) - 1, -1, -1)
+            for x in order:
+                mask, data = row[x]
+                if mask == 0xFF:
+                    continue
+                self._move(x - column)
+                column = x
+                self._write(mask, data)
+            if y < len(self.rows) - 1:
+                self._next_line(y)
+        self._emit("ret", 'ret')
+        # next line jumps are accounted with their average cost
+        line_t, line_n = next_line_cost()
+        self.tstates = round(self.tstates + line_t * (len(self.rows) - 1))
+        self.nops = round(self.nops + line_n * (len(self.rows) - 1))
+
+    def iter_code(self):
+        yield f"{self.label}:\n"
+        for line in self.lines:
+            yield line + '\n'
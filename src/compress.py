@@ -0,0 +1,176 @@
+#!/usr/bin/env python
+
+"""
+COMPRESS.PY by Javier Garcia
+
+Simple byte oriented compressors for the exported sprite data. Both formats
+are easy (and fast) to decompress on a Z80:
+
+RLE stream, a sequence of blocks:
+0x00          end of data
+0x01 - 0x7F   n literal bytes follow
+0x80 - 0xFF   the next byte is repeated (n & 0x7F) + RLE_MIN_RUN times
+
+LZ stream (LZ77 family), a sequence of blocks:
+0x00          end of data
+0x01 - 0x7F   n literal bytes follow
+0x80 - 0xFF   copy (n & 0x7F) + LZ_MIN_MATCH bytes from the already decoded
+              data. It is followed by the distance (1-65535) back from the
+              current position as a little-endian word, so the decoder can
+              do HL = DE - distance and LDIR (the copy may overlap).
+
+The LZ encoder finds matches through hash chains over 3-byte prefixes, so its
+cost stays linear even on full screens.
+"""
+
+from array import array
+
+RLE_MIN_RUN = 3
+RLE_MAX_RUN = 0x7F + RLE_MIN_RUN
+MAX_LITERALS = 0x7F
+LZ_MIN_MATCH = 4
+LZ_MAX_MATCH = 0x7F + LZ_MIN_MATCH
+LZ_WINDOW = 0xFFFF
+LZ_MAX_CHAIN = 32
+END_MARK = 0x00
+
+
+def _flush_literals(out, data, start, end):
+    while start < end:
+        count = min(MAX_LITERALS, end - start)
+        out.append(count)
+        out.extend(data[start:start + count])
+        start = start + count
+
+
+def rle_encode(data):
+    data = bytes(data)
+    out = bytearray()
+    literals = 0
+    pos = 0
+    while pos < len(data):
+        value = data[pos]
+        run = 1
+        while pos + run < len(data) and run < RLE_MAX_RUN and data[pos + run] == value:
+            run = run + 1
+        if run >= RLE_MIN_RUN:
+            _flush_literals(out, data, literals, pos)
+            out.append(0x80 | (run - RLE_MIN_RUN))
+            out.append(value)
+            pos = pos + run
+            literals = pos
+        else:
+            pos = pos + run
+    _flush_literals(out, data, literals, len(data))
+    out.append(END_MARK)
+    return out
+
+
+def rle_decode(data):
+    out = bytearray()
+    pos = 0
+    while data[pos] != END_MARK:
+        token = data[pos]
+        if token & 0x80:
+            out.extend(bytes([data[pos + 1]]) * ((token & 0x7F) + RLE_MIN_RUN))
+            pos = pos + 2
+        else:
+            out.extend(data[pos + 1:pos + 1 + token])
+            pos = pos + 1 + token
+    return out
+
+
+def _match_length(data, cand, pos, limit):
+    length = 0
+    # compare in chunks first, slices are compared at C speed
+    while length + 16 <= limit and data[cand + length:cand + length + 16] == data[pos + length:pos + length + 16]:
+        length = length + 16
+    while length < limit and data[cand + length] == data[pos + length]:
+        length = length + 1
+    return length
+
+
+def lz_encode(data, max_chain=LZ_MAX_CHAIN):
+    data = bytes(data)
+    size = len(data)
+    out = bytearray()
+    head = {}                       # 3-byte prefix -> last position where it was seen
+    chain = array('i', [-1]) * size  # position -> previous position with the same prefix
+    literals = 0
+    pos = 0
+
+    def insert(p):
+        if p + 3 <= size:
+            key = data[p:p + 3]
+            chain[p] = head.get(key, -1)
+            head[key] = p
+
+    while pos < size:
+        best_len = 0
+        best_dist = 0
+        if pos + LZ_MIN_MATCH <= size:
+            limit = min(LZ_MAX_MATCH, size - pos)
+            cand = head.get(data[pos:pos + 3], -1)
+            tries = max_chain
+            while cand >= 0 and pos - cand <= LZ_WINDOW and tries > 0:
+                # a candidate can only be better if it matches the byte that ends the best match
+                if data[cand + best_len] == data[pos + best_len]:
+                    length = _match_length(data, cand, pos, limit)
+                    if length > best_len:
+                        best_len = length
+                        best_dist = pos - cand
+                        if length == limit:
+                            break
+                cand = chain[cand]
+                tries = tries - 1
+        if best_len >= LZ_MIN_MATCH:
+            _flush_literals(out, data, literals, pos)
+            out.append(0x80 | (best_len - LZ_MIN_MATCH))
+            out.append(best_dist & 0xFF)
+            out.append(best_dist >> 8)
+            for p in range(pos, pos + best_len):
+                insert(p)
+            pos = pos + best_len
+            literals = pos
+        else:
+            insert(pos)
+            pos = pos + 1
+    _flush_literals(out, data, literals, size)
+    out.append(END_MARK)
+    return out
+
+
+def lz_decode(data):
+    out = bytearray()
+    pos = 0
+    while data[pos] != END_MARK:
+        token = data[pos]
+        if token & 0x80:
+            length = (token & 0x7F) + LZ_MIN_MATCH
+            start = len(out) - (data[pos + 1] | data[pos + 2] << 8)
+            for i in range(length):
+                out.append(out[start + i])
+            pos = pos + 3
+        else:
+            out.extend(data[pos + 1:pos + 1 + token])
+            pos = pos + 1 + token
+    return out
+
+
+# method -> (encoder, decoder)
+COMPRESSORS = {
+    'rle': (rle_encode, rle_decode),
+    'lz':  (lz_encode, lz_decode),
+}
+
+
+def compress(data, method):
+    if method not in COMPRESSORS:
+        raise ValueError(f"unknown compression method '{method}'")
+    return COMPRESSORS[method][0](data)
+
+
+def decompress(data, method):
+    if method not in COMPRESSORS:
+        raise ValueError(f"unknown compression method '{method}'")
+    return COMPRESSORS[method][1](data)
@@ -0,0 +1,159 @@
+#!/usr/bin/env python
+
+"""
+CONVCACHE.PY by Javier Garcia
+
+Cache of conversions shared by the converters created by the editor. Images
+are identified by a hash of their colour indices plus the settings that
+change the result (mode, size, colour metric and the transparent colour when
+the output honours it):
+
+- if the image was converted before, its palette, pens and video bytes are
+  reused as they are
+- if it differs from the last image converted with the same settings but
+  the palette does not change (the usual case while drawing), only the
+  changed pixels are resolved again and only their video bytes re-packed
+- otherwise the image is converted from scratch
+
+The generated source code is cached too, keyed by the image, the format and
+the converter options. After build(), changed holds the offsets of the video
+bytes that differ from the last image built with the same settings (None if
+the palette changed or there was no such image), so views can be updated
+incrementally.
+"""
+
+import hashlib
+from collections import OrderedDict
+from imgconv import PACK_TABLES, PIXELS_PER_BYTE
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+# Images and generated sources kept
+CACHE_ENTRIES = 16
+# Above this fraction of changed pixels the image is converted again
+INCREMENTAL_LIMIT = 0.25
+
+
+def _differences(old, new, width):
+    """ Offsets where the buffers old and new (same size) differ, compared by rows of width """
+    if np is not None:
+        a = np.frombuffer(old, dtype=np.uint8)
+        b = np.frombuffer(new, dtype=np.uint8)
+        return np.flatnonzero(a != b).tolist()
+    changed = []
+    for start in range(0, len(new), width):
+        end = start + width
+        if old[start:end] != new[start:end]:
+            changed.extend(i for i in range(start, end) if old[i] != new[i])
+    return changed
+
+
+class CachedImage:
+    def __init__(self, indices, palette, img, alpha, packed):
+        self.indices = indices
+        self.palette = palette
+        self.img = img
+        self.alpha = alpha
+        self.packed = packed
+
+
+class ConversionCache:
+    def __init__(self, entries=CACHE_ENTRIES):
+        self.entries = entries
+        self.images = OrderedDict()   # key -> CachedImage
+        self.last = {}                # settings -> key of the last image converted
+        self.sources = OrderedDict()  # (key, format, options, name) -> source code
+        self.changed = None
+        self.hits = 0
+        self.partial = 0
+        self.full = 0
+
+    def _settings(self, conv):
+        return (conv.mode, conv.imgw, conv.imgh, conv._transparent_index(), conv.metric)
+
+    def _key(self, conv, indices):
+        return self._settings(conv) + (hashlib.blake2b(indices, digest_size=16).digest(),)
+
+    def _store(self, table, key, value):
+        table[key] = value
+        table.move_to_end(key)
+        while len(table) > self.entries:
+            table.popitem(last=False)
+
+    def build(self, conv, sprite):
+        """ Sets the palette, img, alpha and packed of the converter conv for sprite """
+        indices = bytes(conv._indices(sprite))
+        key = self._key(conv, indices)
+        entry = self.images.get(key)
+        previous = self.images.get(self.last.get(key[:-1]))
+        if entry is not None:
+            self.images.move_to_end(key)
+            self.hits = self.hits + 1
+            if entry is previous:
+                self.changed = []
+            elif previous is not None and previous.palette == entry.palette:
+                self.changed = _differences(previous.packed, entry.packed, conv.imgw)
+            else:
+                self.changed = None
+        else:
+            conv._build_palette([indices])
+            self.changed = None
+            if previous is not None and previous.palette == conv.palette:
+                entry = self._update(conv, previous, indices)
+            if entry is None:
+                conv._resolve(indices)
+                conv._img2mode()
+                entry = CachedImage(indices, list(conv.palette), bytes(conv.img), bytes(conv.alpha), bytes(conv.packed))
+                self.full = self.full + 1
+            self._store(self.images, key, entry)
+        self.last[key[:-1]] = key
+        conv.palette = list(entry.palette)
+        conv.img = bytearray(entry.img)
+        conv.alpha = bytearray(entry.alpha)
+        conv.packed = entry.packed
+
+    def _update(self, conv, previous, indices):
+        """ New entry from previous re-packing only the bytes of the changed pixels """
+        changed = _differences(previous.indices, indices, conv.imgw)
+        if len(changed) > len(indices) * INCREMENTAL_LIMIT:
+            return None
+        pens, flags = conv._pen_tables()
+        img = bytearray(previous.img)
+        alpha = bytearray(previous.alpha)
+        for i in changed:
+            img[i] = pens[indices[i]]
+            alpha[i] = flags[indices[i]]
+        ppb = PIXELS_PER_BYTE[conv.mode]
+        tables = PACK_TABLES[conv.mode]
+        packed = bytearray(previous.packed)
+        rewritten = sorted(set(i // ppb for i in changed))
+        for offset in rewritten:
+            value = 0
+            for pos, pen in enumerate(img[offset * ppb:(offset + 1) * ppb]):
+                value = value | tables[pos][pen]
+            packed[offset] = value
+        self.changed = rewritten
+        self.partial = self.partial + 1
+        return CachedImage(indices, previous.palette, bytes(img), bytes(alpha), bytes(packed))
+
+    def source(self, conv, fmt, sprite, name, emitter):
+        """
+        Returns the source code generated by emitter(sprite, name), one of the
+        iter_* methods of conv, reusing it if nothing changed since last time.
+        """
+        indices = bytes(conv._indices(sprite))
+        options = (conv.compression, conv.preshift, conv.masked, conv.inc_hl)
+        key = (self._key(conv, indices), fmt, options, name)
+        code = self.sources.get(key)
+        if code is None:
+            code = ''.join(emitter(indices, name))
+            self._store(self.sources, key, code)
+        else:
+            self.sources.move_to_end(key)
+        return code
+
+    def report(self):
+        return f"{self.hits} cached, {self.partial} incremental, {self.full} full conversions"
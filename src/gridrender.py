@@ -0,0 +1,146 @@
+#!/usr/bin/env python
+
+"""
+GRIDRENDER.PY by Javier Garcia
+
+Renderers used by PixelGrid to show the Sprite model in its canvas. Both
+only draw the cells inside the viewport (col0, row0, col1, row1):
+
+RectRenderer  - one canvas rectangle per visible cell (classic look).
+ImageRenderer - the visible cells are painted in a single tk.PhotoImage scaled
+                by the cell size, updated with one put() per dirty row. Grid
+                lines are an overlay of canvas lines.
+
+Cell colours come from grid.colors indexed by grid.row_indices(), which
+takes care of the onion skin of animations.
+"""
+
+import tkinter as tk
+
+GRID_COLOR = "gray"
+# Grid lines are not drawn when cells are smaller than this (in screen pixels)
+GRID_MIN_CELL = 4
+
+
+class RectRenderer:
+    min_pxsize = 8
+
+    def __init__(self, grid):
+        self.grid = grid
+        self.canvas = grid.canvas
+        self.cells = {}   # offset -> canvas item
+
+    def clear(self):
+        for item in self.cells.values():
+            self.canvas.delete(item)
+        self.cells = {}
+
+    def redraw(self, visible):
+        """ Creates the items for the cells that became visible and drops the rest """
+        col0, row0, col1, row1 = visible
+        width = self.grid.sprite.width
+        cellw, cellh = self.grid.cell_size()
+        cells = {}
+        for offset, item in self.cells.items():
+            x, y = offset % width, offset // width
+            if x >= col0 and x < col1 and y >= row0 and y < row1:
+                cells[offset] = item
+            else:
+                self.canvas.delete(item)
+        for y in range(row0, row1):
+            offset = y * width
+            for x in range(col0, col1):
+                if offset + x not in cells:
+                    x0, y0 = x * cellw, y * cellh
+                    cells[offset + x] = self.canvas.create_rectangle(
+                        x0, y0, x0 + cellw, y0 + cellh,
+                        fill=self.grid.colors[self.grid.row_indices(offset, x, x + 1)[0]],
+                        outline=GRID_COLOR if self.grid.show_grid else ''
+                    )
+        self.cells = cells
+        self.refresh(None)
+
+    def refresh(self, dirty):
+        if dirty is None:
+            dirty = self.cells.keys()
+        colors = self.grid.colors
+        for offset in dirty:
+            item = self.cells.get(offset)
+            if item is not None:
+                index = self.grid.row_indices(offset, 0, 1)[0]
+                self.canvas.itemconfigure(item, fill=colors[index])
+
+
+class ImageRenderer:
+    min_pxsize = 2
+
+    def __init__(self, grid):
+        self.grid = grid
+        self.canvas = grid.canvas
+        self.image = tk.PhotoImage(master=self.canvas, width=1, height=1)
+        self.item = None
+        self.visible = (0, 0, 0, 0)
+        self.cellw = 1
+        self.cellh = 1
+        self.cellstr = grid.colors
+
+    def clear(self):
+        self.canvas.delete('grid')
+        if self.item is not None:
+            self.canvas.delete(self.item)
+            self.item = None
+
+    def _row_data(self, offset, col0, col1):
+        """ Returns the PhotoImage data for one pixel line of the cells in [col0, col1) """
+        cellstr = self.cellstr
+        return '{' + ' '.join([cellstr[index] for index in self.grid.row_indices(offset, col0, col1)]) + '}'
+
+    def _put_row(self, y, col0, col1):
+        vcol0, vrow0, _, _ = self.visible
+        x0 = (col0 - vcol0) * self.cellw
+        y0 = (y - vrow0) * self.cellh
+        # a single pixel line is tiled down to fill the cell height
+        data = self._row_data(y * self.grid.sprite.width, col0, col1)
+        self.image.put(data, to=(x0, y0, x0 + (col1 - col0) * self.cellw, y0 + self.cellh))
+
+    def _draw_grid(self):
+        self.canvas.delete('grid')
+        col0, row0, col1, row1 = self.visible
+        if self.grid.show_grid and self.cellw >= GRID_MIN_CELL and self.cellh >= GRID_MIN_CELL:
+            x0, x1 = col0 * self.cellw, col1 * self.cellw
+            y0, y1 = row0 * self.cellh, row1 * self.cellh
+            for col in range(col0, col1 + 1):
+                self.canvas.create_line(col * self.cellw, y0, col * self.cellw, y1, fill=GRID_COLOR, tags='grid')
+            for row in range(row0, row1 + 1):
+                self.canvas.create_line(x0, row * self.cellh, x1, row * self.cellh, fill=GRID_COLOR, tags='grid')
+
+    def redraw(self, visible):
+        col0, row0, col1, row1 = visible
+        self.visible = visible
+        self.cellw, self.cellh = self.grid.cell_size()
+        self.cellstr = [' '.join([hexcol] * self.cellw) for hexcol in self.grid.colors]
+        width = max(1, (col1 - col0) * self.cellw)
+        height = max(1, (row1 - row0) * self.cellh)
+        self.image.configure(width=width, height=height)
+        if self.item is None:
+            self.item = self.canvas.create_image(0, 0, image=self.image, anchor=tk.NW)
+        self.canvas.coords(self.item, col0 * self.cellw, row0 * self.cellh)
+        for y in range(row0, row1):
+            self._put_row(y, col0, col1)
+        self._draw_grid()
+
+    def refresh(self, dirty):
+        if dirty is None:
+            self.redraw(self.visible)
+            return
+        col0, row0, col1, row1 = self.visible
+        width = self.grid.sprite.width
+        # group the dirty cells by row and put the changed span of each row
+        rows = {}
+        for offset in dirty:
+            x, y = offset % width, offset // width
+            if x >= col0 and x < col1 and y >= row0 and y < row1:
+                span = rows.get(y)
+                rows[y] = (x, x) if span is None else (min(span[0], x), max(span[1], x))
+        for y, (x0, x1) in rows.items():
+            self._put_row(y, x0, x1 + 1)
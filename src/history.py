@@ -0,0 +1,103 @@
+#!/usr/bin/env python
+
+"""
+HISTORY.PY by Javier Garcia
+
+Undo/redo history for the Sprite model. Instead of full image snapshots each
+entry keeps only the cells that changed (offset, old value, new value). All the
+changes done between begin() and end() (a mouse stroke, a fill, a mirror...)
+are grouped in a single entry. The history is limited both by number of
+entries and by the memory used by them.
+"""
+
+from array import array
+
+HISTORY_DEPTH = 256
+HISTORY_BUDGET = 8 * 1024 * 1024   # bytes
+# Rough per entry overhead of the Python objects holding a delta
+DELTA_OVERHEAD = 200
+
+
+class Delta:
+    def __init__(self, changes):
+        """ changes is a dict offset -> (old, new) """
+        offsets = sorted(changes.keys())
+        self.offsets = array('I', offsets)
+        self.old = bytes([changes[o][0] for o in offsets])
+        self.new = bytes([changes[o][1] for o in offsets])
+
+    def size(self):
+        return self.offsets.itemsize * len(self.offsets) + len(self.old) + len(self.new) + DELTA_OVERHEAD
+
+
+class History:
+    def __init__(self, depth=HISTORY_DEPTH, budget=HISTORY_BUDGET):
+        self.depth = depth
+        self.budget = budget
+        self.reset()
+
+    def reset(self):
+        self.undo_stack = []
+        self.redo_stack = []
+        self.used = 0
+        self.group = None
+
+    def begin(self):
+        if self.group is None:
+            self.group = {}
+
+    def record(self, offset, old, new):
+        """ Called by the Sprite for every changed cell, ignored outside a group """
+        if self.group is not None:
+            change = self.group.get(offset)
+            self.group[offset] = (old if change is None else change[0], new)
+
+    def record_diff(self, before, after):
+        """ Records the differences between two full image buffers """
+        if self.group is not None:
+            for offset, (old, new) in enumerate(zip(before, after)):
+                if old != new:
+                    self.record(offset, old, new)
+
+    def end(self):
+        if self.group is None:
+            return
+        # drop the cells that ended with their original value
+        changes = {o: c for o, c in self.group.items() if c[0] != c[1]}
+        self.group = None
+        if len(changes) > 0:
+            delta = Delta(changes)
+            self.undo_stack.append(delta)
+            self.used = self.used + delta.size()
+            for redo in self.redo_stack:
+                self.used = self.used - redo.size()
+            self.redo_stack = []
+            self._trim()
+
+    def _trim(self):
+        while len(self.undo_stack) > 0 and (len(self.undo_stack) > self.depth or self.used > self.budget):
+            self.used = self.used - self.undo_stack.pop(0).size()
+
+    def can_undo(self):
+        return len(self.undo_stack) > 0
+
+    def can_redo(self):
+        return len(self.redo_stack) > 0
+
+    def undo(self, sprite):
+        self.end()
+        if len(self.undo_stack) == 0:
+            return False
+        delta = self.undo_stack.pop()
+        sprite.apply(delta.offsets, delta.old)
+        self.redo_stack.append(delta)
+        return True
+
+    def redo(self, sprite):
+        self.end()
+        if len(self.redo_stack) == 0:
+            return False
+        delta = self.redo_stack.pop()
+        sprite.apply(delta.offsets, delta.new)
+        self.undo_stack.append(delta)
+        return True
@@ -19,6 +19,17 @@ bit 7	bit 6	bit 5	bit 4	bit 3	bit 2	bit 1	bit 0
 pixel 0 pixel 1 pixel 0 pixel 1 pixel 0 pixel 1 pixel 0 pixel 1
 """
 
+import struct
+from colormatch import ColorResolver
+from compress import compress
+from compiled import CompiledSprite, generic_cost
+from tileset import Tileset
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
 # Array of CPC colours in the following format:
 # index     = firmware value (1-26) as it is used in INK basic instruction
 # 1st value = hardware byte value (used in assembly to set colors in the PAL chip)
@@ -145,6 +156,168 @@ CPC_COLOR_NAMES = [
     "Bright White",
 ]
 
+# Full screen size in pixels for each mode
+CPC_SCREEN_SIZES = [(160, 200), (320, 200), (640, 200)]
+
+# Number of pixels stored in each video byte for each mode
+PIXELS_PER_BYTE = [2, 4, 8]
+
+# Default screen memory: 8 character lines interleaved in blocks of 2048 bytes,
+# line y starts at SCREEN_ADDRESS + (y // 8) * SCREEN_LINE_BYTES + (y % 8) * SCREEN_BLOCK
+SCREEN_ADDRESS = 0xC000
+SCREEN_SIZE = 0x4000
+SCREEN_LINE_BYTES = 80
+SCREEN_BLOCK = 0x800
+
+def _pixel_bits(mode, pos, pen):
+    """ Bits set in a video byte by the pixel in position pos using the given pen """
+    if mode == 2:
+        return (pen & 0x01) << (7 - pos)
+    elif mode == 1:
+        pos = 3 - pos
+        return (pen & 0x02) << (pos + 3) | (pen & 0x01) << pos
+    pos = 1 - pos
+    return (pen & 0x01) << (6 + pos) | (pen & 0x02) << (1 + pos) | \
+           (pen & 0x04) << (2 + pos) | (pen & 0x08) >> (3 - pos)
+
+# Pens that become all bits set (transparent pixels) when building AND masks
+ALPHA_PENS = bytes([0x00] + [0xFF] * 255)
+
+# Kinds of AND masks the converter can emit
+MASK_MODES = ('interleaved', 'separate')
+
+# PACK_TABLES[mode][pos] translates a pen (0-255) into its bits in the video byte
+PACK_TABLES = [
+    [bytes([_pixel_bits(mode, pos, pen) for pen in range(256)]) for pos in range(PIXELS_PER_BYTE[mode])]
+    for mode in range(3)
+]
+
+def _unpack_table(mode, pos):
+    ppb = PIXELS_PER_BYTE[mode]
+    decode = {PACK_TABLES[mode][pos][pen]: pen for pen in range(1 << (8 // ppb))}
+    mask = PACK_TABLES[mode][pos][0xFF]
+    return bytes(decode[value & mask] for value in range(256))
+
+# UNPACK_TABLES[mode][pos] translates a video byte into the pen of its pixel pos
+UNPACK_TABLES = [
+    [_unpack_table(mode, pos) for pos in range(PIXELS_PER_BYTE[mode])]
+    for mode in range(3)
+]
+
+def _mirror_table(mode):
+    """ Translation table that reverses the order of the pixels inside a video byte """
+    ppb = PIXELS_PER_BYTE[mode]
+    table = bytearray(256)
+    for value in range(256):
+        for pos in range(ppb):
+            pen = UNPACK_TABLES[mode][pos][value]
+            table[value] = table[value] | PACK_TABLES[mode][ppb - 1 - pos][pen]
+    return bytes(table)
+
+# MIRROR_TABLES[mode] translates a video byte into the byte with its pixels in reverse order
+MIRROR_TABLES = [_mirror_table(mode) for mode in range(3)]
+
+def pack_pixels(pens, mode):
+    """
+    Packs a buffer of pens (one byte per pixel, rows one after the other) into
+    CPC video bytes for the given mode. Uses NumPy when available, otherwise
+    each pixel position of the byte is translated in bulk with PACK_TABLES.
+    """
+    ppb = PIXELS_PER_BYTE[mode]
+    pens = bytes(pens)
+    if len(pens) % ppb != 0:
+        pens = pens + bytes(ppb - len(pens) % ppb)
+    total = len(pens) // ppb
+    if total == 0:
+        return bytearray()
+    if np is not None:
+        columns = np.frombuffer(pens, dtype=np.uint8).reshape(total, ppb)
+        data = np.zeros(total, dtype=np.uint8)
+        for pos in range(ppb):
+            table = np.frombuffer(PACK_TABLES[mode][pos], dtype=np.uint8)
+            data |= table[columns[:, pos]]
+        return bytearray(data.tobytes())
+    # bits of different positions never overlap so they can be OR'ed as big integers
+    data = 0
+    for pos in range(ppb):
+        column = pens[pos::ppb].translate(PACK_TABLES[mode][pos])
+        data = data | int.from_bytes(column, 'big')
+    return bytearray(data.to_bytes(total, 'big'))
+
+
+def unpack_pixels(data, mode):
+    """ Inverse of pack_pixels: returns the pens (one byte per pixel) of the video bytes """
+    ppb = PIXELS_PER_BYTE[mode]
+    data = bytes(data)
+    pens = bytearray(len(data) * ppb)
+    for pos in range(ppb):
+        pens[pos::ppb] = data.translate(UNPACK_TABLES[mode][pos])
+    return pens
+
+
+# Offsets of the block tables are 16 bits words
+MAX_BLOCK_OFFSET = 0xFFFF
+
+def with_offsets(blocks):
+    """
+    Joins several blocks of data preceded by a table of little-endian words
+    with the offset of each block from the beginning of the result. Every
+    block must start in the first MAX_BLOCK_OFFSET bytes.
+    """
+    offset = 2 * len(blocks)
+    table = bytearray()
+    for data in blocks:
+        if offset > MAX_BLOCK_OFFSET:
+            raise ConversionError(f"the data is too large for the offset table: a block starts at byte {offset}, "
+                                  f"the limit is {MAX_BLOCK_OFFSET} (64K)")
+        table.extend(struct.pack('<H', offset))
+        offset = offset + len(data)
+    return table + b''.join(blocks)
+
+# Delta frames: runs of (row, column, count, count bytes) ended by DELTA_END
+DELTA_END = 0xFF
+DELTA_MAX_RUN = 255
+# Rows and columns are stored in one byte each, row 255 would read as DELTA_END
+DELTA_MAX_ROWS = 255
+DELTA_MAX_COLUMNS = 256
+# Unchanged bytes merged into the current run instead of starting a new one
+# (a new run costs 3 bytes of header and its setup time on the CPC)
+DELTA_MAX_GAP = 3
+
+def delta_frame(prev, cur, rowbytes):
+    """
+    Returns the changes needed to turn the packed image prev into cur as runs
+    of (row, column, count, bytes) ended by DELTA_END. Runs never cross rows
+    so the player can get the screen address of each one from a line table.
+    """
+    rows = len(cur) // rowbytes
+    if rows > DELTA_MAX_ROWS or rowbytes > DELTA_MAX_COLUMNS:
+        raise ConversionError(f"delta frames support up to {DELTA_MAX_ROWS} rows of {DELTA_MAX_COLUMNS} bytes, "
+                              f"the image has {rows} rows of {rowbytes} bytes")
+    out = bytearray()
+
+    def emit(y, start, end):
+        out.extend((y, start, end - start + 1))
+        out.extend(cur[y * rowbytes + start:y * rowbytes + end + 1])
+
+    for y in range(rows):
+        before = prev[y * rowbytes:(y + 1) * rowbytes]
+        after = cur[y * rowbytes:(y + 1) * rowbytes]
+        if before == after:
+            continue
+        changed = [x for x in range(rowbytes) if before[x] != after[x]]
+        start = end = changed[0]
+        for x in changed[1:]:
+            if x - end - 1 <= DELTA_MAX_GAP and x - start < DELTA_MAX_RUN:
+                end = x
+            else:
+                emit(y, start, end)
+                start = end = x
+        emit(y, start, end)
+    out.append(DELTA_END)
+    return out
+
+
 class ConversionError(Exception):
     def __init__(self, message):
         self.message = message
@@ -153,17 +326,113 @@ class ConversionError(Exception):
         return self.message
     
 
+# Rows of data emitted between progress reports
+PROGRESS_ROWS = 64
+
+# "#RRGGBB" -> index in CPC_RGB_COLORS
+CPC_HEX_INDEX = {f'#{r:02X}{g:02X}{b:02X}': i for i, (r, g, b) in enumerate(CPC_RGB_COLORS)}
+
+
+class RGBImage:
+    """
+    Packed RGB image (3 bytes per pixel, rows one after the other) in any
+    object supporting the buffer protocol.
+    """
+    def __init__(self, data, width, height):
+        self.data = memoryview(data).cast('B')
+        self.width = width
+        self.height = height
+        if len(self.data) < width * height * 3:
+            raise ConversionError(f"RGB buffer too small for {width}x{height} pixels")
+
+
+def pixel_indices(pixels, width, height, metric='manhattan'):
+    """
+    Returns the firmware color index (0-26) of each pixel of the image as a
+    bytes-like object. pixels can be:
+    - a buffer with one firmware index per pixel (bytes, bytearray, array('B'),
+      memoryview...), like Sprite.pixels, which is used without copying it
+    - an RGBImage, whose colours are matched to the nearest CPC colour
+    - a list of ((x, y), "#RRGGBB") tuples as returned by Sprite.get_pixels()
+    """
+    count = width * height
+    if isinstance(pixels, RGBImage):
+        if (pixels.width, pixels.height) != (width, height):
+            raise ConversionError(f"expected a {width}x{height} image, got {pixels.width}x{pixels.height}")
+        return _rgb_indices(pixels.data[0:count * 3], metric)
+    if isinstance(pixels, list):
+        cpc = ColorResolver(CPC_RGB_COLORS, metric)
+        indices = bytearray(count)
+        for i in range(count):
+            pixel = pixels[i][1]
+            index = CPC_HEX_INDEX.get(pixel)
+            indices[i] = cpc.resolve_hex(pixel) if index is None else index
+        return indices
+    view = memoryview(pixels).cast('B')
+    if len(view) < count:
+        raise ConversionError(f"expected {count} pixels, got {len(view)}")
+    return view[0:count]
+
+
+def _rgb_indices(rgb, metric):
+    cpc = ColorResolver(CPC_RGB_COLORS, metric)
+    if np is not None:
+        pixels = np.frombuffer(rgb, dtype=np.uint8).reshape(-1, 3).astype(np.int32)
+        keys = (pixels[:, 0] << 16) | (pixels[:, 1] << 8) | pixels[:, 2]
+        unique, inverse = np.unique(keys, return_inverse=True)
+        lut = np.array([cpc.resolve(k) for k in unique.tolist()], dtype=np.uint8)
+        return lut[inverse.reshape(-1)].tobytes()
+    data = bytes(rgb)
+    resolve = cpc.resolve
+    return bytes(resolve(r << 16 | g << 8 | b) for r, g, b in zip(data[0::3], data[1::3], data[2::3]))
+
+
 class ImgConverter:
-    def __init__(self, w, h, mode):
+    def __init__(self, w, h, mode, metric='manhattan', compression=None, preshift=False,
+                 transparent=None, masked=None, inc_hl=False, tiles=None, flips=False, cache=None):
         self.mode = mode
+        self.metric = metric
+        self.compression = compression   # None, 'rle' or 'lz' (see compress.py)
+        self.preshift = preshift         # emit one variant per pixel offset inside a byte
+        self.transparent = transparent   # hex colour exported as transparent
+        self.masked = masked             # None, 'interleaved' or 'separate' AND masks
+        self.inc_hl = inc_hl             # compiled sprites walk rows with INC HL/DEC HL
+        self.compiled = False            # set by iter_compiled, which always honours the transparent colour
+        self.anim_report = None
+        self.tiles = tiles               # (width, height) in pixels of the tileset tiles
+        self.flips = flips               # tiles can be mirrored versions of other ones
+        self.cache = cache               # ConversionCache shared between converters (see convcache.py)
+        self.progress = None             # callable(fraction) told about the progress of the conversions
+        self._emit_from = 0.0            # progress reported when the data arrays start to be emitted
+        self._emit_total = 1             # bytes of the arrays to emit
+        self._emitted = 0                # bytes of the arrays emitted so far
+        self.tiles_report = None
+        self.raw_size = 0
+        self.packed_size = 0
+        self.cost_report = None
         self.palette = []
         self.img = bytearray()
+        self.alpha = bytearray()
+        self.packed = None               # video bytes of img, once packed
         self.imgw = w
         self.imgh = h
-        self.hex2index = {}
-        for i, rgb in enumerate(CPC_RGB_COLORS):
-            self.hex2index[f'#{rgb[0]:02X}{rgb[1]:02X}{rgb[2]:02X}'] = i
+        self.hex2index = CPC_HEX_INDEX
                  
+    def _report(self, fraction):
+        """ Tells self.progress, if set, the fraction (0 to 1) of the conversion done """
+        if self.progress is not None:
+            self.progress(fraction)
+
+    def _start_emit(self, fraction, total):
+        """ The data arrays emitted next hold total bytes, their progress goes from fraction to 1 """
+        self._emit_from = fraction
+        self._emit_total = max(1, total)
+        self._emitted = 0
+
+    def _report_emitted(self, count):
+        done = min(1.0, (self._emitted + count) / self._emit_total)
+        self._report(self._emit_from + (1.0 - self._emit_from) * done)
+
     def _colors_per_mode(self, mode):
         if mode == 0: return 16
         return 4 if mode == 1 else 2
@@ -175,130 +444,510 @@ class ImgConverter:
             colors.append(CPC_FW_COLORS[fwid][1])
         return colors
 
-    def _get_color_distance(self, col1, col2):
-        """ colors expected as (r, g, b) values"""
-        return abs(col1[0] - col2[0]) + abs(col1[1] - col2[1]) + abs(col1[2] - col2[2])
-    
-    def _findcolor(self, hexpixel, cpccolors):
-        nearest = (999, -1)
-        h = hexpixel.lstrip('#')
-        rgbpixel = tuple(int(h[i:i+2], 16) for i in (0, 2, 4))
-        for i in range(0, len(cpccolors)):
-            diff = (self._get_color_distance(rgbpixel, cpccolors[i]), i)
-            nearest = min(nearest, diff)
-        return nearest
-
     def _img2mode(self):
-        pixelxbyte = 8 if self.mode == 2 else 4 if self.mode == 1 else 2
-        totalbytes = int((self.imgh * self.imgw) / pixelxbyte)
-        data = bytearray([0x00 for i in range(0, totalbytes)])
-        for i in range(0, len(self.img)):
-            video_byte = int(i / pixelxbyte)
-            if self.mode == 2:
-                pos = 7 - (i % pixelxbyte)
-                data[video_byte] = data[video_byte] | (self.img[i] << pos)
-            elif self.mode == 1:
-                pos = 3 - (i % pixelxbyte)
-                data[video_byte] = data[video_byte] | (self.img[i] & 0x02) << (pos+3) | (self.img[i] & 0x01) << pos
-            else:
-                pos = 1 - (i % pixelxbyte)
-                data[video_byte] = data[video_byte] | \
-                             (self.img[i] & 0x01) << (6 + pos) | \
-                             (self.img[i] & 0x02) << (1 + pos) | \
-                             (self.img[i] & 0x04) << (2 + pos) | \
-                             (self.img[i] & 0x08) >> (3 - pos)
+        if self.packed is None:
+            self.packed = pack_pixels(self.img, self.mode)
+        return bytearray(self.packed)
+
+    def _compress(self, data):
+        """ Applies the selected compression (if any) and keeps the sizes for the report """
+        self.raw_size = len(data)
+        if self.compression is not None:
+            data = compress(data, self.compression)
+        self.packed_size = len(data)
         return data
 
-    def _build_palette(self, sprite):
+    def _shifted(self, data, shift, padding=0):
+        """
+        Returns the pens of the image displaced shift pixels to the right. Each
+        row is widened by one byte, the new pixels are filled with padding.
+        """
+        ppb = PIXELS_PER_BYTE[self.mode]
+        left = bytes([padding]) * shift
+        right = bytes([padding]) * (ppb - shift)
+        w = self.imgw
+        return b''.join(left + data[y * w:(y + 1) * w] + right for y in range(self.imgh))
+
+    def _pack_shifts(self, pens, padding):
+        """
+        Packs the pens as they are or, with preshift enabled, shifted 0 to
+        PIXELS_PER_BYTE - 1 pixels so the target can select IMG[x % PIXELS_PER_BYTE]
+        and just copy bytes (each row of a shifted variant is one byte wider).
+        """
+        if not self.preshift:
+            return [pack_pixels(pens, self.mode)]
+        return [pack_pixels(self._shifted(pens, shift, padding), self.mode) for shift in range(PIXELS_PER_BYTE[self.mode])]
+
+    def _image_shifts(self):
+        """ The packed image, or its pre-shifted variants """
+        if not self.preshift:
+            return [self._img2mode()]
+        return self._pack_shifts(bytes(self.img), 0)
+
+    def _mask_pens(self):
+        """ Pens that give the AND mask when packed: all bits set in transparent pixels """
+        return bytes(self.alpha).translate(ALPHA_PENS)
+
+    def _variants(self):
+        """
+        Returns the list of packed images to emit. With interleaved masks each
+        image is made of (mask, data) byte pairs.
+        """
+        images = self._image_shifts()
+        if self.masked != 'interleaved':
+            return images
+        masks = self._pack_shifts(self._mask_pens(), 0xFF)
+        result = []
+        for mask, data in zip(masks, images):
+            pairs = bytearray(len(data) * 2)
+            pairs[0::2] = mask
+            pairs[1::2] = data
+            result.append(pairs)
+        return result
+
+    def _mask_variants(self):
+        """ Returns the AND masks emitted as separate tables, if any """
+        if self.masked != 'separate':
+            return []
+        return self._pack_shifts(self._mask_pens(), 0xFF)
+
+    def _compress_variants(self, variants):
+        """ Compresses each variant on its own so all of them can be unpacked separately """
+        raw = 0
+        packed = 0
+        result = []
+        for i, data in enumerate(variants):
+            self._report(0.3 + 0.3 * i / len(variants))
+            result.append(self._compress(data))
+            raw = raw + self.raw_size
+            packed = packed + self.packed_size
+        self.raw_size = raw
+        self.packed_size = packed
+        return result
+
+    def _variants_header(self):
+        """ Description of the emitted variants for the comments of the code """
+        lines = []
+        if self.preshift:
+            count = PIXELS_PER_BYTE[self.mode]
+            width = self.imgw // count + 1
+            lines.append(f"{count} pre-shifted variants of {width} x {self.imgh} bytes, use IMG[x % {count}]")
+        if self.masked == 'interleaved':
+            lines.append("masked: (mask, data) byte pairs, screen = (screen AND mask) OR data")
+        elif self.masked == 'separate':
+            lines.append("masked: MASK table, screen = (screen AND MASK) OR IMG")
+        return lines
+
+    def compression_report(self):
+        """ Summary of the last packed output, None if no video bytes were generated """
+        if self.raw_size == 0:
+            return None
+        if self.compression is None:
+            return f"uncompressed: {self.raw_size} bytes"
+        ratio = self.packed_size * 100 / self.raw_size
+        return f"{self.compression}: {self.raw_size} -> {self.packed_size} bytes ({ratio:.1f}%)"
+
+    def _indices(self, sprite):
+        return pixel_indices(sprite, self.imgw, self.imgh, self.metric)
+
+    def _transparent_index(self):
+        """
+        Firmware index of the transparent colour, or None. Only masked and
+        compiled sprites draw it through a mask; in any other output it is a
+        colour like the rest, as pen 0 would mix it up with palette[0].
+        """
+        if self.transparent is None or (self.masked is None and not self.compiled):
+            return None
+        index = self.hex2index.get(self.transparent)
+        if index is None:
+            index = ColorResolver(CPC_RGB_COLORS, self.metric).resolve_hex(self.transparent)
+        return index
+
+    def _build_palette(self, sprites):
         """
-        Assigns each pixel in the image to a CPC color. When
-        all pixels are assigned, the method retains the colors with more
-        assignements and builds the palette. The mode sets the max number
+        Counts the pixels of each CPC color in the images (see pixel_indices
+        for the accepted formats) and retains the colors with more
+        assignements to build the palette. The mode sets the max number
         of allowed entries.
         """
-        ocurrences = [(0, i) for i in range(0, len(CPC_RGB_COLORS))]
-        for row in range(self.imgh):
-            for col in range(self.imgw):
-                pixel = sprite[self.imgw * row + col][1]
-                index = self.hex2index[pixel]
-                ocurrences[index] = (ocurrences[index][0] + 1, index)
-        palette = list(filter(lambda item: item[0] > 0, ocurrences))
-        palette.sort(reverse=True)
+        counts = [0] * len(CPC_RGB_COLORS)
+        for sprite in sprites:
+            indices = self._indices(sprite)
+            if np is not None:
+                found = np.bincount(np.frombuffer(indices, dtype=np.uint8), minlength=len(counts)).tolist()
+            else:
+                data = bytes(indices)
+                found = [data.count(i) for i in range(len(counts))]
+            counts = [c + n for c, n in zip(counts, found)]
+        transparent = self._transparent_index()
+        if transparent is not None:
+            counts[transparent] = 0
+        ocurrences = [(count, i) for i, count in enumerate(counts) if count > 0]
+        ocurrences.sort(reverse=True)
         colors = self._colors_per_mode(self.mode)
-        self.palette = list(map(lambda item: CPC_FW_COLORS[item[1]][0], palette[0:colors]))
+        self.palette = list(map(lambda item: CPC_FW_COLORS[item[1]][0], ocurrences[0:colors]))
 
     def _build_cpcimg(self, sprite):
+        self._report(0.0)
+        if self.cache is not None:
+            self.cache.build(self, sprite)
+        else:
+            self._build_palette([sprite])
+            self._resolve(sprite)
+        self._report(0.3)
+
+    def _resolve(self, sprite):
         """
-        Convert each RGB value to a CPC HW color value included in the
-        palette. If more colors that allowed were used, the method selects
-        the nearest valid color.
+        Converts each pixel to the pen of its CPC color in the palette. If
+        more colors that allowed were used, the method selects the nearest
+        valid color. Transparent pixels get pen 0 and are flagged in alpha.
+        Both are done with one translation table for the whole image.
         """
-        self._build_palette(sprite)
-        palettecolors = self._palette2colors()
-        self.img = bytearray()
-        for y in range(0, self.imgh):
-            for x in range(0, self.imgw):
-                pixel = sprite[self.imgw * y + x][1]
-                _, colorindex = self._findcolor(pixel, palettecolors)
-                self.img.extend(colorindex.to_bytes(1, 'little'))
-        
-    def code_c(self, sprite, name):
+        pens, flags = self._pen_tables()
+        indices = bytes(self._indices(sprite))
+        self.img = bytearray(indices.translate(pens))
+        self.alpha = bytearray(indices.translate(flags))
+        self.packed = None
+
+    def _pen_tables(self):
+        """ Tables translating firmware indices into pens and alpha flags """
+        colors = self._palette2colors()
+        transparent = self._transparent_index()
+        pens = bytearray(256)
+        flags = bytearray(256)
+        if colors:
+            resolver = ColorResolver(colors, self.metric)
+            for i, rgb in enumerate(CPC_RGB_COLORS):
+                pens[i] = resolver.resolve_rgb(rgb)
+        if transparent is not None:
+            pens[transparent] = 0
+            flags[transparent] = 1
+        return bytes(pens), bytes(flags)
+
+    def _row_bytes(self):
+        """ Number of bytes emitted in each line of data """
+        width = self.imgw // PIXELS_PER_BYTE[self.mode]
+        if self.preshift:
+            width = width + 1
+        if self.masked == 'interleaved':
+            width = width * 2
+        return max(1, min(16, width))
+
+    def _iter_c_array(self, label, data, row=None):
+        yield f"const unsigned char {label}[{len(data)}] = {{\n"
+        row = row or self._row_bytes()
+        for offset in range(0, len(data), row):
+            if self.progress is not None and offset % (row * PROGRESS_ROWS) == 0:
+                self._report_emitted(offset)
+            end = ',\n' if offset + row < len(data) else '\n'
+            yield '    ' + ', '.join('0x%02X' % x for x in data[offset:offset + row]) + end
+        self._emitted = self._emitted + len(data)
+        yield '};\n'
+
+    def _iter_c_variants(self, label, variants):
+        if not self.preshift:
+            yield from self._iter_c_array(label, memoryview(variants[0]))
+            return
+        for i, data in enumerate(variants):
+            yield from self._iter_c_array(f"{label}_{i}", memoryview(data))
+            yield '\n'
+        pointers = ', '.join(f"{label}_{i}" for i in range(len(variants)))
+        yield f"const unsigned char* const {label}[{len(variants)}] = {{ {pointers} }};\n"
+
+    def iter_c(self, sprite, name):
+        """ Generator with the lines of the sprite in C format """
         self._build_cpcimg(sprite)
-        data = self._img2mode()
-        code = []
+        variants = self._compress_variants(self._variants() + self._mask_variants())
+        masks = variants[len(variants) // 2:] if self.masked == 'separate' else []
+        variants = variants[:len(variants) - len(masks)]
+        self._start_emit(0.6, sum(len(data) for data in variants + masks))
         strpalette = '{ %s }' % ', '.join('0x%02X' % x for x in self.palette)
-        code.append("// C format sprite created with Tixel\n")
-        code.append(f"// mode {self.mode}, width {self.imgw}, height {self.imgh}\n\n")
-        code.append(f"const unsigned char {name.upper()}_PAL[{len(self.palette)}] = {strpalette};\n\n")
-        code.append(f"const unsigned char {name.upper()}_IMG[{len(sprite)}] = {{\n")
-        pixbyte = 8 if self.mode == 2 else 4 if self.mode == 1 else 2
-        row = min(16, int(self.imgw / pixbyte))
-        while len(data) > 0:
-            line = data[0:row]
-            end = ',\n' if len(data) > row else '\n'
-            code.append('    ' + ', '.join('0x%02X' % x for x in line) + end)
-            data = data[row:]
-        code.append('};\n')
-        return code
-        
+        label = name.upper()
+        yield "// C format sprite created with Tixel\n"
+        if self.compression is not None:
+            yield f"// {self.compression_report()}\n"
+        for line in self._variants_header():
+            yield f"// {line}\n"
+        yield f"// mode {self.mode}, width {self.imgw}, height {self.imgh}\n\n"
+        yield f"const unsigned char {label}_PAL[{len(self.palette)}] = {strpalette};\n\n"
+        yield from self._iter_c_variants(f"{label}_IMG", variants)
+        if masks:
+            yield '\n'
+            yield from self._iter_c_variants(f"{label}_MASK", masks)
 
-    def code_asm(self, sprite, name):
+    def _iter_asm_db(self, label, data, row=None):
+        yield f"{label}:\n"
+        row = row or self._row_bytes()
+        for offset in range(0, len(data), row):
+            if self.progress is not None and offset % (row * PROGRESS_ROWS) == 0:
+                self._report_emitted(offset)
+            yield '\tdb ' + ', '.join('&%02X' % x for x in data[offset:offset + row]) + '\n'
+        self._emitted = self._emitted + len(data)
+        yield '\n'
+
+    def _iter_asm_variants(self, label, variants):
+        if not self.preshift:
+            yield from self._iter_asm_db(label, memoryview(variants[0]))
+            return
+        yield f"{label}:\n"
+        yield '\tdw ' + ', '.join(f"{label}_{i}" for i in range(len(variants))) + '\n\n'
+        for i, data in enumerate(variants):
+            yield from self._iter_asm_db(f"{label}_{i}", memoryview(data))
+
+    def iter_asm(self, sprite, name):
+        """ Generator with the lines of the sprite in assembly format """
         self._build_cpcimg(sprite)
-        data = self._img2mode()
-        code = []
+        variants = self._compress_variants(self._variants() + self._mask_variants())
+        masks = variants[len(variants) // 2:] if self.masked == 'separate' else []
+        variants = variants[:len(variants) - len(masks)]
+        self._start_emit(0.6, sum(len(data) for data in variants + masks))
         strpalette = ', '.join('0x%02X' % x for x in self.palette)
-        code.append("; Assembly format sprite created with Tixel\n")
-        code.append(f"; mode {self.mode}, width {self.imgw}, height {self.imgh}\n\n")
-        code.append(f"{name.lower()}_pal:\n")
-        code.append(f"\tdb {strpalette}\n\n")
-        code.append(f"{name.lower()}_img:\n")
-        pixbyte = 8 if self.mode == 2 else 4 if self.mode == 1 else 2
-        row = min(16, int(self.imgw / pixbyte))
-        while len(data) > 0:
-            line = data[0:row]
-            code.append('\tdb ' + ', '.join('&%02X' % x for x in line) + '\n')
-            data = data[row:]
-        code.append('\n')
-        return code
-        
-    def code_bas(self, sprite, name):
+        label = name.lower()
+        yield "; Assembly format sprite created with Tixel\n"
+        if self.compression is not None:
+            yield f"; {self.compression_report()}\n"
+        for line in self._variants_header():
+            yield f"; {line}\n"
+        yield f"; mode {self.mode}, width {self.imgw}, height {self.imgh}\n\n"
+        yield f"{label}_pal:\n"
+        yield f"\tdb {strpalette}\n\n"
+        yield from self._iter_asm_variants(f"{label}_img", variants)
+        if masks:
+            yield from self._iter_asm_variants(f"{label}_mask", masks)
+
+    def iter_compiled(self, sprite, name):
+        """
+        Generator with a compiled sprite: Z80 routines that draw the sprite
+        with immediate values (see compiled.py). The transparent colour, if
+        any, is always honoured; with preshift there is one routine per pixel
+        offset and a table with their addresses.
+        """
+        self.compiled = True
+        self._build_cpcimg(sprite)
+        label = name.lower()
+        images = self._image_shifts()
+        if self._transparent_index() is not None:
+            masks = self._pack_shifts(self._mask_pens(), 0xFF)
+        else:
+            masks = [bytes(len(data)) for data in images]
+        routines = []
+        for i, (mask, data) in enumerate(zip(masks, images)):
+            self._report(0.3 + 0.6 * i / len(images))
+            width = len(data) // self.imgh
+            rows = [list(zip(mask[y * width:(y + 1) * width], data[y * width:(y + 1) * width]))
+                    for y in range(self.imgh)]
+            routine = f"{label}_draw_{i}" if self.preshift else f"{label}_draw"
+            routines.append(CompiledSprite(rows, routine, self.inc_hl))
+        width = len(images[0]) // self.imgh
+        generic = generic_cost(width, self.imgh, self._transparent_index() is not None)
+        worst = max(routines, key=lambda r: r.tstates)
+        self.cost_report = (f"compiled {worst.tstates} T ({worst.nops} NOPs), "
+                            f"generic {generic[0]} T ({generic[1]} NOPs), "
+                            f"{worst.nops * 100 / generic[1]:.0f}%")
+        yield "; Compiled sprite created with Tixel\n"
+        yield f"; mode {self.mode}, width {self.imgw}, height {self.imgh}\n"
+        yield "; entry: HL = screen address of the top left byte, modifies AF, BC, DE, HL\n"
+        if not self.inc_hl:
+            yield "; rows must not cross a 256 bytes boundary (INC L/DEC L)\n"
+        if self.preshift:
+            yield f"; {len(routines)} pre-shifted routines, call the address at {label}_draw[x % {len(routines)}]\n"
+        yield f"; generic blit estimate: {generic[0]} T-states ({generic[1]} NOPs)\n\n"
+        yield f"{label}_pal:\n"
+        yield '\tdb ' + ', '.join('0x%02X' % x for x in self.palette) + '\n\n'
+        if self.preshift:
+            yield f"{label}_draw:\n"
+            yield '\tdw ' + ', '.join(r.label for r in routines) + '\n\n'
+        for i, routine in enumerate(routines):
+            self._report(0.9 + 0.1 * i / len(routines))
+            yield f"; {routine.tstates} T-states ({routine.nops} NOPs), {routine.size} bytes\n"
+            yield from routine.iter_code()
+            yield '\n'
+
+    def compiled_report(self):
+        """ Cost of the last compiled sprite against a generic blit """
+        return self.cost_report
+
+    def _build_anim(self, frames):
+        """
+        Converts all the frames with a shared palette. Returns the first frame
+        packed and the list of deltas, where deltas[i] turns frame i - 1 into
+        frame i and deltas[0] goes back from the last frame to the first one.
+        """
+        self._build_palette(frames)
+        packed = []
+        for i, sprite in enumerate(frames):
+            self._report(0.4 * i / len(frames))
+            self._resolve(sprite)
+            packed.append(pack_pixels(self.img, self.mode))
+        rowbytes = self.imgw // PIXELS_PER_BYTE[self.mode]
+        deltas = []
+        for i in range(len(packed)):
+            self._report(0.4 + 0.4 * i / len(packed))
+            deltas.append(delta_frame(packed[i - 1], packed[i], rowbytes))
+        if len(packed) == 1:
+            deltas = []
+        if deltas:
+            sizes = '/'.join(str(len(d)) for d in deltas[1:] + deltas[:1])
+            self.anim_report = f"{len(frames)} frames: {len(packed[0])} bytes + deltas {sizes} bytes"
+        else:
+            self.anim_report = f"1 frame: {len(packed[0])} bytes"
+        return packed[0], deltas
+
+    def _anim_header(self, comment):
+        yield f"{comment} Animation created with Tixel\n"
+        yield f"{comment} {self.anim_report}\n"
+        yield f"{comment} mode {self.mode}, width {self.imgw}, height {self.imgh}\n"
+        yield f"{comment} delta runs: row, column, count, count bytes; &{DELTA_END:02X} ends the frame\n"
+        yield f"{comment} DELTAS[i] turns frame i - 1 into frame i, DELTAS[0] goes back from the last one\n\n"
+
+    def iter_anim_c(self, frames, name):
+        """ Generator with the first frame and the delta frames of an animation in C format """
+        first, deltas = self._build_anim(frames)
+        self._start_emit(0.8, len(first) + sum(len(data) for data in deltas))
+        label = name.upper()
+        strpalette = '{ %s }' % ', '.join('0x%02X' % x for x in self.palette)
+        yield from self._anim_header('//')
+        yield f"const unsigned char {label}_PAL[{len(self.palette)}] = {strpalette};\n\n"
+        yield from self._iter_c_array(f"{label}_FRAME", memoryview(first))
+        for i, data in enumerate(deltas):
+            yield '\n'
+            yield from self._iter_c_array(f"{label}_DELTA_{i}", memoryview(data))
+        if deltas:
+            pointers = ', '.join(f"{label}_DELTA_{i}" for i in range(len(deltas)))
+            yield f"\nconst unsigned char* const {label}_DELTAS[{len(deltas)}] = {{ {pointers} }};\n"
+
+    def iter_anim_asm(self, frames, name):
+        """ Generator with the first frame and the delta frames of an animation in assembly format """
+        first, deltas = self._build_anim(frames)
+        self._start_emit(0.8, len(first) + sum(len(data) for data in deltas))
+        label = name.lower()
+        yield from self._anim_header(';')
+        yield f"{label}_pal:\n"
+        yield '\tdb ' + ', '.join('0x%02X' % x for x in self.palette) + '\n\n'
+        yield from self._iter_asm_db(f"{label}_frame", memoryview(first))
+        if deltas:
+            yield f"{label}_deltas:\n"
+            yield '\tdw ' + ', '.join(f"{label}_delta_{i}" for i in range(len(deltas))) + '\n\n'
+        for i, data in enumerate(deltas):
+            yield from self._iter_asm_db(f"{label}_delta_{i}", memoryview(data))
+
+    def write_anim(self, stream, fmt, frames, name):
+        """ Writes an animation to a text stream in 'c' or 'asm' format """
+        emitters = {'c': self.iter_anim_c, 'asm': self.iter_anim_asm}
+        if fmt not in emitters:
+            raise ConversionError(f"animations can not be exported in {fmt} format")
+        stream.writelines(emitters[fmt](frames, name))
+
+    def code_anim_bin(self, frames):
+        """
+        Returns the first frame followed by the delta frames 1 to n - 1 and
+        then delta 0, preceded by a table of little-endian words with the
+        offset of each block from the beginning of the file.
+        """
+        first, deltas = self._build_anim(frames)
+        blocks = [first] + deltas[1:] + deltas[:1]
+        return with_offsets(blocks)
+
+    def _build_tiles(self, sprite):
+        tilew, tileh = self.tiles
+        ppb = PIXELS_PER_BYTE[self.mode]
+        if tilew <= 0 or tileh <= 0 or tilew % ppb != 0:
+            raise ConversionError(f"tile width must be a multiple of {ppb} pixels in mode {self.mode}")
+        self._build_cpcimg(sprite)
+        tileset = Tileset(tilew // ppb, tileh, self.flips, MIRROR_TABLES[self.mode])
+        tileset.build(self._img2mode(), self.imgw // ppb, self.imgh)
+        self.tiles_report = tileset.report()
+        maps = 2 if self.flips else 1
+        self._start_emit(0.6, len(tileset.tiles) * tileset.tile_bytes() + len(tileset.tilemap) * maps)
+        self._report(0.6)
+        return tileset
+
+    def _tiles_header(self, comment, tileset):
+        yield f"{comment} Tileset created with Tixel\n"
+        yield f"{comment} {self.tiles_report}\n"
+        yield f"{comment} mode {self.mode}, tiles of {self.tiles[0]}x{self.tiles[1]} pixels ({tileset.tile_bytes()} bytes), "
+        yield f"map of {tileset.cols}x{tileset.rows} tiles\n"
+        if len(tileset.tiles) > 256:
+            yield f"{comment} more than 256 tiles: map entries are words\n"
+        if self.flips:
+            yield f"{comment} FLAGS: bit 0 mirrored horizontally, bit 1 mirrored vertically\n"
+        yield '\n'
+
+    def iter_tiles_c(self, sprite, name):
+        """ Generator with the unique tiles and the tilemap in C format """
+        tileset = self._build_tiles(sprite)
+        label = name.upper()
+        strpalette = '{ %s }' % ', '.join('0x%02X' % x for x in self.palette)
+        yield from self._tiles_header('//', tileset)
+        yield f"const unsigned char {label}_PAL[{len(self.palette)}] = {strpalette};\n\n"
+        tilerow = min(16, tileset.tile_bytes())
+        yield from self._iter_c_array(f"{label}_TILES", memoryview(b''.join(tileset.tiles)), tilerow)
+        yield '\n'
+        if len(tileset.tiles) > 256:
+            entries = ', '.join('%d' % index for index, _ in tileset.tilemap)
+            yield f"const unsigned short {label}_MAP[{len(tileset.tilemap)}] = {{ {entries} }};\n"
+        else:
+            yield from self._iter_c_array(f"{label}_MAP", memoryview(tileset.map_bytes()), tileset.cols)
+        if self.flips:
+            yield '\n'
+            yield from self._iter_c_array(f"{label}_FLAGS", memoryview(tileset.flag_bytes()), tileset.cols)
+
+    def iter_tiles_asm(self, sprite, name):
+        """ Generator with the unique tiles and the tilemap in assembly format """
+        tileset = self._build_tiles(sprite)
+        label = name.lower()
+        yield from self._tiles_header(';', tileset)
+        yield f"{label}_pal:\n"
+        yield '\tdb ' + ', '.join('0x%02X' % x for x in self.palette) + '\n\n'
+        tilerow = min(16, tileset.tile_bytes())
+        yield from self._iter_asm_db(f"{label}_tiles", memoryview(b''.join(tileset.tiles)), tilerow)
+        if len(tileset.tiles) > 256:
+            yield f"{label}_map:\n"
+            for offset in range(0, len(tileset.tilemap), tileset.cols):
+                row = tileset.tilemap[offset:offset + tileset.cols]
+                yield '\tdw ' + ', '.join('%d' % index for index, _ in row) + '\n'
+            yield '\n'
+        else:
+            yield from self._iter_asm_db(f"{label}_map", memoryview(tileset.map_bytes()), tileset.cols)
+        if self.flips:
+            yield from self._iter_asm_db(f"{label}_flags", memoryview(tileset.flag_bytes()), tileset.cols)
+
+    def write_tiles(self, stream, fmt, sprite, name):
+        """ Writes the tileset and tilemap of the image to a text stream in 'c' or 'asm' format """
+        emitters = {'c': self.iter_tiles_c, 'asm': self.iter_tiles_asm}
+        if fmt not in emitters:
+            raise ConversionError(f"tilesets can not be exported in {fmt} format")
+        stream.writelines(emitters[fmt](sprite, name))
+
+    def code_tiles_bin(self, sprite):
+        """
+        Returns the tiles, the map and the flags (if enabled) preceded by a
+        table of little-endian words with the offset of each block.
+        """
+        tileset = self._build_tiles(sprite)
+        blocks = [b''.join(tileset.tiles), tileset.map_bytes()]
+        if self.flips:
+            blocks.append(tileset.flag_bytes())
+        return with_offsets(blocks)
+
+    def iter_bas(self, sprite, name):
+        """ Generator with the lines of the sprite as a BASIC program """
         if name == "": name = "unnamed"
         self._build_cpcimg(sprite)
-        code = []
         strpalette = ': '.join('INK %d,%d' % (i,CPC_HW_COLORS[x]) for i,x in enumerate(self.palette))
-        code.append("10 ' BASIC formated sprite created with Tixel\n")
-        code.append(f"20 ' {name}: mode {self.mode}, width {self.imgw}, height {self.imgh}\n")
-        code.append("30 ' Palette:\n")
-        code.append(f"40 ' {strpalette} \n")
-        code.append("50 ' \n")
+        yield "10 ' BASIC formated sprite created with Tixel\n"
+        yield f"20 ' {name}: mode {self.mode}, width {self.imgw}, height {self.imgh}\n"
+        yield "30 ' Palette:\n"
+        yield f"40 ' {strpalette} \n"
+        yield "50 ' \n"
         xcursors = int(self.imgw / 8)
         ycursors = int(self.imgh / 8)
         symbols = 256 - (len(self.palette) * xcursors * ycursors)
-        code.append(f"60 SYMBOL AFTER {symbols}\n")
-        # I know, I know... the next code is not very elegant
+        yield f"60 SYMBOL AFTER {symbols}\n"
         line = 70
         for cindex in range(0,len(self.palette)):
-            code.append(f"{line} ' Symbol definitions for INK {cindex}\n")
+            self._report(0.3 + 0.7 * cindex / len(self.palette))
+            yield f"{line} ' Symbol definitions for INK {cindex}\n"
             line = line + 10
             for y in range(0, ycursors):
                 for x in range(0, xcursors):
@@ -306,18 +955,71 @@ class ImgConverter:
                     for cline in range(0, 8):  # a cursor has 8 lines
                         imgpos = (x * 8) + (self.imgw * (y * 8 + cline))
                         symval = 0
-                        symval = symval + (128 if self.img[imgpos] == cindex else 0)
-                        symval = symval + (64 if self.img[imgpos+1] == cindex else 0)
-                        symval = symval + (32 if self.img[imgpos+2] == cindex else 0)
-                        symval = symval + (16 if self.img[imgpos+3] == cindex else 0)
-                        symval = symval + (8 if self.img[imgpos+4] == cindex else 0)
-                        symval = symval + (4 if self.img[imgpos+5] == cindex else 0)
-                        symval = symval + (2 if self.img[imgpos+6] == cindex else 0)
-                        symval = symval + (1 if self.img[imgpos+7] == cindex else 0)
+                        for bit in range(0, 8):
+                            if self.img[imgpos + bit] == cindex:
+                                symval = symval | (0x80 >> bit)
                         symbol.append(symval)
-                    code.append(f"{line} SYMBOL {symbols}")
+                    yield f"{line} SYMBOL {symbols}" + ''.join(f",{v}" for v in symbol) + "\n"
                     line = line + 10
-                    for v in symbol: code.append(f",{v}")
-                    code.append("\n")
                     symbols = symbols + 1
-        return code
\ No newline at end of file
+
+    def write_code(self, stream, fmt, sprite, name):
+        """
+        Writes the sprite to a text stream in the given format ('c', 'asm', 'bas'
+        or 'z80' for a compiled sprite) line by line, without keeping the whole
+        output in memory.
+        """
+        emitters = {'c': self.iter_c, 'asm': self.iter_asm, 'bas': self.iter_bas, 'z80': self.iter_compiled}
+        if fmt not in emitters:
+            raise ConversionError(f"sprites can not be exported in {fmt} format")
+        stream.writelines(emitters[fmt](sprite, name))
+
+    def code_c(self, sprite, name):
+        return list(self.iter_c(sprite, name))
+
+    def code_asm(self, sprite, name):
+        return list(self.iter_asm(sprite, name))
+
+    def code_compiled(self, sprite, name):
+        return list(self.iter_compiled(sprite, name))
+
+    def packed_image(self, sprite):
+        """
+        Returns the video bytes of the sprite as the CPC shows them: no
+        compression, variants nor masks. The palette is left in self.palette.
+        """
+        self._build_cpcimg(sprite)
+        return self._img2mode()
+
+    def code_bin(self, sprite):
+        """
+        Returns the video bytes of the sprite (compressed if requested). When
+        there is more than one block (pre-shifted variants or separate masks,
+        which follow the images) the file starts with a table of little-endian
+        words holding the offset of each block from the beginning of the file.
+        """
+        self._build_cpcimg(sprite)
+        variants = self._compress_variants(self._variants() + self._mask_variants())
+        if len(variants) == 1:
+            return variants[0]
+        return with_offsets(variants)
+
+    def code_scr(self, sprite):
+        """
+        Returns a 16K dump of the screen memory with the sprite placed at the
+        top left corner, ready to be loaded at SCREEN_ADDRESS (compressed if
+        requested).
+        """
+        rowbytes = self.imgw // PIXELS_PER_BYTE[self.mode]
+        if rowbytes > SCREEN_LINE_BYTES or self.imgh > CPC_SCREEN_SIZES[self.mode][1]:
+            raise ConversionError(f"the image does not fit in a mode {self.mode} screen")
+        self._build_cpcimg(sprite)
+        data = self._img2mode()
+        screen = bytearray(SCREEN_SIZE)
+        for y in range(0, self.imgh):
+            address = (y // 8) * SCREEN_LINE_BYTES + (y % 8) * SCREEN_BLOCK
+            screen[address:address + rowbytes] = data[y * rowbytes:(y + 1) * rowbytes]
+        return self._compress(screen)
+
+    def code_bas(self, sprite, name):
+        return list(self.iter_bas(sprite, name))
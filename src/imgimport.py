@@ -0,0 +1,459 @@
+#!/usr/bin/env python
+
+"""
+IMGIMPORT.PY by Javier Garcia
+
+Imports PNG, BMP and PPM images as Tixel projects. The readers only use the
+standard library (zlib for PNG) and support the usual variants:
+
+PNG  8 bits per channel grey, grey+alpha, RGB and RGBA, and palette images
+     of 1, 2, 4 or 8 bits (not interlaced)
+BMP  uncompressed 24 and 32 bits, and 1, 4 or 8 bits with colour table
+PPM  binary (P6) and ASCII (P3) files with maxval up to 255
+
+The image is reduced to the number of colours of the mode choosing, among the
+27 CPC colours, the ones that minimise the total error of the image (greedy
+selection over a 12 bits histogram, then refined swapping colours). Pixels can
+then be mapped to the nearest selected colour directly, with Floyd-Steinberg
+error diffusion or with an ordered (Bayer 4x4) dither. NumPy is used when
+available.
+"""
+
+import struct
+import zlib
+from colormatch import ColorResolver, METRICS
+from imgconv import CPC_RGB_COLORS, PIXELS_PER_BYTE, ConversionError
+from project import Project
+from sprite import HEX_COLORS
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+IMAGE_EXTENSIONS = ('.png', '.bmp', '.ppm', '.pnm')
+DITHERS = ('none', 'floyd', 'ordered')
+PNG_SIGNATURE = b'\x89PNG\r\n\x1a\n'
+# Bits per channel of the histogram used to select the palette
+HISTOGRAM_BITS = 4
+# Bayer 4x4 threshold matrix and amplitude (in 0-255 units) of the ordered dither
+BAYER4 = (0, 8, 2, 10, 12, 4, 14, 6, 3, 11, 1, 9, 15, 7, 13, 5)
+ORDERED_SPREAD = 64
+# swap passes over the greedy palette (pure python only for small palettes)
+REFINE_PASSES = 4
+REFINE_PURE_COLORS = 4
+
+
+def read_ppm(content):
+    """ Returns (width, height, rgb bytes) of a P3 or P6 image """
+    magic = content[0:2]
+    if magic not in (b'P3', b'P6'):
+        raise ConversionError("unsupported PPM format")
+    fields = []
+    pos = 2
+    # header: width, height and maxval separated by whitespace, with comments
+    while len(fields) < 3:
+        while content[pos:pos + 1].isspace():
+            pos = pos + 1
+        if content[pos:pos + 1] == b'#':
+            while content[pos:pos + 1] not in (b'\n', b''):
+                pos = pos + 1
+            continue
+        start = pos
+        while not content[pos:pos + 1].isspace():
+            pos = pos + 1
+        fields.append(int(content[start:pos]))
+    width, height, maxval = fields
+    if maxval > 255:
+        raise ConversionError("16 bits PPM images are not supported")
+    size = width * height * 3
+    if magic == b'P6':
+        data = content[pos + 1:pos + 1 + size]
+    else:
+        data = bytes(int(v) for v in content[pos:].split()[:size])
+    if len(data) != size:
+        raise ConversionError("truncated PPM image")
+    if maxval != 255:
+        data = data.translate(bytes([min(255, v * 255 // maxval) for v in range(256)]))
+    return width, height, data
+
+
+def read_bmp(content):
+    """ Returns (width, height, rgb bytes) of an uncompressed BMP image """
+    if content[0:2] != b'BM':
+        raise ConversionError("not a BMP image")
+    offset, = struct.unpack_from('<I', content, 10)
+    hsize, width, height, _, bpp, compression = struct.unpack_from('<IiiHHI', content, 14)
+    if compression not in (0, 3) or bpp not in (1, 4, 8, 24, 32):
+        raise ConversionError("unsupported BMP format")
+    topdown = height < 0
+    height = abs(height)
+    stride = (width * bpp + 31) // 32 * 4
+    colors = []
+    if bpp <= 8:
+        ncolors, = struct.unpack_from('<I', content, 46)
+        ncolors = ncolors or (1 << bpp)
+        table = 14 + hsize
+        for i in range(ncolors):
+            b, g, r = content[table + i * 4:table + i * 4 + 3]
+            colors.append(bytes((r, g, b)))
+    rows = []
+    for y in range(height):
+        start = offset + y * stride
+        line = content[start:start + stride]
+        if bpp == 24:
+            row = bytearray(width * 3)
+            row[0::3] = line[2:width * 3:3]
+            row[1::3] = line[1:width * 3:3]
+            row[2::3] = line[0:width * 3:3]
+        elif bpp == 32:
+            row = bytearray(width * 3)
+            row[0::3] = line[2:width * 4:4]
+            row[1::3] = line[1:width * 4:4]
+            row[2::3] = line[0:width * 4:4]
+        else:
+            row = b''.join(colors[i] for i in _unpack_bits(line, bpp, width))
+        rows.append(bytes(row))
+    if not topdown:
+        rows.reverse()
+    return width, height, b''.join(rows)
+
+
+def _unpack_bits(line, bits, count):
+    """ Returns the count values of bits size packed (MSB first) in line """
+    if bits == 8:
+        return line[:count]
+    perbyte = 8 // bits
+    mask = (1 << bits) - 1
+    values = bytearray(len(line) * perbyte)
+    for i in range(perbyte):
+        shift = 8 - bits * (i + 1)
+        values[i::perbyte] = line.translate(bytes([(b >> shift) & mask for b in range(256)]))
+    return values[:count]
+
+
+def _png_unfilter(raw, height, stride, bpp):
+    """ Undoes the PNG row filters, bpp being the bytes per complete pixel """
+    out = bytearray(height * stride)
+    prev = bytearray(stride)
+    pos = 0
+    for y in range(height):
+        ftype = raw[pos]
+        line = bytearray(raw[pos + 1:pos + 1 + stride])
+        pos = pos + 1 + stride
+        if ftype == 1:
+            for i in range(bpp, stride):
+                line[i] = (line[i] + line[i - bpp]) & 0xFF
+        elif ftype == 2:
+            line = bytearray((a + b) & 0xFF for a, b in zip(line, prev))
+        elif ftype == 3:
+            for i in range(stride):
+                left = line[i - bpp] if i >= bpp else 0
+                line[i] = (line[i] + ((left + prev[i]) >> 1)) & 0xFF
+        elif ftype == 4:
+            for i in range(stride):
+                a = line[i - bpp] if i >= bpp else 0
+                b = prev[i]
+                c = prev[i - bpp] if i >= bpp else 0
+                p = a + b - c
+                pa, pb, pc = abs(p - a), abs(p - b), abs(p - c)
+                if pa <= pb and pa <= pc:
+                    pred = a
+                elif pb <= pc:
+                    pred = b
+                else:
+                    pred = c
+                line[i] = (line[i] + pred) & 0xFF
+        elif ftype != 0:
+            raise ConversionError("corrupted PNG image")
+        out[y * stride:(y + 1) * stride] = line
+        prev = line
+    return out
+
+
+def read_png(content):
+    """ Returns (width, height, rgb bytes) of a PNG image """
+    if content[0:8] != PNG_SIGNATURE:
+        raise ConversionError("not a PNG image")
+    pos = 8
+    idat = []
+    palette = b''
+    header = None
+    while pos < len(content):
+        length, ctype = struct.unpack_from('>I4s', content, pos)
+        chunk = content[pos + 8:pos + 8 + length]
+        pos = pos + 12 + length
+        if ctype == b'IHDR':
+            header = struct.unpack('>IIBBBBB', chunk)
+        elif ctype == b'PLTE':
+            palette = chunk
+        elif ctype == b'IDAT':
+            idat.append(chunk)
+        elif ctype == b'IEND':
+            break
+    if header is None:
+        raise ConversionError("corrupted PNG image")
+    width, height, depth, ctype, _, _, interlace = header
+    channels = {0: 1, 2: 3, 3: 1, 4: 2, 6: 4}.get(ctype)
+    if channels is None or interlace != 0 or (depth != 8 and ctype != 3) or depth > 8:
+        raise ConversionError("unsupported PNG format (use 8 bits per channel, not interlaced)")
+    stride = (width * channels * depth + 7) // 8
+    raw = _png_unfilter(zlib.decompress(b''.join(idat)), height, stride, max(1, channels * depth // 8))
+    if ctype == 3:
+        colors = [palette[i * 3:i * 3 + 3] for i in range(len(palette) // 3)]
+        colors.extend([b'\x00\x00\x00'] * (256 - len(colors)))
+        rows = []
+        for y in range(height):
+            line = raw[y * stride:(y + 1) * stride]
+            rows.append(b''.join(colors[i] for i in _unpack_bits(line, depth, width)))
+        return width, height, b''.join(rows)
+    count = width * height
+    rgb = bytearray(count * 3)
+    if ctype in (0, 4):
+        grey = raw[0::channels]
+        rgb[0::3] = grey
+        rgb[1::3] = grey
+        rgb[2::3] = grey
+    else:
+        rgb[0::3] = raw[0::channels]
+        rgb[1::3] = raw[1::channels]
+        rgb[2::3] = raw[2::channels]
+    return width, height, bytes(rgb)
+
+
+def read_image(filename):
+    """ Returns (width, height, rgb bytes) of a PNG, BMP or PPM image """
+    with open(filename, 'rb') as fd:
+        content = fd.read()
+    if content[0:8] == PNG_SIGNATURE:
+        return read_png(content)
+    if content[0:2] == b'BM':
+        return read_bmp(content)
+    if content[0:2] in (b'P3', b'P6'):
+        return read_ppm(content)
+    raise ConversionError(f"unknown image format: {filename}")
+
+
+def histogram(rgb, total=None):
+    """
+    Returns {bucket centre (r, g, b): pixels} using HISTOGRAM_BITS per channel.
+    When total is given the pixels are added to it, so an image can be read
+    in parts.
+    """
+    shift = 8 - HISTOGRAM_BITS
+    half = 1 << (shift - 1)
+    if np is not None:
+        pixels = np.frombuffer(rgb, dtype=np.uint8).reshape(-1, 3) >> shift
+        keys = (pixels[:, 0].astype(np.int32) << (2 * HISTOGRAM_BITS)) | \
+               (pixels[:, 1].astype(np.int32) << HISTOGRAM_BITS) | pixels[:, 2]
+        counts = np.bincount(keys, minlength=1 << (3 * HISTOGRAM_BITS))
+        used = np.nonzero(counts)[0]
+        keys, counts = used.tolist(), counts[used].tolist()
+    else:
+        table = bytes([v >> shift for v in range(256)])
+        quant = bytes(rgb).translate(table)
+        found = {}
+        for i in range(0, len(quant), 3):
+            key = quant[i:i + 3]
+            found[key] = found.get(key, 0) + 1
+        keys = [(k[0] << (2 * HISTOGRAM_BITS)) | (k[1] << HISTOGRAM_BITS) | k[2] for k in found]
+        counts = list(found.values())
+    mask = (1 << HISTOGRAM_BITS) - 1
+    centres = [(((k >> (2 * HISTOGRAM_BITS)) << shift) + half, (((k >> HISTOGRAM_BITS) & mask) << shift) + half,
+                ((k & mask) << shift) + half) for k in keys]
+    if total is None:
+        return dict(zip(centres, counts))
+    for centre, n in zip(centres, counts):
+        total[centre] = total.get(centre, 0) + n
+    return total
+
+
+def select_palette(rgb, count, metric='manhattan'):
+    """
+    Chooses the count CPC colours (firmware indices) that minimise the error of
+    the image: starting with an empty palette, each step adds the colour that
+    reduces more the sum of the distances from every pixel to its nearest
+    palette colour. Colours that would not reduce the error are not added.
+    """
+    return palette_from_histogram(histogram(rgb), count, metric)
+
+
+def palette_from_histogram(counts, count, metric='manhattan'):
+    """ Same as select_palette but from a histogram (see histogram()) """
+    transform, distance = METRICS[metric]
+    colors = list(counts.keys())
+    weights = list(counts.values())
+    targets = [transform(c) for c in CPC_RGB_COLORS]
+    values = [transform(c) for c in colors]
+    # distances[c][u]: from CPC colour c to histogram colour u
+    distances = [[distance(v, t) for v in values] for t in targets]
+    if np is not None:
+        return _select_numpy(np.array(distances, dtype=np.float64), np.array(weights, dtype=np.float64), count)
+    return _select_pure(distances, weights, count)
+
+
+def _select_numpy(dist, weight, count):
+    selected = []
+    current = np.full(dist.shape[1], np.inf)
+    for _ in range(count):
+        errors = (np.minimum(dist, current) * weight).sum(axis=1)
+        errors[selected] = np.inf
+        best = int(np.argmin(errors))
+        if selected and errors[best] >= (current * weight).sum():
+            break
+        selected.append(best)
+        current = np.minimum(current, dist[best])
+    # greedy choices can be stuck with an early colour (the average of two
+    # others, for instance): try replacing each one while the error goes down
+    total = (current * weight).sum()
+    for _ in range(REFINE_PASSES):
+        changed = False
+        for i in range(len(selected)):
+            others = [c for j, c in enumerate(selected) if j != i]
+            rest = dist[others].min(axis=0) if others else np.full(dist.shape[1], np.inf)
+            errors = (np.minimum(dist, rest) * weight).sum(axis=1)
+            errors[others] = np.inf
+            best = int(np.argmin(errors))
+            if errors[best] < total:
+                total = errors[best]
+                selected[i] = best
+                changed = True
+        if not changed:
+            break
+    return selected
+
+
+def _select_pure(distances, weights, count):
+    def error(palette):
+        rows = [distances[c] for c in palette]
+        return sum(w * min(ds) for w, ds in zip(weights, zip(*rows)))
+
+    selected = []
+    current = [float('inf')] * len(weights)
+    total = float('inf')
+    for _ in range(count):
+        best = None
+        for c, row in enumerate(distances):
+            if c in selected:
+                continue
+            value = sum(w * (d if d < cur else cur) for d, cur, w in zip(row, current, weights))
+            if best is None or value < best[0]:
+                best = (value, c)
+        if best is None or best[0] >= total:
+            break
+        total = best[0]
+        selected.append(best[1])
+        current = [min(d, cur) for d, cur in zip(distances[best[1]], current)]
+    # same refinement as with numpy, only for small palettes as it is slow
+    if len(selected) > REFINE_PURE_COLORS:
+        return selected
+    for _ in range(REFINE_PASSES):
+        changed = False
+        for i in range(len(selected)):
+            for c in range(len(distances)):
+                if c in selected:
+                    continue
+                candidate = selected[:i] + [c] + selected[i + 1:]
+                value = error(candidate)
+                if value < total:
+                    total = value
+                    selected = candidate
+                    changed = True
+        if not changed:
+            break
+    return selected
+
+
+def _clamp(v):
+    return 0 if v < 0 else (255 if v > 255 else v)
+
+
+def quantize(rgb, width, height, palette, dither='none', metric='manhattan'):
+    """
+    Maps every pixel of the image to the nearest colour of palette (list of
+    firmware indices). Returns a bytearray with the firmware index of each
+    pixel. Colours are resolved at 15 bits, each one only once.
+    """
+    resolver = ColorResolver([CPC_RGB_COLORS[i] for i in palette], metric)
+    fw = bytes(palette)
+
+    def nearest(r, g, b):
+        # resolving the bucket centre keeps the number of searches bounded
+        return resolver.resolve(((r & 0xF8) | 4) << 16 | ((g & 0xF8) | 4) << 8 | ((b & 0xF8) | 4))
+
+    count = width * height
+    if dither == 'floyd':
+        out = bytearray(count)
+        # errors carried to the current and the next row, one list per channel
+        cur = [[0.0] * (width + 2) for _ in range(3)]
+        for y in range(height):
+            nxt = [[0.0] * (width + 2) for _ in range(3)]
+            base = y * width
+            for x in range(width):
+                i = (base + x) * 3
+                r = _clamp(int(rgb[i] + cur[0][x + 1]))
+                g = _clamp(int(rgb[i + 1] + cur[1][x + 1]))
+                b = _clamp(int(rgb[i + 2] + cur[2][x + 1]))
+                index = nearest(r, g, b)
+                out[base + x] = fw[index]
+                pr, pg, pb = CPC_RGB_COLORS[palette[index]]
+                for ch, e in ((0, r - pr), (1, g - pg), (2, b - pb)):
+                    if e:
+                        cur[ch][x + 2] = cur[ch][x + 2] + e * 7 / 16
+                        nxt[ch][x] = nxt[ch][x] + e * 3 / 16
+                        nxt[ch][x + 1] = nxt[ch][x + 1] + e * 5 / 16
+                        nxt[ch][x + 2] = nxt[ch][x + 2] + e / 16
+            cur = nxt
+        return out
+    if dither == 'ordered':
+        offsets = [(v - 7.5) * ORDERED_SPREAD / 16 for v in BAYER4]
+        if np is not None:
+            pixels = np.frombuffer(rgb, dtype=np.uint8).reshape(height, width, 3)
+            ys, xs = np.mgrid[0:height, 0:width]
+            threshold = np.array(offsets)[(ys % 4) * 4 + xs % 4]
+            rgb = np.clip(pixels + threshold[:, :, None], 0, 255).astype(np.uint8).tobytes()
+        else:
+            shifted = bytearray(count * 3)
+            for y in range(height):
+                row = [offsets[(y % 4) * 4 + x % 4] for x in range(4)]
+                for x in range(width):
+                    i = (y * width + x) * 3
+                    o = row[x % 4]
+                    shifted[i] = _clamp(int(rgb[i] + o))
+                    shifted[i + 1] = _clamp(int(rgb[i + 1] + o))
+                    shifted[i + 2] = _clamp(int(rgb[i + 2] + o))
+            rgb = bytes(shifted)
+    if np is not None:
+        pixels = np.frombuffer(rgb, dtype=np.uint8).reshape(-1, 3).astype(np.int32)
+        keys = (pixels[:, 0] << 16) | (pixels[:, 1] << 8) | pixels[:, 2]
+        unique, inverse = np.unique(keys, return_inverse=True)
+        lut = np.array([fw[nearest(k >> 16, (k >> 8) & 0xFF, k & 0xFF)] for k in unique.tolist()], dtype=np.uint8)
+        return bytearray(lut[inverse].tobytes())
+    out = bytearray(count)
+    for p in range(count):
+        i = p * 3
+        out[p] = fw[nearest(rgb[i], rgb[i + 1], rgb[i + 2])]
+    return out
+
+
+def import_image(filename, mode, dither='none', metric='manhattan'):
+    """
+    Returns a new Project (of the given mode) with the image. Its width is
+    padded to a whole number of video bytes with the first palette colour.
+    """
+    if dither not in DITHERS:
+        raise ValueError(f"unknown dithering '{dither}'")
+    width, height, rgb = read_image(filename)
+    colors = [16, 4, 2][mode]
+    palette = select_palette(rgb, colors, metric)
+    pixels = quantize(rgb, width, height, palette, dither, metric)
+    ppb = PIXELS_PER_BYTE[mode]
+    padded = (width + ppb - 1) // ppb * ppb
+    bg = palette[0]
+    project = Project(mode, padded, height, HEX_COLORS[bg])
+    project.btn1color = HEX_COLORS[palette[1 % len(palette)]]
+    project.btn2color = HEX_COLORS[palette[2 % len(palette)]]
+    data = project.sprite.pixels
+    for y in range(height):
+        data[y * padded:y * padded + width] = type(data)('B', pixels[y * width:(y + 1) * width])
+    return project
@@ -0,0 +1,203 @@
+#!/usr/bin/env python
+
+"""
+IMGSTREAM.PY by Javier Garcia
+
+Converts large uncompressed images (PPM P6, BMP of 24 or 32 bits and raw RGB
+files) straight into packed CPC video bytes without loading them. The file is
+mapped with mmap and read in bands of BAND_ROWS rows: PPM and top-down BMP
+rows are memoryviews of the mapping, other rows go through one reusable
+buffer. Each band is resolved to pens with a 15 bits lookup table filled as
+new colours appear and packed with pack_pixels, so memory use only depends
+on the width of the image:
+
+with ImageStream('sheet.ppm') as image:
+    palette = stream_palette(image, 1)
+    with open('sheet.bin', 'wb') as fd:
+        convert_stream(image, 1, palette, fd)
+"""
+
+import mmap
+import struct
+from colormatch import ColorResolver
+from imgconv import CPC_RGB_COLORS, PIXELS_PER_BYTE, ConversionError, pack_pixels
+from imgimport import histogram, palette_from_histogram
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+STREAM_EXTENSIONS = ('.ppm', '.pnm', '.bmp', '.rgb')
+# Rows converted at once
+BAND_ROWS = 64
+# Marks the entries of the lookup table still not resolved
+UNRESOLVED = 0xFF
+
+
+class ImageStream:
+    """
+    Memory mapped image. rows(y0, y1) returns the RGB bytes of rows y0 to y1
+    (excluded). Raw RGB files have no header so their width must be given.
+    """
+    def __init__(self, filename, width=None):
+        self.filename = filename
+        self.fd = open(filename, 'rb')
+        try:
+            self.map = mmap.mmap(self.fd.fileno(), 0, access=mmap.ACCESS_READ)
+        except ValueError:
+            self.fd.close()
+            raise ConversionError(f"empty image: {filename}")
+        self.view = memoryview(self.map)
+        self.bgr = False        # channels stored as B, G, R
+        self.bottom_up = False  # first row stored at the end
+        self.pixel = 3          # bytes per pixel
+        try:
+            if self.map[0:2] == b'P6':
+                self._parse_ppm()
+            elif self.map[0:2] == b'BM':
+                self._parse_bmp()
+            elif width is not None:
+                self.width = width
+                self.height = len(self.map) // (width * 3)
+                self.offset = 0
+                self.stride = width * 3
+            else:
+                raise ConversionError(f"{filename}: unknown format, the width is needed for raw RGB files")
+            if self.offset + self.stride * self.height > len(self.map):
+                raise ConversionError(f"{filename}: truncated image")
+        except Exception:
+            self.close()
+            raise
+        self.buffer = bytearray(self.width * 3 * BAND_ROWS)
+
+    def _parse_ppm(self):
+        fields = []
+        pos = 2
+        while len(fields) < 3:
+            while self.map[pos:pos + 1].isspace():
+                pos = pos + 1
+            if self.map[pos:pos + 1] == b'#':
+                pos = self.map.find(b'\n', pos)
+                continue
+            end = pos
+            while self.map[end:end + 1].isdigit():
+                end = end + 1
+            if end == pos:
+                raise ConversionError(f"{self.filename}: bad PPM header")
+            fields.append(int(self.map[pos:end]))
+            pos = end
+        self.width, self.height, maxval = fields
+        if maxval != 255:
+            raise ConversionError(f"{self.filename}: only PPM files with maxval 255 can be streamed")
+        self.offset = pos + 1
+        self.stride = self.width * 3
+
+    def _parse_bmp(self):
+        offset, = struct.unpack_from('<I', self.map, 10)
+        width, height, _, bits, compression = struct.unpack_from('<iiHHI', self.map, 18)
+        if bits not in (24, 32) or compression not in (0, 3):
+            raise ConversionError(f"{self.filename}: only uncompressed 24 and 32 bits BMP files can be streamed")
+        self.width = width
+        self.height = abs(height)
+        self.bottom_up = height > 0
+        self.bgr = True
+        self.pixel = bits // 8
+        self.offset = offset
+        self.stride = (self.width * self.pixel + 3) // 4 * 4
+
+    def rows(self, y0, y1):
+        """ RGB bytes of the rows, only valid until the next call """
+        if not self.bgr and not self.bottom_up:
+            return self.view[self.offset + y0 * self.stride:self.offset + y1 * self.stride]
+        size = self.width * 3
+        out = memoryview(self.buffer)[0:(y1 - y0) * size]
+        for i, y in enumerate(range(y0, y1)):
+            if self.bottom_up:
+                y = self.height - 1 - y
+            start = self.offset + y * self.stride
+            row = self.view[start:start + self.width * self.pixel]
+            dest = out[i * size:(i + 1) * size]
+            if self.bgr:
+                dest[0::3] = row[2::self.pixel]
+                dest[1::3] = row[1::self.pixel]
+                dest[2::3] = row[0::self.pixel]
+            else:
+                dest[:] = row
+        return out
+
+    def bands(self):
+        """ Yields (y, rgb) for each band of BAND_ROWS rows """
+        for y in range(0, self.height, BAND_ROWS):
+            yield y, self.rows(y, min(self.height, y + BAND_ROWS))
+
+    def close(self):
+        self.view.release()
+        self.map.close()
+        self.fd.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+
+def stream_palette(image, mode, metric='manhattan'):
+    """ Best CPC colours (firmware indices) for the mode, reading the image band by band """
+    counts = {}
+    for _, rgb in image.bands():
+        histogram(rgb, counts)
+    return palette_from_histogram(counts, [16, 4, 2][mode], metric)
+
+
+def convert_stream(image, mode, palette, out, metric='manhattan'):
+    """
+    Writes to out (binary stream) the video bytes of the image in the given
+    mode, row after row, using palette (list of firmware indices) for the
+    pens. Rows are padded with pen 0 to whole bytes. Returns the bytes written.
+    """
+    resolver = ColorResolver([CPC_RGB_COLORS[i] for i in palette], metric)
+    ppb = PIXELS_PER_BYTE[mode]
+    width = image.width
+    padded = (width + ppb - 1) // ppb * ppb
+    # pen of every 15 bits colour, resolved with the centre of its bucket
+    lut = bytearray([UNRESOLVED]) * (1 << 15)
+    written = 0
+    if np is not None:
+        table = np.frombuffer(lut, dtype=np.uint8)
+    for y, rgb in image.bands():
+        rows = len(rgb) // (width * 3)
+        if np is not None:
+            pixels = np.frombuffer(rgb, dtype=np.uint8).reshape(rows, width, 3) >> 3
+            keys = (pixels[:, :, 0].astype(np.int32) << 10) | (pixels[:, :, 1].astype(np.int32) << 5) | pixels[:, :, 2]
+            for key in np.unique(keys[table[keys] == UNRESOLVED]).tolist():
+                lut[key] = _resolve_key(resolver, key)
+            pens = np.zeros((rows, padded), dtype=np.uint8)
+            pens[:, 0:width] = table[keys]
+            pens = pens.tobytes()
+        else:
+            data = bytes(rgb)
+            pens = bytearray(rows * padded)
+            for row in range(rows):
+                start = row * width * 3
+                reds = data[start:start + width * 3:3]
+                greens = data[start + 1:start + width * 3:3]
+                blues = data[start + 2:start + width * 3:3]
+                base = row * padded
+                for x, (r, g, b) in enumerate(zip(reds, greens, blues)):
+                    key = (r >> 3) << 10 | (g >> 3) << 5 | b >> 3
+                    pen = lut[key]
+                    if pen == UNRESOLVED:
+                        pen = _resolve_key(resolver, key)
+                        lut[key] = pen
+                    pens[base + x] = pen
+        data = pack_pixels(pens, mode)
+        out.write(data)
+        written = written + len(data)
+    return written
+
+
+def _resolve_key(resolver, key):
+    r, g, b = (key >> 10) << 3 | 4, ((key >> 5) & 0x1F) << 3 | 4, (key & 0x1F) << 3 | 4
+    return resolver.resolve(r << 16 | g << 8 | b)
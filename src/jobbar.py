@@ -0,0 +1,35 @@
+import tkinter as tk
+from tkinter import ttk
+
+class JobBar(tk.Frame):
+    """ Progress of the running background job with a button to cancel it """
+    def __init__(self, parent):
+        super().__init__(parent, pady=2, padx=5)
+        self.text = tk.StringVar(master=self, value='')
+        self.label = tk.Label(self, textvariable=self.text, anchor='w')
+        self.label.grid(row=0, column=0, sticky='w', padx=5)
+        self.bar = ttk.Progressbar(self, orient='horizontal', length=200, mode='determinate', maximum=1.0)
+        self.bar.grid(row=0, column=1, padx=5)
+        self.button = tk.Button(self, text='Cancel')
+        self.button.grid(row=0, column=2, padx=5)
+        self.grid_columnconfigure(0, weight=1)
+        self.title = ''
+
+    def start(self, title, cancel):
+        self.title = title
+        self.text.set(title)
+        self.bar.configure(value=0)
+        self.button.configure(command=cancel, state='normal')
+        self.grid()
+
+    def set_progress(self, fraction, text=None):
+        self.bar.configure(value=fraction)
+        if text:
+            self.text.set(f"{self.title}: {text}")
+
+    def set_text(self, text):
+        self.text.set(text)
+        self.button.configure(state='disabled')
+
+    def stop(self):
+        self.grid_remove()
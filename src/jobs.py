@@ -0,0 +1,117 @@
+#!/usr/bin/env python
+
+"""
+JOBS.PY by Javier Garcia
+
+Runs long tasks (conversions, exports, loading and saving projects) in a
+worker thread so the editor keeps responding. The worker only talks to Tk
+through a queue that the main loop polls with after(): progress updates and
+the final result or error are delivered there, and the callbacks given to
+start() always run in the main thread.
+
+Jobs receive a Job object and must call job.progress() from time to time;
+once the user cancels the job that call raises JobCancelled, so work stops
+at the next step and nothing else is written. Jobs must not touch Tk widgets
+nor the editor sprites: they get copies of what they need.
+"""
+
+import queue
+import threading
+from atomicfile import atomic_open
+
+# Milliseconds between checks of the queue
+POLL_MS = 40
+
+
+class JobCancelled(Exception):
+    pass
+
+
+class Job:
+    def __init__(self, title, events):
+        self.title = title
+        self.events = events
+        self.cancelled = threading.Event()
+
+    def progress(self, fraction, text=None):
+        """ Reports the progress (0 to 1) of the job, raises JobCancelled if cancelled """
+        if self.cancelled.is_set():
+            raise JobCancelled()
+        self.events.put(('progress', fraction, text))
+
+
+def write_output(job, filename, data):
+    """ Last step of the binary exports: writes data (str or bytes) to filename atomically """
+    job.progress(0.95, "writing")
+    with atomic_open(filename, 'w' if isinstance(data, str) else 'wb') as fd:
+        fd.write(data)
+    return filename
+
+
+class JobRunner:
+    """
+    Runs one job at a time. bar is the widget showing the progress (see
+    JobBar), it is shown while a job is running.
+    """
+    def __init__(self, root, bar):
+        self.root = root
+        self.bar = bar
+        self.events = queue.Queue()
+        self.job = None
+        self.done = None
+        self.failed = None
+
+    def busy(self):
+        return self.job is not None
+
+    def start(self, title, work, done=None, failed=None):
+        """
+        Runs work(job) in a worker thread. When it ends done(result) or
+        failed(exception) are called in the main thread; nothing is called
+        if the job is cancelled. Returns False if another job is running.
+        """
+        if self.busy():
+            return False
+        self.job = Job(title, self.events)
+        self.done = done
+        self.failed = failed
+        self.bar.start(title, self.cancel)
+        worker = threading.Thread(target=self._run, args=(self.job, work), daemon=True)
+        worker.start()
+        self.root.after(POLL_MS, self._poll)
+        return True
+
+    def cancel(self):
+        if self.job is not None:
+            self.job.cancelled.set()
+            self.bar.set_text(f"{self.job.title}: cancelling...")
+
+    def _run(self, job, work):
+        try:
+            self.events.put(('done', work(job)))
+        except JobCancelled:
+            self.events.put(('cancelled', None))
+        except Exception as e:
+            self.events.put(('failed', e))
+
+    def _poll(self):
+        while True:
+            try:
+                event = self.events.get_nowait()
+            except queue.Empty:
+                break
+            if event[0] == 'progress':
+                self.bar.set_progress(event[1], event[2])
+                continue
+            self._finish(event[0], event[1])
+            return
+        self.root.after(POLL_MS, self._poll)
+
+    def _finish(self, kind, value):
+        callback = {'done': self.done, 'failed': self.failed}.get(kind)
+        self.job = None
+        self.done = None
+        self.failed = None
+        self.bar.stop()
+        if callback is not None:
+            callback(value)
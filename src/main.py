@@ -1,17 +1,25 @@
 import tkinter as tk
 from tkinter import filedialog
 from tkinter import messagebox
+from tkinter import simpledialog
 from pixelgrid import PixelGrid, PixelGridMode
+from gridrender import ImageRenderer, RectRenderer
 from toolframe import ToolFrame, Tools
 from menu import AppMenu, MenuActions
 from colorbar import ColorBar
 from newdlg import NewDialog
 from codedlg import CodeDialog
-from imgconv import ImgConverter
+from imgconv import ImgConverter, SCREEN_ADDRESS
+from convcache import ConversionCache
+from jobs import JobRunner, write_output
+from atomicfile import atomic_open
+from jobbar import JobBar
+from preview import CPCPreview
+from amsdos import amsdos_header
+from imgimport import import_image
+from project import Project, load_project, save_project, TIXEL_VERSION
+from sprite import Sprite, HEX2INDEX
 from pathlib import Path
-import json
-
-TIXEL_VERSION = "1.0.0"
 
 class TixelApp:
     def __init__(self, root):
@@ -21,11 +29,15 @@ class TixelApp:
         self.scrnmode = 1
         self.current_prj = ""
         self.bgcolor = "#FFFFFF"
+        self.frames = []
+        self.frame = 0
+        self.conv_cache = ConversionCache()
 
         self.root = root
         self.setup_menu()
         self.setup_canvas()
         self.setup_tools()
+        self.setup_preview()
 
     def project_new(self):
         newwin = NewDialog(self.scrnmode, self.resolution, self.bgcolor)
@@ -36,51 +48,78 @@ class TixelApp:
         self.bgcolor = newwin.get_bgcolor()
         self.newproject()
 
+    def run_job(self, title, work, done=None, error_title="Error", on_error=None):
+        """
+        Runs work(job) in the background (see jobs.py), errors are shown in a
+        message box and then on_error() is called
+        """
+        def failed(e):
+            messagebox.showerror(error_title, str(e))
+            if on_error is not None:
+                on_error()
+        if not self.jobs.start(title, work, done, failed):
+            messagebox.showinfo(title, f"Please wait until '{self.jobs.job.title}' finishes or cancel it")
+
     def project_open(self):
         f = filedialog.askopenfilename(
             title = "Open Project",
             defaultextension=".tpj",
             filetypes = (("Tixel project","*.tpj"), ("all files","*.*"))
         )
-        if f is not None:
-            try:
-                with open(f, 'r') as fd:
-                    content = fd.readlines()
-                    strcont = '\n'.join(content)
-                    data = json.loads(strcont)
-                    self.scrnmode = data['mode']
-                    self.width = data['width']
-                    self.height = data['height']
-                    self.tool_frame.draw_color(0, data['btn1color'])
-                    self.tool_frame.draw_color(1, data['btn2color'])
-                    self.bgcolor = data['bgcolor']
-                    self.tool_frame.erase_color(self.bgcolor)
-                    self.canvas.set_pixels(data['pixels'])
-                    self.canvas.set_color(0, data['btn1color'])
-                    self.canvas.set_color(1, data['btn2color'])
-                    self.canvas.set_bgcolor(self.bgcolor)
+        if f:
+            def done(project):
+                self.show_project(project)
                 self.current_prj = f
                 self.updatetitle()
-            except Exception as e:
-                messagebox.showerror("Open error", str(e))
+            def work(job):
+                return load_project(f, lambda fraction: job.progress(fraction, "reading"))
+            self.run_job("Opening project", work, done, "Open error")
+
+    def project_import(self):
+        f = filedialog.askopenfilename(
+            title = "Import Image",
+            filetypes = (("Images","*.png *.bmp *.ppm *.pnm"), ("all files","*.*"))
+        )
+        if f:
+            mode = simpledialog.askinteger("Import Image", "Screen mode (0-2):",
+                                           initialvalue=self.scrnmode, minvalue=0, maxvalue=2)
+            if mode is None:
+                return
+            dither = self.menu.dithering.get()
+            def done(project):
+                self.current_prj = ""
+                self.show_project(project)
+            self.run_job("Importing image", lambda job: import_image(f, mode, dither), done, "Import error")
+
+    def show_project(self, project):
+        self.scrnmode = project.mode
+        self.width = project.width
+        self.height = project.height
+        self.tool_frame.draw_color(0, project.btn1color)
+        self.tool_frame.draw_color(1, project.btn2color)
+        self.bgcolor = project.bgcolor
+        self.newproject()
+        self.frames = project.frames
+        self.show_frame(0)
+        self.canvas.set_color(0, project.btn1color)
+        self.canvas.set_color(1, project.btn2color)
+        self.canvas.set_bgcolor(self.bgcolor)
+        self.tool_frame.set_transparent(project.transparent)
 
     def project_save(self, f):
-        try:
-            data = {}
-            data['mode'] = self.scrnmode
-            data['width'] = self.width
-            data['height'] = self.height
-            data['btn1color'], data['btn2color'] = self.tool_frame.get_currentcolors()
-            data['bgcolor'] = self.bgcolor
-            data['pixels'] = self.canvas.get_pixels()
-            with open(f, 'w') as fd:
-                content = json.dumps(data)
-                fd.write(content)
+        project = Project(self.scrnmode, self.width, self.height, self.bgcolor)
+        project.btn1color, project.btn2color = self.tool_frame.get_currentcolors()
+        project.transparent = self.tool_frame.get_transparent()
+        # the editor can go on changing the frames while they are saved
+        project.frames = [sprite.copy() for sprite in self.frames]
+        def work(job):
+            save_project(f, project, progress=lambda fraction: job.progress(fraction, "writing"))
+        def done(result):
             self.current_prj = f
             self.updatetitle()
-        except Exception as e:
-            messagebox.showerror("Save error", str(e))
+        def failed():
             self.current_prj = ""
+        self.run_job("Saving project", work, done, "Save error", failed)
 
     def project_save_as(self):
         f = filedialog.asksaveasfilename(
@@ -88,7 +127,7 @@ class TixelApp:
             defaultextension=".tpj",
             filetypes = (("Tixel project","*.tpj"), ("all files","*.*"))
         )
-        if f is not None:
+        if f:
             self.project_save(f)
 
     def menu_file_action(self, action):
@@ -96,6 +135,8 @@ class TixelApp:
             self.project_new()
         elif action == MenuActions.FILE_OPEN:
             self.project_open()
+        elif action == MenuActions.FILE_IMPORT:
+            self.project_import()
         elif action == MenuActions.FILE_SAVE:
             if self.current_prj == "":
                 self.project_save_as()
@@ -108,8 +149,45 @@ class TixelApp:
 
     def menu_edit_action(self, action):
         if action == MenuActions.EDIT_UNDO:
-            self.canvas.undo_pop()
+            self.canvas.undo()
+            self.updatetitle()
+        elif action == MenuActions.EDIT_REDO:
+            self.canvas.redo()
             self.updatetitle()
+        elif action == MenuActions.EDIT_FILL_DIAGONAL:
+            self.canvas.set_fill_diagonal(self.menu.fill_diagonal.get())
+
+    def menu_view_action(self, action):
+        if action == MenuActions.VIEW_ZOOM_IN:
+            self.canvas.zoom_in()
+        elif action == MenuActions.VIEW_ZOOM_OUT:
+            self.canvas.zoom_out()
+        elif action == MenuActions.VIEW_ZOOM_RESET:
+            self.canvas.zoom_reset()
+        elif action == MenuActions.VIEW_GRID:
+            self.canvas.set_grid(self.menu.show_grid.get())
+        elif action == MenuActions.VIEW_FAST_RENDER:
+            renderer = ImageRenderer if self.menu.fast_render.get() else RectRenderer
+            self.canvas.set_renderer(renderer)
+        elif action == MenuActions.VIEW_PREVIEW:
+            if self.menu.show_preview.get():
+                self.preview.grid()
+                self.update_preview(None)
+            else:
+                self.preview.grid_remove()
+        elif action == MenuActions.VIEW_PREVIEW_SCALE:
+            self.preview.set_scale(self.menu.preview_scale.get())
+            self.update_preview(None)
+
+    def update_preview(self, dirty):
+        """ Shows the edited frame in the preview, dirty is None when all of it changed """
+        if not self.menu.show_preview.get():
+            return
+        conv = ImgConverter(self.width, self.height, self.scrnmode,
+                            transparent=self.tool_frame.get_transparent(), cache=self.preview_cache)
+        packed = conv.packed_image(self.canvas.sprite.pixels)
+        changed = None if dirty is None else self.preview_cache.changed
+        self.preview.show(self.scrnmode, self.width, self.height, packed, conv.palette, changed)
 
     def menu_transform_action(self, action):
         if action == MenuActions.TRANSFORM_VERT:
@@ -119,26 +197,173 @@ class TixelApp:
             self.canvas.mirrorhor()
             self.updatetitle()
 
+    def show_frame(self, index):
+        self.frame = index
+        onion = None
+        if self.menu.onion_skin.get() and index > 0:
+            onion = self.frames[index - 1]
+        self.canvas.show_frame(self.frames[index], onion)
+        self.updatetitle()
+
+    def menu_frame_action(self, action):
+        if action == MenuActions.FRAME_NEW:
+            sprite = Sprite(self.scrnmode, self.width, self.height, HEX2INDEX[self.bgcolor])
+            self.frames.insert(self.frame + 1, sprite)
+            self.show_frame(self.frame + 1)
+        elif action == MenuActions.FRAME_DUPLICATE:
+            self.frames.insert(self.frame + 1, self.frames[self.frame].copy())
+            self.show_frame(self.frame + 1)
+        elif action == MenuActions.FRAME_DELETE:
+            if len(self.frames) > 1:
+                del self.frames[self.frame]
+                self.show_frame(min(self.frame, len(self.frames) - 1))
+        elif action == MenuActions.FRAME_PREV:
+            self.show_frame((self.frame - 1) % len(self.frames))
+        elif action == MenuActions.FRAME_NEXT:
+            self.show_frame((self.frame + 1) % len(self.frames))
+        elif action == MenuActions.FRAME_ONION:
+            self.show_frame(self.frame)
+
     def code_view(self, content):
         codewin = CodeDialog()
         self.root.eval(f'tk::PlaceWindow {str(codewin)} center')
         codewin.set_code(content)
         self.root.wait_window(codewin)
 
+    def new_converter(self):
+        compression = self.menu.compression.get()
+        if compression == 'none':
+            compression = None
+        masked = self.menu.masked.get()
+        if masked == 'none':
+            masked = None
+        return ImgConverter(self.width, self.height, self.scrnmode, compression=compression,
+                            preshift=self.menu.preshift.get(),
+                            transparent=self.tool_frame.get_transparent(), masked=masked,
+                            cache=self.conv_cache)
+
+    def code_export(self):
+        f = filedialog.asksaveasfilename(
+            title = "Export to File",
+            defaultextension=".c",
+            filetypes = (("C source","*.c"), ("Assembly source","*.asm"), ("BASIC program","*.bas"),
+                         ("Compiled sprite","*.z80"))
+        )
+        if f:
+            fmt = Path(f).suffix.lower().lstrip('.')
+            if fmt not in ('c', 'asm', 'bas', 'z80'):
+                messagebox.showerror("Export error", f"Unknown export format '{fmt}'")
+                return
+            conv = self.new_converter()
+            sprite = bytes(self.canvas.sprite.pixels)
+            def work(job):
+                conv.progress = lambda fraction: job.progress(fraction, "converting")
+                with atomic_open(f) as fd:
+                    conv.write_code(fd, fmt, sprite, Path(f).stem)
+            self.run_job("Exporting", work, None, "Export error")
+
+    def code_export_bin(self):
+        f = filedialog.asksaveasfilename(
+            title = "Export Binary",
+            defaultextension=".bin",
+            filetypes = (("Sprite binary","*.bin"), ("Screen dump","*.scr"))
+        )
+        if f:
+            scr = Path(f).suffix.lower() == '.scr'
+            load = SCREEN_ADDRESS if scr else 0x4000
+            header = messagebox.askyesno(
+                "Export Binary",
+                f"Add an AMSDOS header (load address &{load:04X})?"
+            )
+            conv = self.new_converter()
+            sprite = bytes(self.canvas.sprite.pixels)
+            def work(job):
+                conv.progress = lambda fraction: job.progress(fraction * 0.9, "converting")
+                data = conv.code_scr(sprite) if scr else conv.code_bin(sprite)
+                if header:
+                    data = amsdos_header(Path(f).name, len(data), load) + data
+                write_output(job, f, data)
+            self.run_job("Exporting binary", work, None, "Export error")
+
+    def code_export_anim(self):
+        f = filedialog.asksaveasfilename(
+            title = "Export Animation",
+            defaultextension=".asm",
+            filetypes = (("Assembly source","*.asm"), ("C source","*.c"), ("Animation binary","*.bin"))
+        )
+        if f:
+            conv = self.new_converter()
+            frames = [bytes(sprite.pixels) for sprite in self.frames]
+            fmt = Path(f).suffix.lower().lstrip('.')
+            def work(job):
+                conv.progress = lambda fraction: job.progress(fraction, "converting frames")
+                if fmt == 'bin':
+                    write_output(job, f, conv.code_anim_bin(frames))
+                else:
+                    with atomic_open(f) as fd:
+                        conv.write_anim(fd, fmt, frames, Path(f).stem)
+            self.run_job("Exporting animation", work, None, "Export error")
+
+    def code_export_tiles(self):
+        size = simpledialog.askstring("Export Tileset", "Tile size in pixels (WxH):", initialvalue="8x8")
+        if not size:
+            return
+        try:
+            width, height = (int(v) for v in size.lower().split('x'))
+        except ValueError:
+            messagebox.showerror("Export error", f"Invalid tile size '{size}'")
+            return
+        flips = messagebox.askyesno("Export Tileset", "Reuse mirrored tiles?")
+        f = filedialog.asksaveasfilename(
+            title = "Export Tileset",
+            defaultextension=".asm",
+            filetypes = (("Assembly source","*.asm"), ("C source","*.c"), ("Tileset binary","*.bin"))
+        )
+        if f:
+            conv = self.new_converter()
+            conv.tiles = (width, height)
+            conv.flips = flips
+            sprite = bytes(self.canvas.sprite.pixels)
+            fmt = Path(f).suffix.lower().lstrip('.')
+            def work(job):
+                conv.progress = lambda fraction: job.progress(fraction, "building tiles")
+                if fmt == 'bin':
+                    write_output(job, f, conv.code_tiles_bin(sprite))
+                else:
+                    with atomic_open(f) as fd:
+                        conv.write_tiles(fd, fmt, sprite, Path(f).stem)
+                return conv.tiles_report
+            done = lambda report: messagebox.showinfo("Export Tileset", report)
+            self.run_job("Exporting tileset", work, done, "Export error")
+
     def menu_code_action(self, action):
-        conv = ImgConverter(self.width, self.height, self.scrnmode)
-        sprite = self.canvas.get_pixels()
+        if action == MenuActions.CODE_EXPORT:
+            self.code_export()
+            return
+        elif action == MenuActions.CODE_EXPORT_ANIM:
+            self.code_export_anim()
+            return
+        elif action == MenuActions.CODE_EXPORT_TILES:
+            self.code_export_tiles()
+            return
+        elif action == MenuActions.CODE_EXPORT_BIN:
+            self.code_export_bin()
+            return
+        conv = self.new_converter()
+        sprite = bytes(self.canvas.sprite.pixels)
         name = Path(self.current_prj).stem
-        code = ""
         if action == MenuActions.CODE_C:
-            code = conv.code_c(sprite, name)
+            fmt, emitter = 'c', conv.iter_c
         elif action == MenuActions.CODE_ASM:
-            code = conv.code_asm(sprite, name)
+            fmt, emitter = 'asm', conv.iter_asm
+        elif action == MenuActions.CODE_COMPILED:
+            fmt, emitter = 'z80', conv.iter_compiled
         else:
-            code = conv.code_bas(sprite, name)
-        # convert from List[str] to str
-        code = ''.join(code)
-        self.code_view(code)
+            fmt, emitter = 'bas', conv.iter_bas
+        def work(job):
+            conv.progress = lambda fraction: job.progress(fraction, "converting")
+            return self.conv_cache.source(conv, fmt, sprite, name, emitter)
+        self.run_job("Generating code", work, self.code_view)
 
     def menu_help_action(self, action):
         if action == MenuActions.HELP_ABOUT:
@@ -160,6 +385,8 @@ class TixelApp:
     def newproject(self):
         self.canvas.set_bgcolor(self.bgcolor)
         self.canvas.reconfigure(self.scrnmode, self.width, self.height, self.bgcolor)
+        self.frames = [self.canvas.sprite]
+        self.frame = 0
         self.tool_frame.erase_color(self.bgcolor)
         self.updatetitle()
 
@@ -167,8 +394,10 @@ class TixelApp:
         self.menu = AppMenu(self.root)
         self.menu.init_file(self.menu_file_action)
         self.menu.init_edit(self.menu_edit_action)
+        self.menu.init_view(self.menu_view_action)
         self.menu.init_transform(self.menu_transform_action)
         self.menu.init_code(self.menu_code_action)
+        self.menu.init_frames(self.menu_frame_action)
         self.menu.init_help(self.menu_help_action)
         self.root.config(menu=self.menu.menu_main)
 
@@ -183,15 +412,33 @@ class TixelApp:
         self.colorbar = ColorBar(self.root)
         self.colorbar.create_bar(self.color_button_action)
         self.colorbar.grid(row=1, column=0, columnspan=8, sticky='w', pady=5, padx=5)
+        self.jobbar = JobBar(self.root)
+        self.jobbar.grid(row=2, column=0, columnspan=8, sticky='ew')
+        self.jobbar.grid_remove()
+        self.jobs = JobRunner(self.root, self.jobbar)
 
     def setup_canvas(self):
         pxsize = min(30, self.root.winfo_screenheight()/35)
         self.canvas = PixelGrid(self.root, self.scrnmode, self.width, self.height, self.bgcolor, pxsize)
-        self.canvas.grid(row=0, column=2, columnspan=5)
+        self.canvas.grid(row=0, column=2, columnspan=5, sticky='nsew')
+        self.frames = [self.canvas.sprite]
+        self.root.grid_rowconfigure(0, weight=1)
+        self.root.grid_columnconfigure(2, weight=1)
+
+    def setup_preview(self):
+        self.preview = CPCPreview(self.root, self.menu.preview_scale.get())
+        self.preview.grid(row=0, column=7, sticky='n', padx=5)
+        # own cache: its changed bytes are always relative to what the preview shows
+        self.preview_cache = ConversionCache()
+        self.canvas.on_change = self.update_preview
+        self.tool_frame.transparent.trace_add('write', lambda *args: self.update_preview(None))
+        self.update_preview(None)
 
     def updatetitle(self):
         prj = self.current_prj if self.current_prj != "" else "unsaved"
         title = f"Tixel - {prj} ({self.width}x{self.height} mode {self.scrnmode})"
+        if len(self.frames) > 1:
+            title = title + f" - frame {self.frame + 1}/{len(self.frames)}"
         self.root.title(title)
 
     def run(self):
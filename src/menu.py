@@ -7,8 +7,11 @@ class MenuActions(enum.Enum):
     FILE_SAVE = 12
     FILE_SAVE_AS = 13
     FILE_EXIT = 14
+    FILE_IMPORT = 15
 
     EDIT_UNDO = 20
+    EDIT_REDO = 21
+    EDIT_FILL_DIAGONAL = 22
 
     TRANSFORM_VERT = 31
     TRANSFORM_HOR = 32
@@ -16,6 +19,26 @@ class MenuActions(enum.Enum):
     CODE_BASIC = 40
     CODE_C = 41
     CODE_ASM = 42
+    CODE_EXPORT = 43
+    CODE_EXPORT_BIN = 44
+    CODE_COMPILED = 45
+    CODE_EXPORT_ANIM = 46
+    CODE_EXPORT_TILES = 47
+
+    VIEW_ZOOM_IN = 50
+    VIEW_ZOOM_OUT = 51
+    VIEW_ZOOM_RESET = 52
+    VIEW_GRID = 53
+    VIEW_FAST_RENDER = 54
+    VIEW_PREVIEW = 55
+    VIEW_PREVIEW_SCALE = 56
+
+    FRAME_NEW = 60
+    FRAME_DUPLICATE = 61
+    FRAME_DELETE = 62
+    FRAME_PREV = 63
+    FRAME_NEXT = 64
+    FRAME_ONION = 65
 
     HELP_ABOUT = 90
 
@@ -34,6 +57,14 @@ class AppMenu:
         self.root.bind_all('<Control-s>', lambda ev: listener(MenuActions.FILE_SAVE))
         self.menu_file.add_command(label="Save Project As...", command=lambda: listener(MenuActions.FILE_SAVE_AS))
         self.menu_file.add_separator()
+        self.menu_file.add_command(label="Import Image...", command=lambda: listener(MenuActions.FILE_IMPORT))
+        self.dithering = tk.StringVar(master=self.root, value='none')
+        self.menu_dithering = tk.Menu(self.menu_file, tearoff=0)
+        self.menu_dithering.add_radiobutton(label="None", value='none', variable=self.dithering)
+        self.menu_dithering.add_radiobutton(label="Floyd-Steinberg", value='floyd', variable=self.dithering)
+        self.menu_dithering.add_radiobutton(label="Ordered", value='ordered', variable=self.dithering)
+        self.menu_file.add_cascade(label="Dithering", menu=self.menu_dithering)
+        self.menu_file.add_separator()
         self.menu_file.add_command(label="Exit", command=lambda: listener(MenuActions.FILE_EXIT))
         self.menu_main.add_cascade(label="File", menu=self.menu_file)
         
@@ -41,8 +72,39 @@ class AppMenu:
         self.menu_edit = tk.Menu(self.menu_main, tearoff=0)
         self.menu_edit.add_command(label="Undo", accelerator='Ctrl+Z', command=lambda: listener(MenuActions.EDIT_UNDO))
         self.root.bind_all('<Control-z>', lambda ev: listener(MenuActions.EDIT_UNDO))
+        self.menu_edit.add_command(label="Redo", accelerator='Ctrl+Y', command=lambda: listener(MenuActions.EDIT_REDO))
+        self.root.bind_all('<Control-y>', lambda ev: listener(MenuActions.EDIT_REDO))
+        self.root.bind_all('<Control-Z>', lambda ev: listener(MenuActions.EDIT_REDO))
+        self.menu_edit.add_separator()
+        self.fill_diagonal = tk.BooleanVar(master=self.root, value=True)
+        self.menu_edit.add_checkbutton(label="Fill Diagonals", variable=self.fill_diagonal, command=lambda: listener(MenuActions.EDIT_FILL_DIAGONAL))
         self.menu_main.add_cascade(label="Edit", menu=self.menu_edit)
 
+    def init_view(self, listener):
+        self.menu_view = tk.Menu(self.menu_main, tearoff=0)
+        self.menu_view.add_command(label="Zoom In", accelerator='Ctrl++', command=lambda: listener(MenuActions.VIEW_ZOOM_IN))
+        self.root.bind_all('<Control-plus>', lambda ev: listener(MenuActions.VIEW_ZOOM_IN))
+        self.root.bind_all('<Control-equal>', lambda ev: listener(MenuActions.VIEW_ZOOM_IN))
+        self.menu_view.add_command(label="Zoom Out", accelerator='Ctrl+-', command=lambda: listener(MenuActions.VIEW_ZOOM_OUT))
+        self.root.bind_all('<Control-minus>', lambda ev: listener(MenuActions.VIEW_ZOOM_OUT))
+        self.menu_view.add_command(label="Actual Size", accelerator='Ctrl+0', command=lambda: listener(MenuActions.VIEW_ZOOM_RESET))
+        self.root.bind_all('<Control-0>', lambda ev: listener(MenuActions.VIEW_ZOOM_RESET))
+        self.menu_view.add_separator()
+        self.show_grid = tk.BooleanVar(master=self.root, value=True)
+        self.menu_view.add_checkbutton(label="Show Grid", variable=self.show_grid, command=lambda: listener(MenuActions.VIEW_GRID))
+        self.fast_render = tk.BooleanVar(master=self.root, value=True)
+        self.menu_view.add_checkbutton(label="Fast Rendering", variable=self.fast_render, command=lambda: listener(MenuActions.VIEW_FAST_RENDER))
+        self.menu_view.add_separator()
+        self.show_preview = tk.BooleanVar(master=self.root, value=True)
+        self.menu_view.add_checkbutton(label="Show Preview", variable=self.show_preview, command=lambda: listener(MenuActions.VIEW_PREVIEW))
+        self.preview_scale = tk.IntVar(master=self.root, value=1)
+        self.menu_preview_scale = tk.Menu(self.menu_view, tearoff=0)
+        for scale in (1, 2, 3):
+            self.menu_preview_scale.add_radiobutton(label=f"{scale}x", value=scale, variable=self.preview_scale,
+                                                    command=lambda: listener(MenuActions.VIEW_PREVIEW_SCALE))
+        self.menu_view.add_cascade(label="Preview Scale", menu=self.menu_preview_scale)
+        self.menu_main.add_cascade(label="View", menu=self.menu_view)
+
     def init_transform(self, listener):
         self.menu_transform = tk.Menu(self.menu_main, tearoff=0)
         self.menu_transform.add_command(label="Vertically", command=lambda: listener(MenuActions.TRANSFORM_VERT))
@@ -54,8 +116,44 @@ class AppMenu:
         self.menu_code.add_command(label="BASIC", command=lambda: listener(MenuActions.CODE_BASIC))
         self.menu_code.add_command(label="C", command=lambda: listener(MenuActions.CODE_C))
         self.menu_code.add_command(label="Assembly", command=lambda: listener(MenuActions.CODE_ASM))
+        self.menu_code.add_command(label="Compiled Z80", command=lambda: listener(MenuActions.CODE_COMPILED))
+        self.menu_code.add_separator()
+        self.compression = tk.StringVar(master=self.root, value='none')
+        self.menu_compression = tk.Menu(self.menu_code, tearoff=0)
+        self.menu_compression.add_radiobutton(label="None", value='none', variable=self.compression)
+        self.menu_compression.add_radiobutton(label="RLE", value='rle', variable=self.compression)
+        self.menu_compression.add_radiobutton(label="LZ", value='lz', variable=self.compression)
+        self.menu_code.add_cascade(label="Compression", menu=self.menu_compression)
+        self.preshift = tk.BooleanVar(master=self.root, value=False)
+        self.menu_code.add_checkbutton(label="Pre-shifted Sprites", variable=self.preshift)
+        self.masked = tk.StringVar(master=self.root, value='none')
+        self.menu_masks = tk.Menu(self.menu_code, tearoff=0)
+        self.menu_masks.add_radiobutton(label="None", value='none', variable=self.masked)
+        self.menu_masks.add_radiobutton(label="Interleaved", value='interleaved', variable=self.masked)
+        self.menu_masks.add_radiobutton(label="Separate Table", value='separate', variable=self.masked)
+        self.menu_code.add_cascade(label="Masks", menu=self.menu_masks)
+        self.menu_code.add_separator()
+        self.menu_code.add_command(label="Export to File...", command=lambda: listener(MenuActions.CODE_EXPORT))
+        self.menu_code.add_command(label="Export Binary...", command=lambda: listener(MenuActions.CODE_EXPORT_BIN))
+        self.menu_code.add_command(label="Export Animation...", command=lambda: listener(MenuActions.CODE_EXPORT_ANIM))
+        self.menu_code.add_command(label="Export Tileset...", command=lambda: listener(MenuActions.CODE_EXPORT_TILES))
         self.menu_main.add_cascade(label="Code", menu=self.menu_code)
 
+    def init_frames(self, listener):
+        self.menu_frames = tk.Menu(self.menu_main, tearoff=0)
+        self.menu_frames.add_command(label="New Frame", command=lambda: listener(MenuActions.FRAME_NEW))
+        self.menu_frames.add_command(label="Duplicate Frame", command=lambda: listener(MenuActions.FRAME_DUPLICATE))
+        self.menu_frames.add_command(label="Delete Frame", command=lambda: listener(MenuActions.FRAME_DELETE))
+        self.menu_frames.add_separator()
+        self.menu_frames.add_command(label="Previous Frame", accelerator='PgUp', command=lambda: listener(MenuActions.FRAME_PREV))
+        self.root.bind_all('<Prior>', lambda ev: listener(MenuActions.FRAME_PREV))
+        self.menu_frames.add_command(label="Next Frame", accelerator='PgDn', command=lambda: listener(MenuActions.FRAME_NEXT))
+        self.root.bind_all('<Next>', lambda ev: listener(MenuActions.FRAME_NEXT))
+        self.menu_frames.add_separator()
+        self.onion_skin = tk.BooleanVar(master=self.root, value=True)
+        self.menu_frames.add_checkbutton(label="Onion Skin", variable=self.onion_skin, command=lambda: listener(MenuActions.FRAME_ONION))
+        self.menu_main.add_cascade(label="Frames", menu=self.menu_frames)
+
     def init_help(self, listener):
         self.menu_help = tk.Menu(self.menu_main, tearoff=0)
         self.menu_help.add_command(label="About...", command=lambda: listener(MenuActions.HELP_ABOUT))
@@ -1,19 +1,23 @@
 import tkinter as tk
 from tkinter import ttk
-from imgconv import CPC_RGB_COLORS, CPC_COLOR_NAMES
+from imgconv import CPC_RGB_COLORS, CPC_COLOR_NAMES, CPC_SCREEN_SIZES
+
+# Sprite sizes must be multiple of a CPC cursor (8 pixels)
+SIZE_STEP = 8
 
 class NewDialog(tk.Toplevel):
-    sizes = [(8,8), (8,16), (8,24), (16,8), (16,16), (16,24), (24,8), (24,16), (24,24)]
+    # None stands for the full screen of the selected mode
+    sizes = [(8,8), (8,16), (8,24), (16,8), (16,16), (16,24), (24,8), (24,16), (24,24), None]
 
     def __init__(self, defmode, defsize, defbgcolor):
         super().__init__()   
         self.color = defbgcolor
         self.sizeindex = defsize
-        self.size = self.sizes[defsize]
         self.mode = defmode
+        self.size = self._preset_size(defsize, defmode)
 
         self.wm_title('New Project')
-        self.geometry('300x150')
+        self.geometry('300x210')
 
         self.frame = tk.Frame(self, padx=5, pady=5)
         l = tk.Label(self.frame, text="Destination Mode:")
@@ -24,6 +28,7 @@ class NewDialog(tk.Toplevel):
             values=['Mode 0', 'Mode 1', 'Mode 2']
         )
         self.modes.current(defmode)
+        self.modes.bind("<<ComboboxSelected>>", self.onchange_mode)
         self.modes.grid(row=0, column=1, columnspan=2, sticky='nw', pady=5)
 
         l = tk.Label(self.frame, text="Backgroun color:")
@@ -46,18 +51,31 @@ class NewDialog(tk.Toplevel):
             )
         self.colorbtn.grid(row=1, column=3, padx=5, pady=5)
 
-        l = tk.Label(self.frame, text="Sprote size:")
+        l = tk.Label(self.frame, text="Sprite size:")
         l.grid(row=2, column=0, sticky='nw', pady=5)
         self.sizescb = ttk.Combobox(
             self.frame,
             state="readonly",
-            values=['8x8', '8x16', '8x24', '16x8', '16x16', '16x24', '24x8', '24x16', '24x24']
+            values=['8x8', '8x16', '8x24', '16x8', '16x16', '16x24', '24x8', '24x16', '24x24', 'Full screen']
         )
         self.sizescb.current(defsize)
+        self.sizescb.bind("<<ComboboxSelected>>", self.onchange_size)
         self.sizescb.grid(row=2, column=1, columnspan=2, sticky='nw', pady=5)
 
+        l = tk.Label(self.frame, text="Width x Height:")
+        l.grid(row=3, column=0, sticky='nw', pady=5)
+        maxw, maxh = CPC_SCREEN_SIZES[defmode]
+        self.widthvar = tk.IntVar(master=self, value=self.size[0])
+        self.heightvar = tk.IntVar(master=self, value=self.size[1])
+        self.widthsb = tk.Spinbox(self.frame, from_=SIZE_STEP, to=maxw, increment=SIZE_STEP,
+                                  width=5, textvariable=self.widthvar)
+        self.widthsb.grid(row=3, column=1, sticky='nw', pady=5)
+        self.heightsb = tk.Spinbox(self.frame, from_=SIZE_STEP, to=maxh, increment=SIZE_STEP,
+                                   width=5, textvariable=self.heightvar)
+        self.heightsb.grid(row=3, column=2, sticky='nw', pady=5)
+
         b = tk.Button(self.frame, text="Create", command=self.on_create)
-        b.grid(row=4, column=1, sticky='s', pady=10)
+        b.grid(row=5, column=1, sticky='s', pady=10)
         self.frame.pack(expand=True)
 
     def _hex2rgbindex(self, hexcolor):
@@ -70,13 +88,37 @@ class NewDialog(tk.Toplevel):
         rgb = CPC_RGB_COLORS[colorid]
         return f'#{rgb[0]:02X}{rgb[1]:02X}{rgb[2]:02X}'
 
+    def _preset_size(self, sizeindex, mode):
+        size = self.sizes[sizeindex]
+        return CPC_SCREEN_SIZES[mode] if size is None else size
+
+    def _spin_value(self, var, maxval):
+        try:
+            value = var.get()
+        except tk.TclError:
+            value = SIZE_STEP
+        value = min(maxval, max(SIZE_STEP, value))
+        return value - (value % SIZE_STEP)
+
     def on_create(self):
         self.mode = self.modes.current()
-        
         self.sizeindex = self.sizescb.current()
-        self.size = self.sizes[self.sizeindex]
+        maxw, maxh = CPC_SCREEN_SIZES[self.mode]
+        self.size = (self._spin_value(self.widthvar, maxw), self._spin_value(self.heightvar, maxh))
         self.destroy()
 
+    def onchange_mode(self, event):
+        maxw, maxh = CPC_SCREEN_SIZES[self.modes.current()]
+        self.widthsb.configure(to=maxw)
+        self.heightsb.configure(to=maxh)
+        if self.sizes[self.sizescb.current()] is None:
+            self.onchange_size(event)
+
+    def onchange_size(self, event):
+        width, height = self._preset_size(self.sizescb.current(), self.modes.current())
+        self.widthvar.set(width)
+        self.heightvar.set(height)
+
     def onchange_bgcolor(self, event):
         colorid = self.bgcolors.current()
         self.color = self._rgbindex2hex(colorid)
@@ -1,9 +1,19 @@
 import tkinter as tk
 import enum
+from sprite import Sprite, HEX2INDEX, HEX_COLORS, line_cells
+from gridrender import ImageRenderer
+from history import History, HISTORY_DEPTH, HISTORY_BUDGET
 
-MAX_XPIXELS = 24
-MAX_YPIXELS = 24
+# Size of the visible area in cells at the default zoom
+VIEW_XPIXELS = 24
+VIEW_YPIXELS = 24
 PIXEL_SIZE = 30
+MAX_PIXEL_SIZE = 60
+ZOOM_STEP = 1.25
+# Width and height of a cell relative to the pixel size in each mode
+MODE_ASPECT = [(1, 0.5), (1, 1), (0.5, 1)]
+# Weight of the background colour when showing the previous frame (onion skin)
+ONION_BLEND = 0.6
 
 class PixelGridMode(enum.Enum):
     DRAWING     = 0
@@ -12,87 +22,234 @@ class PixelGridMode(enum.Enum):
     FILLING     = 3
 
 class PixelGrid(tk.Frame):
-    def __init__(self, parent, mode, width, height, bgcolor, pxsize = 30):
+    def __init__(self, parent, mode, width, height, bgcolor, pxsize = 30,
+                 undo_depth = HISTORY_DEPTH, undo_budget = HISTORY_BUDGET):
         super().__init__(parent, bd=1, relief=tk.SUNKEN)
         self.width = width
         self.height = height
         self.pxsize = pxsize
+        self.default_pxsize = pxsize
         self.scrnmode = mode
         self.fill_color1 = bgcolor
         self.fill_color2 = bgcolor
         self.fill_bg = bgcolor
         self.behaviour = PixelGridMode.DRAWING
-        canvas_maxw = MAX_XPIXELS * self.pxsize
-        canvas_maxh = MAX_YPIXELS * self.pxsize
-        self.undo_stack = []
-        self.canvas = tk.Canvas(self, bd=0, highlightthickness=0, width=canvas_maxw, height=canvas_maxh)
-        self.canvas.pack(fill=tk.BOTH, expand=True, padx=2, pady=2)
+        canvas_maxw = VIEW_XPIXELS * self.pxsize
+        canvas_maxh = VIEW_YPIXELS * self.pxsize
+        self.history = History(undo_depth, undo_budget)
+        self.sprite = Sprite(mode, width, height, HEX2INDEX[bgcolor])
+        self.sprite.recorder = self.history
+        self.onion = None
+        self.colors = list(HEX_COLORS)
+        self.show_grid = True
+        self.fill_diagonal = True
+        self.last_cell = None
+        self.visible = (0, 0, 0, 0)
+        self.view_pending = False
+        self.on_change = None
+        self.canvas = tk.Canvas(self, bd=0, highlightthickness=0, width=canvas_maxw, height=canvas_maxh,
+                                background='#CCCCCC',
+                                xscrollcommand=self._on_xscroll, yscrollcommand=self._on_yscroll)
+        self.vscroll = tk.Scrollbar(self, orient=tk.VERTICAL, command=self.canvas.yview)
+        self.hscroll = tk.Scrollbar(self, orient=tk.HORIZONTAL, command=self.canvas.xview)
+        self.canvas.grid(row=0, column=0, sticky='nsew', padx=2, pady=2)
+        self.vscroll.grid(row=0, column=1, sticky='ns')
+        self.hscroll.grid(row=1, column=0, sticky='ew')
+        self.grid_rowconfigure(0, weight=1)
+        self.grid_columnconfigure(0, weight=1)
+        self.renderer = ImageRenderer(self)
+        self._bind_events()
         self._draw_pixels()
 
-    def _draw_pixels(self):
-        aspectx, aspecty = [(1, 0.5), (1, 1), (0.5, 1)][self.scrnmode]    
-        for row in range(MAX_YPIXELS):
-            for column in range(MAX_XPIXELS):
-                x0, y0 = (column * self.pxsize * aspectx), (row * self.pxsize * aspecty)
-                x1, y1 = (x0 + self.pxsize * aspectx), (y0 + self.pxsize * aspecty)
-                if column < self.width and row < self.height:
-                    self.canvas.create_rectangle(x0, y0, x1, y1,
-                                                fill=self.fill_bg, outline="gray",
-                                                tags=(self._tag(column, row), "cell"))
-                else:
-                    self.canvas.create_rectangle(x0, y0, x1, y1, fill='#CCCCCC', tags=("out"))
-                    
-        self.canvas.tag_bind("cell", "<B1-Motion>", lambda e: self._paint(e, self.fill_color1))
-        self.canvas.tag_bind("cell", "<Button-1>",  lambda e: self._paint(e, self.fill_color1))
+    def _bind_events(self):
+        self.canvas.bind("<B1-Motion>", lambda e: self._motion(e, self.fill_color1))
+        self.canvas.bind("<Button-1>",  lambda e: self._press(e, self.fill_color1))
         # Depending on the OS, right mouse button can be Button-2 or Button-3
-        self.canvas.tag_bind("cell", "<B2-Motion>", lambda e: self._paint(e, self.fill_color2))
-        self.canvas.tag_bind("cell", "<Button-2>",  lambda e: self._paint(e, self.fill_color2))
-        self.canvas.tag_bind("cell", "<B3-Motion>", lambda e: self._paint(e, self.fill_color2))
-        self.canvas.tag_bind("cell", "<Button-3>",  lambda e: self._paint(e, self.fill_color2))
-    
-    def _tag(self, x, y):
-        # Return the tag for a given row and column
-        tag = f"{x},{y}"
-        return tag
-
-    def _paint(self, event, color):
-        cell = self.canvas.find_closest(event.x, event.y)
-        tags = self.canvas.gettags(cell)
-        if 'out' not in tags:
+        self.canvas.bind("<B2-Motion>", lambda e: self._motion(e, self.fill_color2))
+        self.canvas.bind("<Button-2>",  lambda e: self._press(e, self.fill_color2))
+        self.canvas.bind("<B3-Motion>", lambda e: self._motion(e, self.fill_color2))
+        self.canvas.bind("<Button-3>",  lambda e: self._press(e, self.fill_color2))
+        for button in (1, 2, 3):
+            self.canvas.bind(f"<ButtonRelease-{button}>", lambda e: self._release())
+        self.canvas.bind("<Configure>", lambda e: self._schedule_view())
+        # Mouse wheel scrolls (Shift for horizontal) and zooms with Control.
+        # Windows and MacOS send MouseWheel events, X11 uses buttons 4 and 5
+        self.canvas.bind("<MouseWheel>", lambda e: self.canvas.yview_scroll(-1 if e.delta > 0 else 1, 'units'))
+        self.canvas.bind("<Shift-MouseWheel>", lambda e: self.canvas.xview_scroll(-1 if e.delta > 0 else 1, 'units'))
+        self.canvas.bind("<Control-MouseWheel>", lambda e: self.zoom_in() if e.delta > 0 else self.zoom_out())
+        self.canvas.bind("<Button-4>", lambda e: self.canvas.yview_scroll(-1, 'units'))
+        self.canvas.bind("<Button-5>", lambda e: self.canvas.yview_scroll(1, 'units'))
+        self.canvas.bind("<Shift-Button-4>", lambda e: self.canvas.xview_scroll(-1, 'units'))
+        self.canvas.bind("<Shift-Button-5>", lambda e: self.canvas.xview_scroll(1, 'units'))
+        self.canvas.bind("<Control-Button-4>", lambda e: self.zoom_in())
+        self.canvas.bind("<Control-Button-5>", lambda e: self.zoom_out())
+
+    def cell_size(self):
+        """ Returns the size of a cell in screen pixels (at least 1x1) """
+        aspectx, aspecty = MODE_ASPECT[self.scrnmode]
+        return max(1, round(self.pxsize * aspectx)), max(1, round(self.pxsize * aspecty))
+
+    def _draw_pixels(self):
+        cellw, cellh = self.cell_size()
+        self.renderer.clear()
+        self.visible = (0, 0, 0, 0)
+        self.canvas.configure(
+            scrollregion=(0, 0, self.width * cellw, self.height * cellh),
+            xscrollincrement=cellw,
+            yscrollincrement=cellh
+        )
+        self.sprite.mark_all()
+        self._update_view()
+
+    def _on_xscroll(self, first, last):
+        self.hscroll.set(first, last)
+        self._schedule_view()
+
+    def _on_yscroll(self, first, last):
+        self.vscroll.set(first, last)
+        self._schedule_view()
+
+    def _schedule_view(self):
+        if not self.view_pending:
+            self.view_pending = True
+            self.after_idle(self._update_view)
+
+    def _visible_range(self):
+        """ Returns the range of cells (col0, row0, col1, row1) inside the viewport """
+        cellw, cellh = self.cell_size()
+        x0 = self.canvas.canvasx(0)
+        y0 = self.canvas.canvasy(0)
+        x1 = x0 + max(self.canvas.winfo_width(), int(self.canvas.cget('width')))
+        y1 = y0 + max(self.canvas.winfo_height(), int(self.canvas.cget('height')))
+        col0 = max(0, int(x0 // cellw))
+        row0 = max(0, int(y0 // cellh))
+        col1 = min(self.width, int(x1 // cellw) + 1)
+        row1 = min(self.height, int(y1 // cellh) + 1)
+        return col0, row0, col1, row1
+
+    def _update_view(self):
+        self.view_pending = False
+        visible = self._visible_range()
+        if visible != self.visible:
+            self.visible = visible
+            self._changed(self.sprite.take_dirty())
+            self.renderer.redraw(visible)
+        else:
+            self._refresh()
+
+    def _event_cell(self, event):
+        """ Returns the (x, y) cell under the mouse, it can be outside the sprite """
+        cellw, cellh = self.cell_size()
+        x = int(self.canvas.canvasx(event.x) // cellw)
+        y = int(self.canvas.canvasy(event.y) // cellh)
+        return x, y
+
+    def _onion_colors(self):
+        """ HEX_COLORS followed by the faded version of each one used by the onion skin """
+        bg = [int(self.fill_bg[i:i + 2], 16) for i in (1, 3, 5)]
+        faded = []
+        for hexcol in HEX_COLORS:
+            rgb = [int(hexcol[i:i + 2], 16) for i in (1, 3, 5)]
+            rgb = [round(c * (1 - ONION_BLEND) + b * ONION_BLEND) for c, b in zip(rgb, bg)]
+            faded.append(f'#{rgb[0]:02X}{rgb[1]:02X}{rgb[2]:02X}')
+        return list(HEX_COLORS) + faded
+
+    def row_indices(self, offset, col0, col1):
+        """
+        Returns the indices in self.colors of the cells [col0, col1) of the row
+        starting at offset. With onion skin, background cells show the faded
+        colour of the previous frame.
+        """
+        row = self.sprite.pixels[offset + col0:offset + col1]
+        if self.onion is None:
+            return row
+        bgindex = HEX2INDEX[self.fill_bg]
+        ghost = self.onion.pixels[offset + col0:offset + col1]
+        faded = len(HEX_COLORS)
+        return [g + faded if c == bgindex and g != bgindex else c for c, g in zip(row, ghost)]
+
+    def _refresh(self):
+        """ Updates the view with the cells that changed in the sprite model """
+        dirty = self.sprite.take_dirty()
+        self.renderer.refresh(dirty)
+        self._changed(dirty)
+
+    def _changed(self, dirty):
+        """ Tells on_change the offsets of the cells that changed (None: all of them) """
+        if self.on_change is not None and (dirty is None or dirty):
+            self.on_change(dirty)
+
+    def _press(self, event, color):
+        # A whole stroke (press, motion, release) is a single undo step
+        self.history.begin()
+        self.last_cell = self._event_cell(event)
+        self._paint(self.last_cell, color)
+        self._schedule_view()
+
+    def _motion(self, event, color):
+        cell = self._event_cell(event)
+        if self.last_cell is None or cell == self.last_cell:
+            return
+        if self.behaviour in (PixelGridMode.DRAWING, PixelGridMode.EREASING):
+            # motion events are sparse, join them with a line so fast strokes have no gaps
+            x0, y0 = self.last_cell
+            for line_cell in line_cells(x0, y0, cell[0], cell[1]):
+                self._paint(line_cell, color)
+        else:
+            self._paint(cell, color)
+        self.last_cell = cell
+        # the view is updated once per idle cycle with all the cells painted meanwhile
+        self._schedule_view()
+
+    def _release(self):
+        self.last_cell = None
+        self.history.end()
+
+    def _paint(self, cell, color):
+        x, y = cell
+        if self.sprite.inside(x, y):
             if self.behaviour == PixelGridMode.EREASING:
-                oldcolor = self.canvas.itemcget(cell, "fill")
-                if oldcolor != color:
-                    self.undo_append()
-                    self.canvas.itemconfigure(cell, fill=self.fill_bg)
+                self.sprite.set_hex(x, y, self.fill_bg)
             elif self.behaviour == PixelGridMode.DRAWING:
-                oldcolor = self.canvas.itemcget(cell, "fill")
-                if oldcolor != color:
-                    self.undo_append()
-                    self.canvas.itemconfigure(cell, fill=color)
+                self.sprite.set_hex(x, y, color)
             elif self.behaviour == PixelGridMode.REPLACING:
-                self.undo_append()
-                self.replace_color(cell, color)
+                self.replace_color((x, y), color)
             elif self.behaviour == PixelGridMode.FILLING:
-                pos = tags[0].split(',')
-                pixels = [(int(pos[0]), int(pos[1]))]
-                oldcolor = self.canvas.itemcget(cell, "fill")
-                self.undo_append()
-                self.fill_color(pixels, oldcolor, color)
+                self.fill_color((x, y), color)
 
     def get_pixels(self):
-        pixels = []
-        for y in range(self.height):
-            for x in range(self.width):
-                color = self.canvas.itemcget(self._tag(x, y), "fill")
-                pixels.append(((x, y), color))
-        return pixels            
+        return self.sprite.get_pixels()
 
     def set_pixels(self, pixels):
-        for pixel in pixels:
-            x, y = pixel[0]
-            color = pixel[1]
-            tag = self._tag(x, y)
-            self.canvas.itemconfigure(tag, fill=color)
+        self.sprite.set_pixels(pixels)
+        self._refresh()
+
+    def set_sprite(self, sprite):
+        """ Replaces the edited image, the sprite must have the current size """
+        self.history = History(self.history.depth, self.history.budget)
+        self.sprite = sprite
+        self.sprite.recorder = self.history
+        self.sprite.mark_all()
+        self._refresh()
+
+    def show_frame(self, sprite, onion=None):
+        """
+        Edits another frame of the animation. Each frame keeps its own undo
+        history, onion is the frame shown faded behind it (or None).
+        """
+        if not isinstance(sprite.recorder, History):
+            sprite.recorder = History(self.history.depth, self.history.budget)
+        self.history = sprite.recorder
+        self.sprite = sprite
+        self.set_onion(onion)
+
+    def set_onion(self, sprite):
+        self.onion = sprite
+        self.colors = self._onion_colors() if sprite is not None else list(HEX_COLORS)
+        self.renderer.clear()
+        self.visible = (0, 0, 0, 0)
+        self.sprite.mark_all()
+        self._update_view()
 
     def set_color(self, button, hexcol):
         if button == 0:
@@ -106,77 +263,76 @@ class PixelGrid(tk.Frame):
     def set_behaviour(self, mode):
         self.behaviour = mode
 
+    def set_fill_diagonal(self, diagonal):
+        self.fill_diagonal = diagonal
+
     def reconfigure(self, mode, width, height, bgcolor):
         self.scrnmode = mode
         self.width = width
         self.height = height
         self.fill_bg = bgcolor
-        self.canvas.delete('all')
+        self.onion = None
+        self.colors = list(HEX_COLORS)
+        self.history = History(self.history.depth, self.history.budget)
+        self.sprite = Sprite(mode, width, height, HEX2INDEX[bgcolor])
+        self.sprite.recorder = self.history
+        self._draw_pixels()
+
+    def set_renderer(self, renderer_class):
+        self.renderer.clear()
+        self.renderer = renderer_class(self)
+        if self.pxsize < self.renderer.min_pxsize:
+            self.pxsize = self.renderer.min_pxsize
         self._draw_pixels()
 
+    def set_grid(self, show):
+        self.show_grid = show
+        self.renderer.clear()
+        self.visible = (0, 0, 0, 0)
+        self._update_view()
+
+    def set_zoom(self, pxsize):
+        pxsize = min(MAX_PIXEL_SIZE, max(self.renderer.min_pxsize, pxsize))
+        if pxsize != self.pxsize:
+            xfirst, _ = self.canvas.xview()
+            yfirst, _ = self.canvas.yview()
+            self.pxsize = pxsize
+            self._draw_pixels()
+            self.canvas.xview_moveto(xfirst)
+            self.canvas.yview_moveto(yfirst)
+
+    def zoom_in(self):
+        self.set_zoom(self.pxsize * ZOOM_STEP)
+
+    def zoom_out(self):
+        self.set_zoom(self.pxsize / ZOOM_STEP)
+
+    def zoom_reset(self):
+        self.set_zoom(self.default_pxsize)
+
     def mirrorvert(self):
-        self.undo_append()
-        pixels = self.get_pixels()
-        mirror = []
-        max_x = self.width - 1
-        for i in range(0, len(pixels)):
-            mirror.append(((max_x - pixels[i][0][0], pixels[i][0][1]), pixels[i][1]))
-        self.set_pixels(mirror)
+        self.history.begin()
+        self.sprite.mirror_vert()
+        self.history.end()
+        self._refresh()
 
     def mirrorhor(self):
-        self.undo_append()
-        pixels = self.get_pixels()
-        mirror = []
-        max_y = self.height - 1
-        for i in range(0, len(pixels)):
-            mirror.append(((pixels[i][0][0], max_y - pixels[i][0][1]), pixels[i][1]))
-        self.set_pixels(mirror)
+        self.history.begin()
+        self.sprite.mirror_hor()
+        self.history.end()
+        self._refresh()
 
     def replace_color(self, cell, color):
-        oldcolor = self.canvas.itemcget(cell, "fill")
-        pixels = self.get_pixels()
-        replaced = []
-        for p in pixels:
-            if p[1] == oldcolor:
-                replaced.append((p[0], color))
-            else:
-                replaced.append(p)
-        self.set_pixels(replaced)
-
-    def fill_color(self, cells, oldcolor, newcolor):
-        if oldcolor != newcolor:
-            while len(cells) > 0:
-                cx, cy = cells[0]
-                cells = cells[1:]
-                self.canvas.itemconfigure(self._tag(cx, cy), fill=newcolor)
-                neighbours = [
-                    (cx-1, cy-1),
-                    (cx  , cy-1),
-                    (cx+1, cy-1),
-                    (cx-1, cy),
-                    (cx+1, cy),
-                    (cx-1, cy+1),
-                    (cx  , cy+1),
-                    (cx+1, cy+1)
-                ]
-                for x,y in neighbours:
-                    if x > -1 and x < self.width and y > -1 and y < self.height:
-                        tag = self._tag(x, y)
-                        color = self.canvas.itemcget(tag, "fill")
-                        if color == oldcolor and (x,y) not in cells:
-                            cells.append((x,y))                
-
-    def undo_reset(self):
-        self.undo_stack = []
-
-    def undo_append(self):
-        pixels = self.get_pixels()
-        self.undo_stack.append(pixels)
-        if len(self.undo_stack) > 5:
-            self.undo_stack = self.undo_stack[1:]
-
-    def undo_pop(self):
-        if len(self.undo_stack) > 0:
-            pixels = self.undo_stack[-1]
-            self.set_pixels(pixels)
-            self.undo_stack = self.undo_stack[0:-1]
+        oldindex = self.sprite.get(cell[0], cell[1])
+        self.sprite.replace(oldindex, HEX2INDEX[color])
+
+    def fill_color(self, cell, color):
+        self.sprite.flood_fill(cell[0], cell[1], HEX2INDEX[color], self.fill_diagonal)
+
+    def undo(self):
+        if self.history.undo(self.sprite):
+            self._refresh()
+
+    def redo(self):
+        if self.history.redo(self.sprite):
+            self._refresh()
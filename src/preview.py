@@ -0,0 +1,92 @@
+#!/usr/bin/env python
+
+"""
+PREVIEW.PY by Javier Garcia
+
+Shows the sprite as the CPC will: the video bytes produced by the converter
+are decoded back into pens with the bit layout of the screen mode and painted
+with the palette in a tk.PhotoImage. Pixels keep the aspect of each mode
+(mode 0 pixels are twice as wide as tall, mode 2 pixels twice as tall as
+wide) and are scaled 1x, 2x or 3x.
+
+Only the video bytes that changed are painted again, each one with a put()
+per pixel, so drawing a pixel costs a few Tk calls whatever the size of the
+sprite. A new palette or scale repaints the whole image, one put() per line.
+"""
+
+import tkinter as tk
+from imgconv import CPC_FW_COLORS, CPC_HW_COLORS, PIXELS_PER_BYTE, UNPACK_TABLES, unpack_pixels
+
+# Width and height of a pixel at 1x in each mode
+PIXEL_ASPECT = [(2, 1), (1, 1), (1, 2)]
+PREVIEW_SCALES = (1, 2, 3)
+# Colour of the pens without palette entry
+UNUSED_PEN = '#000000'
+
+
+class CPCPreview(tk.LabelFrame):
+    def __init__(self, parent, scale=1):
+        super().__init__(parent, pady=5, padx=5, text='Preview')
+        self.scale = scale
+        self.image = tk.PhotoImage(master=self, width=1, height=1)
+        self.label = tk.Label(self, image=self.image, background='#CCCCCC')
+        self.label.grid(row=0, column=0)
+        self.mode = 1
+        self.width = 0
+        self.height = 0
+        self.palette = None
+        self.colors = []
+        self.packed = b''
+
+    def pixel_size(self):
+        aspectw, aspecth = PIXEL_ASPECT[self.mode]
+        return aspectw * self.scale, aspecth * self.scale
+
+    def set_scale(self, scale):
+        self.scale = scale
+        self.palette = None
+
+    def show(self, mode, width, height, packed, palette, changed=None):
+        """
+        Shows the video bytes packed (width x height pixels in the given mode)
+        using palette (hardware colours of the pens). changed has the offsets
+        of the bytes that changed since the last call, None to paint them all.
+        """
+        if (mode, width, height) != (self.mode, self.width, self.height) or palette != self.palette:
+            changed = None
+        self.mode = mode
+        self.width = width
+        self.height = height
+        self.packed = packed
+        if changed is None:
+            self.palette = list(palette)
+            colors = [CPC_FW_COLORS[CPC_HW_COLORS[hwid]][1] for hwid in palette]
+            self.colors = [f'#{r:02X}{g:02X}{b:02X}' for r, g, b in colors]
+            self.colors.extend([UNUSED_PEN] * (256 - len(self.colors)))
+            self._redraw()
+        else:
+            for offset in changed:
+                self._put_byte(offset)
+
+    def _redraw(self):
+        pw, ph = self.pixel_size()
+        self.image.configure(width=max(1, self.width * pw), height=max(1, self.height * ph))
+        pens = unpack_pixels(self.packed, self.mode)
+        cellstr = [' '.join([hexcol] * pw) for hexcol in self.colors]
+        w = self.width
+        for y in range(self.height):
+            row = '{' + ' '.join([cellstr[pen] for pen in pens[y * w:(y + 1) * w]]) + '}'
+            # a single line of pixels is tiled down to fill the pixel height
+            self.image.put(row, to=(0, y * ph, w * pw, (y + 1) * ph))
+
+    def _put_byte(self, offset):
+        ppb = PIXELS_PER_BYTE[self.mode]
+        pw, ph = self.pixel_size()
+        value = self.packed[offset]
+        for pos in range(ppb):
+            i = offset * ppb + pos
+            if i >= self.width * self.height:
+                break
+            x, y = (i % self.width) * pw, (i // self.width) * ph
+            pen = UNPACK_TABLES[self.mode][pos][value]
+            self.image.put(self.colors[pen], to=(x, y, x + pw, y + ph))
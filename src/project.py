@@ -0,0 +1,232 @@
+#!/usr/bin/env python
+
+"""
+PROJECT.PY by Javier Garcia
+
+Tixel project (.tpj) loading and saving. This module does not depend on
+tkinter so it can be used by the command line tools too.
+
+Projects are saved in a compact binary format. Old JSON projects (where every
+pixel is stored as [[x, y], "#RRGGBB"]) can still be opened. Binary layout,
+all values little-endian:
+
+magic     4 bytes  b'TPJB'
+version   1 byte   BINARY_VERSION
+flags     1 byte   bit 0: pixel data compressed with zlib
+                   bit 1: pixel data packed in nibbles (2 pixels per byte)
+mode      1 byte
+width     2 bytes
+height    2 bytes
+btn1color 1 byte   firmware colour index (0-26)
+btn2color 1 byte   firmware colour index
+bgcolor   1 byte   firmware colour index
+ncolors   1 byte   number of palette entries
+transp    1 byte   firmware index of the transparent colour, NO_TRANSPARENT if
+                   there is none (since version 2)
+nframes   2 bytes  number of animation frames (since version 3)
+palette   ncolors bytes with the firmware index of each used colour
+pixels    palette entry of each pixel, row after row and frame after frame.
+          One byte per pixel, or two pixels per byte (first one in the high
+          nibble) when the palette has 16 or less colours.
+"""
+
+import json
+import struct
+import zlib
+from array import array
+from sprite import Sprite, HEX2INDEX, HEX_COLORS
+from atomicfile import atomic_open
+
+BINARY_MAGIC = b'TPJB'
+BINARY_VERSION = 3
+BINARY_HEADER = struct.Struct('<4sBBBHHBBBB')
+NO_TRANSPARENT = 0xFF
+FRAMES_FIELD = struct.Struct('<H')
+FLAG_ZLIB = 0x01
+FLAG_NIBBLES = 0x02
+
+# Tables used to split a byte into its high and low nibbles
+HIGH_NIBBLE = bytes([b >> 4 for b in range(256)])
+LOW_NIBBLE = bytes([b & 0x0F for b in range(256)])
+SHIFT_NIBBLE = bytes([(b << 4) & 0xFF for b in range(256)])
+
+TIXEL_VERSION = "1.0.0"
+
+
+class Project:
+    def __init__(self, mode=1, width=16, height=16, bgcolor="#FFFFFF"):
+        self.mode = mode
+        self.width = width
+        self.height = height
+        self.bgcolor = bgcolor
+        self.btn1color = bgcolor
+        self.btn2color = bgcolor
+        self.transparent = None     # colour exported as transparent (masked sprites)
+        self.frames = [Sprite(mode, width, height, HEX2INDEX[bgcolor])]
+
+    @property
+    def sprite(self):
+        """ First frame, the image of single frame projects """
+        return self.frames[0]
+
+    @sprite.setter
+    def sprite(self, sprite):
+        self.frames[0] = sprite
+
+    def new_frame(self):
+        sprite = Sprite(self.mode, self.width, self.height, HEX2INDEX[self.bgcolor])
+        self.frames.append(sprite)
+        return sprite
+
+
+def _pack_nibbles(data):
+    if len(data) % 2 != 0:
+        data = data + b'\x00'
+    if len(data) == 0:
+        return b''
+    high = int.from_bytes(data[0::2].translate(SHIFT_NIBBLE), 'big')
+    low = int.from_bytes(data[1::2], 'big')
+    return (high | low).to_bytes(len(data) // 2, 'big')
+
+
+def _unpack_nibbles(data, count):
+    pixels = bytearray(len(data) * 2)
+    pixels[0::2] = data.translate(HIGH_NIBBLE)
+    pixels[1::2] = data.translate(LOW_NIBBLE)
+    return pixels[:count]
+
+
+def _report(progress, fraction):
+    if progress is not None:
+        progress(fraction)
+
+
+def _load_json(content, progress=None):
+    data = json.loads(content)
+    project = Project(data['mode'], data['width'], data['height'], data['bgcolor'])
+    project.btn1color = data['btn1color']
+    project.btn2color = data['btn2color']
+    project.transparent = data.get('transparent')
+    project.sprite.set_pixels(data['pixels'])
+    frames = data.get('frames', [])[1:]
+    for i, pixels in enumerate(frames):
+        _report(progress, 0.5 + 0.5 * i / len(frames))
+        project.new_frame().set_pixels(pixels)
+    return project
+
+
+def _load_binary(content, progress=None):
+    if len(content) < BINARY_HEADER.size:
+        raise ValueError("truncated project file")
+    _, version, flags, mode, width, height, btn1, btn2, bg, ncolors = BINARY_HEADER.unpack_from(content)
+    if version > BINARY_VERSION:
+        raise ValueError(f"unsupported project version {version}")
+    pos = BINARY_HEADER.size
+    transparent = NO_TRANSPARENT
+    if version >= 2:
+        if len(content) <= pos:
+            raise ValueError("truncated project file")
+        transparent = content[pos]
+        pos = pos + 1
+    nframes = 1
+    if version >= 3:
+        if len(content) < pos + FRAMES_FIELD.size:
+            raise ValueError("truncated project file")
+        nframes, = FRAMES_FIELD.unpack_from(content, pos)
+        pos = pos + FRAMES_FIELD.size
+    palette = content[pos:pos + ncolors]
+    data = content[pos + ncolors:]
+    if flags & FLAG_ZLIB:
+        data = zlib.decompress(data)
+    size = width * height
+    count = size * nframes
+    if flags & FLAG_NIBBLES:
+        data = _unpack_nibbles(data, count)
+    if len(data) != count or len(palette) != ncolors:
+        raise ValueError("truncated project file")
+    project = Project(mode, width, height, HEX_COLORS[bg])
+    project.btn1color = HEX_COLORS[btn1]
+    project.btn2color = HEX_COLORS[btn2]
+    if transparent != NO_TRANSPARENT:
+        project.transparent = HEX_COLORS[transparent]
+    table = bytes(palette) + bytes(256 - ncolors)
+    data = bytes(data).translate(table)
+    for frame in range(nframes):
+        _report(progress, 0.5 + 0.5 * frame / nframes)
+        sprite = project.sprite if frame == 0 else project.new_frame()
+        sprite.pixels[:] = array('B', data[frame * size:(frame + 1) * size])
+    return project
+
+
+def load_project(filename, progress=None):
+    """
+    Loads a binary or JSON project. progress, if given, is called with the
+    fraction (0 to 1) loaded; it can raise an exception to stop loading.
+    """
+    _report(progress, 0.0)
+    with open(filename, 'rb') as fd:
+        content = fd.read()
+    _report(progress, 0.5)
+    if content[0:len(BINARY_MAGIC)] == BINARY_MAGIC:
+        return _load_binary(content, progress)
+    # old projects were saved as JSON
+    return _load_json(content.decode('utf-8'), progress)
+
+
+def save_project_json(filename, project):
+    data = {}
+    data['mode'] = project.mode
+    data['width'] = project.width
+    data['height'] = project.height
+    data['btn1color'] = project.btn1color
+    data['btn2color'] = project.btn2color
+    data['bgcolor'] = project.bgcolor
+    if project.transparent is not None:
+        data['transparent'] = project.transparent
+    data['pixels'] = project.sprite.get_pixels()
+    if len(project.frames) > 1:
+        data['frames'] = [sprite.get_pixels() for sprite in project.frames]
+    with atomic_open(filename) as fd:
+        fd.write(json.dumps(data))
+
+
+def save_project(filename, project, compress=True, progress=None):
+    """
+    Saves the project in binary format, replacing filename only once it is
+    complete. progress works as in load_project.
+    """
+    frames = []
+    for i, sprite in enumerate(project.frames):
+        _report(progress, 0.4 * i / len(project.frames))
+        frames.append(sprite.pixels.tobytes())
+    pixels = b''.join(frames)
+    palette = bytes([i for i in range(len(HEX_COLORS)) if pixels.find(i) != -1])
+    table = bytearray(256)
+    for entry, index in enumerate(palette):
+        table[index] = entry
+    data = pixels.translate(table)
+    flags = 0
+    if len(palette) <= 16:
+        data = _pack_nibbles(data)
+        flags = flags | FLAG_NIBBLES
+    if compress:
+        _report(progress, 0.5)
+        packed = zlib.compress(data, 6)
+        if len(packed) < len(data):
+            data = packed
+            flags = flags | FLAG_ZLIB
+    header = BINARY_HEADER.pack(
+        BINARY_MAGIC, BINARY_VERSION, flags, project.mode, project.width, project.height,
+        HEX2INDEX[project.btn1color], HEX2INDEX[project.btn2color], HEX2INDEX[project.bgcolor],
+        len(palette)
+    )
+    transparent = NO_TRANSPARENT
+    if project.transparent is not None:
+        transparent = HEX2INDEX[project.transparent]
+    _report(progress, 0.9)
+    with atomic_open(filename, 'wb') as fd:
+        fd.write(header)
+        fd.write(bytes([transparent]))
+        fd.write(FRAMES_FIELD.pack(len(project.frames)))
+        fd.write(palette)
+        fd.write(data)
@@ -0,0 +1,214 @@
+#!/usr/bin/env python
+
+"""
+SPRITE.PY by Javier Garcia
+
+Document model used by the editor. The image is kept as a compact array of CPC
+firmware colour indices (0-26, same order as CPC_RGB_COLORS) so every operation
+runs at memory speed. Views (like PixelGrid) only read from it and redraw the
+cells reported as dirty.
+"""
+
+from array import array
+from imgconv import CPC_RGB_COLORS
+
+# Hex representation ("#RRGGBB") of each CPC colour and its reverse lookup
+HEX_COLORS = [f'#{rgb[0]:02X}{rgb[1]:02X}{rgb[2]:02X}' for rgb in CPC_RGB_COLORS]
+HEX2INDEX = {hexcol: i for i, hexcol in enumerate(HEX_COLORS)}
+
+
+def line_cells(x0, y0, x1, y1):
+    """ Yields the cells of the Bresenham line from (x0, y0) to (x1, y1), both included """
+    dx = abs(x1 - x0)
+    dy = -abs(y1 - y0)
+    sx = 1 if x0 < x1 else -1
+    sy = 1 if y0 < y1 else -1
+    err = dx + dy
+    while True:
+        yield x0, y0
+        if x0 == x1 and y0 == y1:
+            return
+        e2 = 2 * err
+        if e2 >= dy:
+            err = err + dy
+            x0 = x0 + sx
+        if e2 <= dx:
+            err = err + dx
+            y0 = y0 + sy
+
+
+class Sprite:
+    def __init__(self, mode, width, height, bgindex=0):
+        self.mode = mode
+        self.width = width
+        self.height = height
+        self.pixels = array('B', [bgindex]) * (width * height)
+        self.dirty = set()
+        self.dirty_all = True
+        # object with a record(offset, old, new) method (see history.History)
+        self.recorder = None
+
+    def offset(self, x, y):
+        return y * self.width + x
+
+    def inside(self, x, y):
+        return x > -1 and x < self.width and y > -1 and y < self.height
+
+    def get(self, x, y):
+        return self.pixels[y * self.width + x]
+
+    def set(self, x, y, index):
+        """ Returns True if the cell really changed """
+        offset = y * self.width + x
+        old = self.pixels[offset]
+        if old == index:
+            return False
+        self.pixels[offset] = index
+        self.dirty.add(offset)
+        if self.recorder is not None:
+            self.recorder.record(offset, old, index)
+        return True
+
+    def get_hex(self, x, y):
+        return HEX_COLORS[self.get(x, y)]
+
+    def set_hex(self, x, y, hexcol):
+        return self.set(x, y, HEX2INDEX[hexcol])
+
+    def mark_all(self):
+        self.dirty.clear()
+        self.dirty_all = True
+
+    def take_dirty(self):
+        """
+        Returns the set of dirty offsets and clears it. None means that
+        the whole image must be redrawn.
+        """
+        if self.dirty_all:
+            self.dirty_all = False
+            self.dirty.clear()
+            return None
+        dirty = self.dirty
+        self.dirty = set()
+        return dirty
+
+    def apply(self, offsets, values):
+        """ Writes the values in the given offsets without recording them """
+        for offset, index in zip(offsets, values):
+            self.pixels[offset] = index
+            self.dirty.add(offset)
+
+    def clear(self, index):
+        self.pixels = array('B', [index]) * (self.width * self.height)
+        self.mark_all()
+
+    def replace(self, oldindex, newindex):
+        if oldindex == newindex:
+            return
+        data = self.pixels.tobytes()
+        pos = data.find(oldindex)
+        while pos != -1:
+            self.pixels[pos] = newindex
+            self.dirty.add(pos)
+            if self.recorder is not None:
+                self.recorder.record(pos, oldindex, newindex)
+            pos = data.find(oldindex, pos + 1)
+
+    def flood_fill(self, x, y, index, diagonal=True):
+        """
+        Scanline fill of the area connected to (x, y) that shares its colour.
+        With diagonal set, cells touching only by a corner are connected too
+        (8-connected), otherwise only horizontal/vertical neighbours (4-connected).
+        Returns the number of changed cells.
+        """
+        w, h = self.width, self.height
+        pixels = self.pixels
+        target = pixels[y * w + x]
+        if target == index:
+            return 0
+        visited = bytearray(w * h)
+        spans = []
+        stack = [(x, y)]
+        while len(stack) > 0:
+            x, y = stack.pop()
+            row = y * w
+            if visited[row + x] or pixels[row + x] != target:
+                continue
+            left = x
+            while left > 0 and pixels[row + left - 1] == target and not visited[row + left - 1]:
+                left = left - 1
+            right = x
+            while right < w - 1 and pixels[row + right + 1] == target and not visited[row + right + 1]:
+                right = right + 1
+            visited[row + left:row + right + 1] = b'\x01' * (right - left + 1)
+            spans.append((row + left, row + right + 1))
+            # look for new spans in the rows above and below
+            lo = max(0, left - 1) if diagonal else left
+            hi = min(w - 1, right + 1) if diagonal else right
+            for ny in (y - 1, y + 1):
+                if ny < 0 or ny >= h:
+                    continue
+                nrow = ny * w
+                nx = lo
+                while nx <= hi:
+                    if not visited[nrow + nx] and pixels[nrow + nx] == target:
+                        stack.append((nx, ny))
+                        # one seed is enough for each run of matching cells
+                        while nx <= hi and pixels[nrow + nx] == target:
+                            nx = nx + 1
+                    nx = nx + 1
+        count = 0
+        for start, end in spans:
+            pixels[start:end] = array('B', [index]) * (end - start)
+            for offset in range(start, end):
+                self.dirty.add(offset)
+                if self.recorder is not None:
+                    self.recorder.record(offset, target, index)
+            count = count + end - start
+        return count
+
+    def _record_all(self, before):
+        if self.recorder is not None:
+            self.recorder.record_diff(before, self.pixels)
+
+    def mirror_vert(self):
+        """ Mirrors the image around the vertical axis (x becomes width-1-x) """
+        w = self.width
+        before = array('B', self.pixels)
+        for offset in range(0, len(self.pixels), w):
+            row = self.pixels[offset:offset + w]
+            row.reverse()
+            self.pixels[offset:offset + w] = row
+        self._record_all(before)
+        self.mark_all()
+
+    def mirror_hor(self):
+        """ Mirrors the image around the horizontal axis (y becomes height-1-y) """
+        w = self.width
+        before = self.pixels
+        rows = [self.pixels[offset:offset + w] for offset in range(0, len(self.pixels), w)]
+        rows.reverse()
+        self.pixels = array('B')
+        for row in rows:
+            self.pixels.extend(row)
+        self._record_all(before)
+        self.mark_all()
+
+    def get_pixels(self):
+        """ Returns the image as a list of ((x, y), "#RRGGBB") tuples """
+        pixels = []
+        w = self.width
+        for offset, index in enumerate(self.pixels):
+            pixels.append(((offset % w, offset // w), HEX_COLORS[index]))
+        return pixels
+
+    def set_pixels(self, pixels):
+        for (x, y), color in pixels:
+            if self.inside(x, y):
+                self.set_hex(x, y, color)
+
+    def copy(self):
+        """ Returns a new Sprite with the same pixels (the history is not shared) """
+        sprite = Sprite(self.mode, self.width, self.height)
+        sprite.pixels[:] = self.pixels
+        return sprite
@@ -0,0 +1,92 @@
+#!/usr/bin/env python
+
+"""
+TILESET.PY by Javier Garcia
+
+Cuts packed CPC images (as returned by pack_pixels) into tiles and keeps only
+the different ones. Every tile is looked up by its bytes in a dictionary, so
+the whole image is processed in linear time. When flips are enabled, the
+mirrored versions of each new tile are added to the dictionary too, and a tile
+equal to a mirrored one is stored as a reference plus flags:
+
+FLIP_H  the tile must be drawn mirrored horizontally
+FLIP_V  the tile must be drawn mirrored vertically
+"""
+
+FLIP_H = 0x01
+FLIP_V = 0x02
+
+
+class Tileset:
+    """
+    Splits data (packed image of rowbytes x height) in tiles of tilew bytes
+    by tileh lines. Tiles at the right and bottom edges are padded with zeros.
+    After build(), tiles holds the bytes of each different tile and tilemap
+    the (index, flags) of each tile of the image, row after row. mirror is
+    the translation table that reverses the pixels of a video byte (see
+    imgconv.MIRROR_TABLES), needed for flips.
+    """
+    def __init__(self, tilew, tileh, flips=False, mirror=None):
+        self.mirror = mirror
+        self.tilew = tilew
+        self.tileh = tileh
+        self.flips = flips
+        self.tiles = []
+        self.tilemap = []
+        self.cols = 0
+        self.rows = 0
+        self.mirrored = 0
+
+    def _flip_h(self, tile):
+        rows = [tile[y * self.tilew:(y + 1) * self.tilew] for y in range(self.tileh)]
+        return b''.join(row[::-1] for row in rows).translate(self.mirror)
+
+    def _flip_v(self, tile):
+        rows = [tile[y * self.tilew:(y + 1) * self.tilew] for y in range(self.tileh)]
+        return b''.join(reversed(rows))
+
+    def build(self, data, rowbytes, height):
+        tw, th = self.tilew, self.tileh
+        self.cols = (rowbytes + tw - 1) // tw
+        self.rows = (height + th - 1) // th
+        # pad the image so it is made of whole tiles
+        width = self.cols * tw
+        lines = [bytes(data[y * rowbytes:(y + 1) * rowbytes]).ljust(width, b'\x00') for y in range(height)]
+        lines.extend([bytes(width)] * (self.rows * th - height))
+        known = {}   # tile bytes -> (index, flags)
+        self.tiles = []
+        self.tilemap = []
+        self.mirrored = 0
+        for row in range(self.rows):
+            band = lines[row * th:(row + 1) * th]
+            for col in range(self.cols):
+                tile = b''.join(line[col * tw:(col + 1) * tw] for line in band)
+                entry = known.get(tile)
+                if entry is None:
+                    entry = (len(self.tiles), 0)
+                    self.tiles.append(tile)
+                    known[tile] = entry
+                    if self.flips:
+                        hflip = self._flip_h(tile)
+                        variants = ((hflip, FLIP_H), (self._flip_v(tile), FLIP_V), (self._flip_v(hflip), FLIP_H | FLIP_V))
+                        for variant, flags in variants:
+                            known.setdefault(variant, (entry[0], flags))
+                elif entry[1] != 0:
+                    self.mirrored = self.mirrored + 1
+                self.tilemap.append(entry)
+
+    def tile_bytes(self):
+        return self.tilew * self.tileh
+
+    def map_bytes(self):
+        """ Tile indexes, one byte each or little-endian words when there are more than 256 tiles """
+        if len(self.tiles) <= 256:
+            return bytes(index for index, _ in self.tilemap)
+        return b''.join(index.to_bytes(2, 'little') for index, _ in self.tilemap)
+
+    def flag_bytes(self):
+        return bytes(flags for _, flags in self.tilemap)
+
+    def report(self):
+        return (f"{len(self.tilemap)} tiles -> {len(self.tiles)} unique ({self.mirrored} mirrored), "
+                f"{len(self.tiles) * self.tile_bytes()} + {len(self.map_bytes())} bytes")
@@ -14,6 +14,8 @@ class ToolFrame(tk.LabelFrame):
         self.color2 = '#FFFFFF'
         self.bgcolor = '#FFFFFF'
         self.selected = tk.StringVar(master=self, value='Draw')
+        self.transparent = tk.BooleanVar(master=self, value=False)
+        self.transparent_color = self.bgcolor
         self.tools=[]
 
     def _create_colorview(self, text, row, col, defcolor, defsize=40):
@@ -49,6 +51,8 @@ class ToolFrame(tk.LabelFrame):
         self.colorbtn1 = self._create_colorview('Button1 Color', 4, 0, self.color1)
         self.colorbtn2 = self._create_colorview('Button2 Color', 5, 0, self.color2)
         self.bgcolorbtn = self._create_colorview('Erase Color', 6, 0, self.bgcolor)
+        transparent = tk.Checkbutton(self, text='Transparent', variable=self.transparent)
+        transparent.grid(row=7, column=0, sticky='w')
 
     def draw_color(self, button, color):
         if button == 0:
@@ -60,8 +64,21 @@ class ToolFrame(tk.LabelFrame):
 
     def erase_color(self, color):
         self.bgcolor = color
+        self.transparent_color = color
         self.bgcolorbtn.configure(background=color)
 
+    def get_transparent(self):
+        """
+        Colour exported as transparent when the option is set: the erase color,
+        or the one of the opened project if it was saved with another one
+        """
+        return self.transparent_color if self.transparent.get() else None
+
+    def set_transparent(self, color):
+        if color is not None:
+            self.transparent_color = color
+        self.transparent.set(color is not None)
+
     def get_currentcolors(self):
         return (self.color1, self.color2)
     
\ No newline at end of file